@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import config
+from metrics import Metrics
+from media_probe import ProbeCache
+from segment_plan import compile_plan
+
+
+def load_manifest(manifest_path):
+    """
+    Load a batch manifest.
+
+    The manifest is either a list of jobs or an object with "jobs" and
+    optional "defaults" (configuration overrides applied to every job).
+    Each job needs "audio", "timestamps" and "output", and may set "name",
+    "output_dir" and "config" (configuration overrides for that job only).
+
+    Returns:
+        tuple: (list of job dictionaries, dictionary of default overrides)
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid manifest JSON: {str(e)}")
+
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data.get('defaults', {})
+        data = data.get('jobs')
+    if not isinstance(data, list) or not data:
+        raise ValueError("Manifest must be a non-empty list of jobs or an object with a \"jobs\" list")
+
+    jobs = []
+    names = set()
+    outputs = set()
+    for i, job in enumerate(data):
+        if not all(k in job for k in ['audio', 'timestamps', 'output']):
+            raise ValueError(f"Job {i} is missing required fields (audio, timestamps, output)")
+        name = job.get('name') or os.path.splitext(os.path.basename(job['output']))[0]
+        if name in names:
+            raise ValueError(f"Duplicate job name: {name}")
+        # Chunk renders keep their intermediates per output file name
+        if os.path.basename(job['output']) in outputs:
+            raise ValueError(f"Duplicate output file name: {job['output']}")
+        names.add(name)
+        outputs.add(os.path.basename(job['output']))
+        jobs.append(dict(job, name=name))
+    return jobs, defaults
+
+
+class BatchRunner:
+    def __init__(self, config, max_jobs=2, threads_per_encode=None, metrics=None):
+        """
+        Render many episodes in one process, sharing warm caches between them.
+
+        All jobs use one cache directory, so normalized loop tiles, cached
+        chunk renders and memory-mapped loops are reused across episodes.
+        Probe metadata and decoded loops are shared in memory as well.
+
+        Args:
+            config: Base configuration, overridden per job by the manifest
+            max_jobs: Maximum number of episodes rendered at the same time
+            threads_per_encode: Encoder threads per job (overrides THREADS)
+            metrics: Optional Metrics; every event is tagged with its job name
+        """
+        self.config = config
+        self.max_jobs = max(1, max_jobs)
+        self.threads_per_encode = threads_per_encode
+        self.metrics = metrics or Metrics()
+        self.cache_dir = config.get('CACHE_DIR') or os.path.join(config['OUTPUT_DIR'], '.cache')
+        self.probe_cache = ProbeCache(os.path.join(self.cache_dir, 'media_probe.json'))
+        self.logger = logging.getLogger(__name__)
+
+        # Decoded loops shared by all jobs, one cache per output frame rate and budget
+        self.frame_caches = {}
+        self._frame_caches_lock = threading.Lock()
+
+    def frame_cache(self, fps, budget_mb):
+        """
+        Return the shared cache of loops decoded at fps, creating it on first use.
+
+        Loops are decoded at the output frame rate, so jobs rendering at
+        different rates cannot share frames. Jobs that override
+        FRAME_CACHE_MB in the manifest get a cache with their own budget,
+        shared with the other jobs using the same rate and budget.
+
+        Args:
+            fps: Output frame rate of the job
+            budget_mb: FRAME_CACHE_MB of the job
+
+        Returns:
+            LoopFrameCache: The cache, or None when budget_mb is 0
+        """
+        if int(budget_mb) <= 0:
+            return None
+        from frame_cache import LoopFrameCache
+
+        key = (fps, int(budget_mb))
+        with self._frame_caches_lock:
+            if key not in self.frame_caches:
+                self.frame_caches[key] = LoopFrameCache(
+                    int(budget_mb) * 1024 * 1024,
+                    fps,
+                    mmap_dir=os.path.join(self.cache_dir, 'frames'),
+                    mmap_threshold_bytes=int(self.config.get('FRAME_CACHE_MMAP_MB', 256)) * 1024 * 1024,
+                    probe=self.probe_cache.probe
+                )
+            return self.frame_caches[key]
+
+    def job_config(self, job, defaults=None):
+        """Build the configuration of one job."""
+        job_config = dict(self.config)
+        job_config.update(defaults or {})
+        job_config.update(job.get('config', {}))
+        job_config.update({
+            'AUDIO_FILE': job['audio'],
+            'TIMESTAMPS_FILE': job['timestamps'],
+            'OUTPUT_DIR': job.get('output_dir') or job_config['OUTPUT_DIR'],
+            'CACHE_DIR': self.cache_dir,
+        })
+        if self.threads_per_encode:
+            job_config['THREADS'] = self.threads_per_encode
+        os.makedirs(job_config['OUTPUT_DIR'], exist_ok=True)
+        return job_config
+
+    def schedule(self, jobs):
+        """
+        Order jobs longest episode first, so the longest renders do not start last.
+
+        Jobs whose audio cannot be probed keep their manifest order at the end
+        and fail with a proper error when they run.
+        """
+        def episode_duration(job):
+            try:
+                return self.probe_cache.duration(job['audio'])
+            except Exception:
+                return -1.0
+
+        durations = {job['name']: episode_duration(job) for job in jobs}
+        self.probe_cache.save()
+        return sorted(jobs, key=lambda job: -durations[job['name']])
+
+    def run_job(self, job, defaults=None):
+        """
+        Render one job and return its result.
+
+        Returns:
+            dict: Status, output path, timings and error of the job
+        """
+        from video_editor import VideoEditor
+
+        result = {'name': job['name'], 'audio': job['audio'], 'timestamps': job['timestamps'], 'status': 'error'}
+        started = time.time()
+        editor = None
+        try:
+            job_config = self.job_config(job, defaults)
+            plan = compile_plan(job_config['TIMESTAMPS_FILE'], job_config.get('CHARACTER_MAPPING'))
+            editor = VideoEditor(
+                job_config, metrics=self.metrics.for_job(job['name']), plan=plan,
+                probe_cache=self.probe_cache, frame_cache=self.frame_cache(
+                    job_config.get('VIDEO_FPS', 30), job_config.get('FRAME_CACHE_MB', 0)
+                )
+            )
+            output_path = editor.create_final_video(job['output'])
+            output_paths = output_path if isinstance(output_path, list) else [output_path]
+            result.update({
+                'status': 'ok',
+                'output': output_path,
+                'output_size_bytes': sum(os.path.getsize(path) for path in output_paths),
+                'episode_duration': editor.audio_duration,
+            })
+        except Exception as e:
+            self.logger.error(f"Job {job['name']} failed: {str(e)}")
+            result['error'] = str(e)
+        finally:
+            result['wall_time'] = round(time.time() - started, 3)
+            if editor is not None:
+                result['stage_timings'] = editor.stage_timings
+                if result['status'] == 'ok' and result['wall_time']:
+                    result['realtime_factor'] = round(editor.audio_duration / result['wall_time'], 3)
+        return result
+
+    def run(self, jobs, defaults=None):
+        """
+        Render all jobs with at most max_jobs running concurrently.
+
+        Returns:
+            dict: Summary report with one result per job, in manifest order
+        """
+        started = time.time()
+        order = {job['name']: i for i, job in enumerate(jobs)}
+        results = []
+        self.logger.info(f"Rendering {len(jobs)} jobs, {self.max_jobs} at a time")
+        self.metrics.emit('batch_start', jobs=len(jobs), max_jobs=self.max_jobs)
+
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+            futures = [executor.submit(self.run_job, job, defaults) for job in self.schedule(jobs)]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                self.logger.info(f"Job {result['name']}: {result['status']} ({len(results)}/{len(jobs)})")
+                self.metrics.progress('batch', len(results), len(jobs), unit='jobs')
+
+        results.sort(key=lambda r: order[r['name']])
+        summary = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'wall_time': round(time.time() - started, 3),
+            'max_jobs': self.max_jobs,
+            'threads_per_encode': self.threads_per_encode,
+            'succeeded': sum(1 for r in results if r['status'] == 'ok'),
+            'failed': sum(1 for r in results if r['status'] != 'ok'),
+            'jobs': results,
+        }
+        if self.frame_caches:
+            caches = list(self.frame_caches.values())
+            summary['frame_cache'] = {'hits': sum(c.hits for c in caches), 'misses': sum(c.misses for c in caches)}
+            for cache in caches:
+                cache.clear()
+        self.metrics.emit('batch_end', succeeded=summary['succeeded'], failed=summary['failed'],
+                          duration=summary['wall_time'])
+        return summary
+
+
+def main():
+    """Render every job of a manifest and write the summary report."""
+    parser = argparse.ArgumentParser(description='Render a batch of podcast episodes with shared caches')
+    parser.add_argument('manifest', help='JSON manifest of jobs (audio, timestamps, output)')
+    parser.add_argument('--max-jobs', type=int, default=2, help='Maximum number of episodes rendered at the same time')
+    parser.add_argument('--threads-per-encode', type=int, help='Encoder threads per job (overrides THREADS)')
+    parser.add_argument('--output-dir', help='Default directory for output files')
+    parser.add_argument('--frame-cache-mb', type=int,
+                        help='Memory budget for decoded character loops shared by all jobs')
+    parser.add_argument('--encoder', choices=['moviepy', 'pipe'], help='Encoder backend for every job')
+    parser.add_argument('--preset', help='Encoding preset for every job')
+    parser.add_argument('--report', help='Write the JSON summary report to this file instead of stdout')
+    parser.add_argument('--metrics', help='Write timing spans and progress of every job as JSON lines to this file')
+    args = parser.parse_args()
+
+    batch_config = dict(config)
+    if args.output_dir:
+        batch_config['OUTPUT_DIR'] = args.output_dir
+    if args.frame_cache_mb is not None:
+        batch_config['FRAME_CACHE_MB'] = args.frame_cache_mb
+    if args.encoder:
+        batch_config['ENCODER_BACKEND'] = args.encoder
+    if args.preset:
+        batch_config['ENCODING_PRESET'] = args.preset
+    os.makedirs(batch_config['OUTPUT_DIR'], exist_ok=True)
+
+    log_file = os.path.join(batch_config['OUTPUT_DIR'], f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+    logging.basicConfig(
+        level=getattr(logging, batch_config['LOG_LEVEL']),
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.FileHandler(log_file), logging.StreamHandler(sys.stderr)]
+    )
+
+    jobs, defaults = load_manifest(args.manifest)
+    metrics = Metrics(args.metrics or batch_config.get('METRICS_FILE'))
+    try:
+        runner = BatchRunner(batch_config, args.max_jobs, args.threads_per_encode, metrics=metrics)
+        summary = runner.run(jobs, defaults)
+    finally:
+        metrics.close()
+
+    output = json.dumps(summary, indent=2, ensure_ascii=False)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import subprocess
+import threading
+from datetime import datetime
+
+from config import config
+from ffmpeg_utils import run_ffmpeg
+
+# Render modes the benchmark knows about, as overrides of the configuration
+RENDER_MODES = {
+    'compose': {},
+    'compose-mux': {'AUDIO_MODE': 'mux'},
+    'pipe': {'ENCODER_BACKEND': 'pipe'},
+    'pipe-framecache': {'ENCODER_BACKEND': 'pipe', 'FRAME_CACHE_MB': 2048},
+    'tiles': {'RENDER_MODE': 'tiles'},
+    'chunks': {'WORKERS': os.cpu_count() or 2, 'ENCODER_BACKEND': 'pipe'},
+    'renditions': {
+        'FRAME_CACHE_MB': 2048,
+        'RENDITIONS': [
+            {'name': 'full', 'width': 1280, 'height': 720},
+            {'name': 'small', 'width': 640, 'height': 360},
+            {'name': 'vertical', 'width': 406, 'height': 720, 'fit': 'crop'},
+        ],
+    },
+    # Compare encode_ms_per_frame with 'pipe' for the cost of drawing the bars
+    'pipe-visualizer': {'ENCODER_BACKEND': 'pipe', 'VISUALIZER': 'spectrum'},
+    # Burns in the benchmark dialogue, which wraps to two lines, through the caption atlas
+    'pipe-subtitles': {'ENCODER_BACKEND': 'pipe', 'SUBTITLES': 'burn'},
+    # Compare encode_ms_per_frame with 'pipe' for the cost of compositing every character
+    'stage': {'ENCODER_BACKEND': 'pipe', 'STAGE_LAYOUT': {'size': [1280, 720]}},
+}
+
+
+def character_name(index):
+    """Fixed-width names, so no name is a substring of another."""
+    return f"Speaker {index:02d}"
+
+
+def generate_inputs(work_dir, args):
+    """
+    Create synthetic character loops, an audio file and a timestamps script.
+
+    The same arguments always produce the same inputs, so results are
+    comparable across commits.
+
+    Returns:
+        dict: Paths of the generated files and the character mapping
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    width, height = args.resolution.split('x')
+
+    mapping = {}
+    for i in range(args.characters):
+        video_path = os.path.join(work_dir, f"character_{i:02d}.mov")
+        if not os.path.exists(video_path):
+            run_ffmpeg([
+                '-f', 'lavfi', '-i',
+                f"testsrc2=size={width}x{height}:rate={args.source_fps}:duration={args.loop_seconds},"
+                f"hue=h={i * 360 / max(1, args.characters)}",
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', video_path
+            ])
+        mapping[character_name(i)] = video_path
+
+    audio_path = os.path.join(work_dir, f"podcast_{args.audio_seconds}s.wav")
+    if not os.path.exists(audio_path):
+        run_ffmpeg([
+            '-f', 'lavfi', '-i', f"sine=frequency=220:sample_rate=44100:duration={args.audio_seconds}",
+            '-c:a', 'pcm_s16le', audio_path
+        ])
+
+    # Seeded segment boundaries: whole seconds for TXT scripts, sub-second for JSON
+    rng = random.Random(args.seed)
+    resolution = 1.0 if args.format == 'txt' else 0.1
+    slots = int(args.audio_seconds / resolution)
+    count = max(1, min(args.segments, slots))
+    boundaries = sorted(rng.sample(range(1, slots), count - 1)) if count > 1 else []
+    starts = [0.0] + [b * resolution for b in boundaries]
+    speakers = [rng.randrange(args.characters) for _ in starts]
+
+    # Long enough to wrap to two caption lines at any resolution
+    dialogue = "Benchmark line that is long enough to wrap onto a second caption line when burned in."
+
+    timestamps_path = os.path.join(work_dir, f"timestamps_{count}.{args.format}")
+    if args.format == 'txt':
+        with open(timestamps_path, 'w', encoding='utf-8') as f:
+            for start, speaker in zip(starts, speakers):
+                minutes, seconds = divmod(int(start), 60)
+                f.write(f"{minutes:02d}:{seconds:02d} {character_name(speaker)}\n{dialogue}\n\n")
+    else:
+        ends = starts[1:] + ['end']
+        data = [
+            {'video': mapping[character_name(speaker)], 'start': round(start, 3), 'end': end, 'text': dialogue}
+            for start, end, speaker in zip(starts, ends, speakers)
+        ]
+        with open(timestamps_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+    return {
+        'audio': audio_path,
+        'timestamps': timestamps_path,
+        'character_mapping': mapping,
+        'segments': count,
+    }
+
+
+class ProcessSampler(threading.Thread):
+    """Samples the number of running ffmpeg descendants of this process (Linux only)."""
+
+    def __init__(self, interval=0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_ffmpeg = 0
+        self.supported = os.path.isdir('/proc')
+        self._stop_event = threading.Event()
+
+    def _count_ffmpeg(self):
+        parents = {}
+        names = {}
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/stat", 'r') as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # The command name is in parentheses and may contain spaces
+            name = stat[stat.index('(') + 1:stat.rindex(')')]
+            fields = stat[stat.rindex(')') + 2:].split()
+            parents[int(pid)] = int(fields[1])
+            names[int(pid)] = name
+
+        me = os.getpid()
+        count = 0
+        for pid, name in names.items():
+            if 'ffmpeg' not in name:
+                continue
+            parent = parents.get(pid)
+            while parent and parent != me:
+                parent = parents.get(parent)
+            if parent == me:
+                count += 1
+        return count
+
+    def run(self):
+        if not self.supported:
+            return
+        while not self._stop_event.is_set():
+            self.peak_ffmpeg = max(self.peak_ffmpeg, self._count_ffmpeg())
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_one(spec):
+    """
+    Render one mode in this process and return its measurements.
+
+    Called in a fresh child process per mode, so peak RSS is not shared
+    between modes.
+    """
+    from video_editor import VideoEditor
+
+    run_config = dict(config)
+    run_config.update(spec['config'])
+
+    sampler = ProcessSampler()
+    sampler.start()
+    started = time.time()
+    editor = VideoEditor(run_config)
+    episode_duration = editor.audio_duration
+    try:
+        output_path = editor.create_final_video(spec['output_filename'])
+    finally:
+        editor.close()
+    output_paths = output_path if isinstance(output_path, list) else [output_path]
+    wall_time = time.time() - started
+    sampler.stop()
+    total_frames = int(round(episode_duration * run_config.get('VIDEO_FPS', 30)))
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'wall_time': wall_time,
+        'episode_duration': episode_duration,
+        'realtime_factor': episode_duration / wall_time if wall_time else None,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': self_usage.ru_maxrss / 1024,
+        'peak_child_rss_mb': child_usage.ru_maxrss / 1024,
+        'peak_ffmpeg_processes': sampler.peak_ffmpeg if sampler.supported else None,
+        'stage_timings': editor.stage_timings,
+        # Frame production and encoding together, per output frame
+        'encode_ms_per_frame': 1000 * editor.stage_timings['encode'] / total_frames
+        if total_frames and 'encode' in editor.stage_timings else None,
+        'output_size_bytes': sum(os.path.getsize(path) for path in output_paths),
+    }
+
+
+def git_revision():
+    """Return the current git commit, if available."""
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare wall times with a baseline report.
+
+    Returns:
+        list: Descriptions of the modes that got slower than the threshold allows
+    """
+    regressions = []
+    previous = {r['mode']: r for r in baseline.get('results', []) if 'wall_time' in r}
+    for result in results:
+        before = previous.get(result['mode'])
+        if before is None or 'wall_time' not in result:
+            continue
+        change = result['wall_time'] / before['wall_time'] - 1
+        result['change_vs_baseline'] = change
+        if change > threshold:
+            regressions.append(
+                f"{result['mode']}: {before['wall_time']:.2f}s -> {result['wall_time']:.2f}s ({change:+.0%})"
+            )
+    return regressions
+
+
+def main():
+    """Generate synthetic inputs, render them in every requested mode and report the results."""
+    parser = argparse.ArgumentParser(description='Render benchmark with synthetic podcasts')
+    parser.add_argument('--characters', type=int, default=2, help='Number of character loops')
+    parser.add_argument('--loop-seconds', type=float, default=3.0, help='Length of each character loop')
+    parser.add_argument('--resolution', default='1280x720', help='Loop resolution, WIDTHxHEIGHT')
+    parser.add_argument('--source-fps', type=int, default=30, help='Frame rate of the generated loops')
+    parser.add_argument('--audio-seconds', type=int, default=120, help='Episode length in seconds')
+    parser.add_argument('--segments', type=int, default=40, help='Number of segments in the script')
+    parser.add_argument('--format', choices=['txt', 'json'], default='json', help='Timestamps script format')
+    parser.add_argument('--modes', default='compose,pipe,tiles',
+                        help=f"Comma separated render modes ({', '.join(RENDER_MODES)})")
+    parser.add_argument('--preset', help='Encoding preset for every mode')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the segment layout')
+    parser.add_argument('--work-dir', default=os.path.join('output', 'benchmark'),
+                        help='Directory for generated inputs and renders')
+    parser.add_argument('--report', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='Earlier report to compare wall times with')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative slowdown vs. the baseline that counts as a regression')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        with open(args.run_one, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+        print(json.dumps(run_one(spec)))
+        return 0
+
+    inputs = generate_inputs(os.path.join(args.work_dir, 'inputs'), args)
+    results = []
+    for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode: {mode}")
+
+        mode_dir = os.path.join(args.work_dir, mode)
+        os.makedirs(mode_dir, exist_ok=True)
+        run_config = {
+            'AUDIO_FILE': inputs['audio'],
+            'TIMESTAMPS_FILE': inputs['timestamps'],
+            'OUTPUT_DIR': mode_dir,
+            'CHARACTER_MAPPING': inputs['character_mapping'],
+            # Fresh caches per run, so every mode pays its full cost
+            'CACHE_DIR': os.path.join(mode_dir, f"cache_{datetime.now().strftime('%Y%m%d_%H%M%S')}"),
+        }
+        if args.preset:
+            run_config['ENCODING_PRESET'] = args.preset
+        run_config.update(RENDER_MODES[mode])
+
+        spec_path = os.path.join(mode_dir, 'spec.json')
+        with open(spec_path, 'w', encoding='utf-8') as f:
+            json.dump({'config': run_config, 'output_filename': 'benchmark.mp4'}, f)
+
+        print(f"Running {mode}...", file=sys.stderr)
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run-one', spec_path],
+            stdout=subprocess.PIPE, text=True
+        )
+        if result.returncode != 0:
+            results.append({'mode': mode, 'error': f"exit code {result.returncode}"})
+            continue
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        measurement['mode'] = mode
+        results.append(measurement)
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'inputs': {
+            'characters': args.characters,
+            'loop_seconds': args.loop_seconds,
+            'resolution': args.resolution,
+            'audio_seconds': args.audio_seconds,
+            'segments': inputs['segments'],
+            'format': args.format,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report['regressions'] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    for line in regressions:
+        print(f"Regression: {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from timeline import Timeline, OverlayStack
+from frame_cache import LoopFrameCache
+from encoders import create_encoder
+from ffmpeg_utils import probe_video, concat_stream_copy, mux_audio, encoding_settings
+from render_cache import RenderCache, file_fingerprint
+from metrics import Metrics
+from stills import load_still
+from subtitles import SubtitleLayer
+from visualizer import VisualizerLayer
+
+ENCODING_KEYS = [
+    'VIDEO_CODEC', 'VIDEO_AUDIO_CODEC', 'ENCODING_PRESET', 'CRF_VALUE', 'THREADS',
+    'X264_TUNE', 'KEYFRAME_INTERVAL', 'ENCODER_BACKEND', 'FORCE_SEGMENT_KEYFRAMES',
+]
+
+# Decoded loops are kept per worker process and reused by all of its chunks,
+# one cache per frame rate and settings. With a single worker, chunks render
+# in the calling process, where several batch or service jobs may share them.
+_worker_frame_caches = {}
+_worker_frame_caches_lock = threading.Lock()
+
+
+def _worker_frame_cache(fps, settings):
+    """Return this process's LoopFrameCache for a frame rate and cache settings."""
+    key = (fps,) + tuple(sorted(settings.items()))
+    with _worker_frame_caches_lock:
+        if key not in _worker_frame_caches:
+            _worker_frame_caches[key] = LoopFrameCache(fps=fps, **settings)
+        return _worker_frame_caches[key]
+
+
+def plan_chunks(timeline, workers):
+    """
+    Split the timeline into contiguous runs of roughly equal length.
+
+    Chunk boundaries always fall on segment boundaries, which are whole
+    output frames, so the chunks can be joined without re-encoding.
+
+    Args:
+        timeline: Timeline of the episode
+        workers: Number of worker processes
+
+    Returns:
+        list: List of (first frame, last frame) ranges
+    """
+    # A few chunks per worker keeps the pool busy when segment lengths vary
+    target = max(1, timeline.total_frames // (workers * 4))
+
+    chunks = []
+    chunk_start = 0
+    for start, frames in zip(timeline.frame_starts.tolist(), timeline.frame_counts.tolist()):
+        if start + frames - chunk_start >= target:
+            chunks.append((chunk_start, start + frames))
+            chunk_start = start + frames
+    if chunk_start < timeline.total_frames:
+        chunks.append((chunk_start, timeline.total_frames))
+    return chunks
+
+
+def render_chunk(job):
+    """
+    Render a slice of the timeline into a video-only chunk file.
+
+    Runs in a worker process, so it opens its own readers and closes them
+    before returning.
+
+    Args:
+        job: Dictionary with the serialized timeline slice, canvas size, output path and settings
+
+    Returns:
+        str: Path to the rendered chunk
+    """
+    from moviepy.editor import VideoFileClip
+
+    timeline = Timeline.from_dict(job['timeline'])
+    sources = {}
+    try:
+        stills = set(job.get('stills', ()))
+        if job.get('frame_cache'):
+            frame_cache = _worker_frame_cache(timeline.fps, job['frame_cache'])
+            bound = {path: frame_cache.get(path) for path in timeline.videos if path not in stills}
+        else:
+            for video_path in timeline.videos:
+                if video_path not in stills:
+                    sources[video_path] = VideoFileClip(video_path)
+            bound = dict(sources)
+        for video_path in stills:
+            bound[video_path] = load_still(video_path, timeline.fps)
+        timeline.bind(bound, job['size'])
+        layers = []
+        if job.get('visualizer'):
+            visualizer = job['visualizer']
+            layers.append(VisualizerLayer(visualizer['levels'], visualizer['fps'], visualizer['style'],
+                                          visualizer['first_frame']))
+        if job.get('subtitles'):
+            layers.append(SubtitleLayer(job['subtitles']['cues'], job['subtitles']['style']))
+        if layers:
+            timeline.overlay = OverlayStack(layers)
+        create_encoder(job['encoding'], progress_logger=None).encode(timeline, job['output'])
+    finally:
+        for clip in sources.values():
+            clip.close()
+
+    return job['output']
+
+
+class ChunkRenderer:
+    def __init__(self, config, cache_dir, workers, render_cache=None, frame_cache_settings=None, metrics=None,
+                 window_seconds=None, probe=None, stills=None, subtitles=None, visualizer=None):
+        """
+        Initialize the ChunkRenderer.
+
+        Args:
+            config: Dictionary containing configuration parameters
+            cache_dir: Directory for intermediate chunk files
+            workers: Number of worker processes
+            render_cache: Optional RenderCache used to reuse previously rendered segments
+            frame_cache_settings: Optional LoopFrameCache arguments; each worker
+                then decodes every loop once and serves frames from memory
+            metrics: Optional Metrics receiving timing spans and progress events
+            window_seconds: Optional fixed window length; chunks are then cut
+                every window_seconds of output regardless of segment boundaries
+            probe: Optional function returning media metadata (e.g. ProbeCache.probe)
+            stills: Optional set of videos rendered from their first frame
+            subtitles: Optional SubtitleLayer burned into the chunks
+            visualizer: Optional VisualizerLayer drawn into the chunks
+        """
+        self.config = config
+        self.stills = set(stills or ())
+        self.subtitles = subtitles
+        self.visualizer = visualizer
+        self.video_fps = config.get('VIDEO_FPS', 30)
+        self.video_audio_codec = config.get('VIDEO_AUDIO_CODEC', 'aac')
+        self.chunk_dir = os.path.join(cache_dir, 'chunks')
+        self.workers = workers
+        self.render_cache = render_cache
+        self.metrics = metrics or Metrics()
+        self.window_seconds = window_seconds
+        self.probe = probe or probe_video
+        self.frame_cache_settings = frame_cache_settings
+        # Plain dictionary of the encoder settings, passed to the worker processes
+        self.encoding = {key: config[key] for key in ENCODING_KEYS if key in config}
+        self.logger = logging.getLogger(__name__)
+
+    def _chunk_key(self, chunk, size, subtitles=None, visualizer=None):
+        """
+        Build the content address of a chunk.
+
+        Chunks are video-only (the audio is muxed once after the join), so
+        the key covers the source videos, loop phases, frame counts, the
+        captions and visualizer levels drawn into the chunk and the encoding
+        parameters.
+        """
+        parts = [self.video_fps, size[0], size[1]] + encoding_settings(self.config)
+        if self.config.get('FORCE_SEGMENT_KEYFRAMES'):
+            parts.append('segment_keyframes')
+        for video_path, phase, frames in chunk.entries():
+            parts += [file_fingerprint(video_path), f"{phase:.6f}", frames]
+            if video_path in self.stills:
+                parts.append('still')
+        if subtitles:
+            parts.append(json.dumps(subtitles, sort_keys=True, ensure_ascii=False))
+        if visualizer:
+            parts += [json.dumps(visualizer['style'], sort_keys=True), visualizer['first_frame'],
+                      hashlib.sha1(visualizer['levels'].tobytes()).hexdigest()]
+        return RenderCache.make_key(*parts)
+
+    def _run_jobs(self, jobs):
+        """
+        Render jobs, in a process pool when more than one worker is configured.
+
+        Every finished chunk is yielded as soon as it is ready, so chunks that
+        completed before a failure are kept in the cache.
+        """
+        if self.workers <= 1:
+            for job in jobs:
+                yield job, render_chunk(job)
+            return
+
+        error = None
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(render_chunk, job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    path = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                yield futures[future], path
+        if error is not None:
+            raise error
+
+    def render(self, segments, audio_file, output_path):
+        """
+        Render chunks, join them with stream copy and mux the audio.
+
+        Args:
+            segments: List of segment dictionaries with video path, start and end times
+            audio_file: Path to the source audio file
+            output_path: Path of the final video
+
+        Returns:
+            str: Path to the created video
+        """
+        timeline = Timeline.from_segments(segments, self.video_fps)
+        if not len(timeline):
+            raise ValueError("No valid segments to process")
+
+        sizes = [self.probe(path)['size'] for path in timeline.videos]
+        size = (max(w for w, _ in sizes), max(h for _, h in sizes))
+
+        work_dir = os.path.join(self.chunk_dir, os.path.splitext(os.path.basename(output_path))[0])
+        os.makedirs(work_dir, exist_ok=True)
+
+        if self.window_seconds:
+            # Fixed windows keep open readers and memory constant for any episode length
+            window_frames = max(1, int(round(self.window_seconds * self.video_fps)))
+            ranges = [(start, min(start + window_frames, timeline.total_frames))
+                      for start in range(0, timeline.total_frames, window_frames)]
+        elif self.render_cache is not None:
+            # One chunk per segment so an edit only invalidates the segments it touches
+            ranges = [(start, start + frames) for start, frames
+                      in zip(timeline.frame_starts.tolist(), timeline.frame_counts.tolist())]
+        else:
+            ranges = plan_chunks(timeline, self.workers)
+
+        chunk_paths = [None] * len(ranges)
+        jobs = []
+        for i, (first_frame, last_frame) in enumerate(ranges):
+            chunk = timeline.slice(first_frame, last_frame)
+            job = {
+                'index': i,
+                'frames': chunk.total_frames,
+                'timeline': chunk.to_dict(),
+                'size': size,
+                'encoding': self.encoding,
+                'output': os.path.join(work_dir, f"chunk_{i:05d}.mp4"),
+                'frame_cache': self.frame_cache_settings,
+                'stills': [path for path in chunk.videos if path in self.stills],
+            }
+            if self.subtitles is not None:
+                # Workers get only the cues of their chunk, relative to its first frame
+                cues = self.subtitles.cues_between(chunk.start_time, chunk.start_time + chunk.duration)
+                if cues:
+                    job['subtitles'] = {'cues': cues, 'style': self.subtitles.style}
+            if self.visualizer is not None:
+                levels, first = self.visualizer.between(first_frame, last_frame)
+                job['visualizer'] = {
+                    'levels': levels, 'first_frame': first,
+                    'fps': self.visualizer.fps, 'style': self.visualizer.style,
+                }
+            if self.render_cache is not None:
+                job['key'] = self._chunk_key(chunk, size, job.get('subtitles'), job.get('visualizer'))
+                chunk_paths[i] = self.render_cache.get(job['key'])
+                if chunk_paths[i] is not None:
+                    continue
+            jobs.append(job)
+
+        self.logger.info(
+            f"Rendering {len(jobs)} of {len(ranges)} chunks with {self.workers} workers "
+            f"({len(ranges) - len(jobs)} reused from cache)"
+        )
+        video_only_path = output_path + '.video.mp4'
+        try:
+            frames_done = timeline.total_frames - sum(job['frames'] for job in jobs)
+            with self.metrics.span('process_segments', chunks=len(jobs), workers=self.workers):
+                for job, path in self._run_jobs(jobs):
+                    if self.render_cache is not None:
+                        path = self.render_cache.put(job['key'], path)
+                    chunk_paths[job['index']] = path
+                    frames_done += job['frames']
+                    self.metrics.emit('chunk_done', chunk=job['index'], frames=job['frames'])
+                    self.metrics.progress('encode', frames_done, timeline.total_frames)
+
+            self.logger.info(f"Joining {len(chunk_paths)} chunks")
+            with self.metrics.span('concatenate', pieces=len(chunk_paths)):
+                concat_stream_copy(chunk_paths, video_only_path)
+            with self.metrics.span('mux'):
+                mux_audio(
+                    video_only_path, audio_file,
+                    [(s['start'], s['end']) for s in segments],
+                    output_path, audio_codec=self.video_audio_codec
+                )
+        finally:
+            for job in jobs:
+                if os.path.exists(job['output']):
+                    os.remove(job['output'])
+            if os.path.exists(video_only_path):
+                os.remove(video_only_path)
+
+        if self.render_cache is not None:
+            self.render_cache.evict(keep=chunk_paths)
+
+        return output_path
@@ -20,9 +20,53 @@ config = {
     'ENCODING_PRESET': os.getenv('ENCODING_PRESET', 'medium'),  # Options: ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow
     'CRF_VALUE': os.getenv('CRF_VALUE', '23'),  # Constant Rate Factor (0-51, lower means better quality)
     'THREADS': int(os.getenv('THREADS', 4)),  # Number of threads to use for encoding
+    'X264_TUNE': os.getenv('X264_TUNE'),  # Optional x264 tune, e.g. animation, stillimage, fastdecode, zerolatency
+    'KEYFRAME_INTERVAL': os.getenv('KEYFRAME_INTERVAL'),  # Optional maximum distance between keyframes, in frames
+    'FORCE_SEGMENT_KEYFRAMES': os.getenv('FORCE_SEGMENT_KEYFRAMES', 'false').lower() in ('1', 'true', 'yes'),  # Start every segment with a keyframe so extract.py can stream-copy speaker turns
+    'ENCODER_BACKEND': os.getenv('ENCODER_BACKEND', 'moviepy'),  # moviepy: write_videofile, pipe: raw frames straight into an ffmpeg process
+    
+    # Rendering settings
+    'RENDER_MODE': os.getenv('RENDER_MODE', 'compose'),  # compose: decode and re-encode every frame, tiles: stream-copy pre-encoded loop tiles
+    'AUDIO_MODE': os.getenv('AUDIO_MODE', 'clip'),  # clip: attach audio through moviepy, mux: render video only and mux the audio file once
+    'WORKERS': int(os.getenv('WORKERS', 1)),  # Worker processes for parallel chunk rendering (compose mode)
+    'WINDOW_SECONDS': float(os.getenv('WINDOW_SECONDS', 0)),  # Render in fixed windows of this many seconds, releasing readers between windows (0 disables)
+    'RENDER_CACHE': os.getenv('RENDER_CACHE', 'false').lower() in ('1', 'true', 'yes'),  # Reuse rendered segments between runs
+    'RENDER_CACHE_MAX_MB': int(os.getenv('RENDER_CACHE_MAX_MB', 10240)),  # Size limit of the render cache (least recently used entries are evicted)
+    'FRAME_CACHE_MB': int(os.getenv('FRAME_CACHE_MB', 0)),  # Memory budget for decoded character loops (0 disables the frame cache)
+    'FRAME_CACHE_MMAP_MB': int(os.getenv('FRAME_CACHE_MMAP_MB', 256)),  # Loops larger than this are decoded into memory-mapped files
+    'STATIC_MOTION_THRESHOLD': float(os.getenv('STATIC_MOTION_THRESHOLD', 0)),  # Loops whose most moving area changes less than this (mean pixel difference, 0-255) are rendered from one frame (0 disables)
+    'COALESCE_SEGMENTS': os.getenv('COALESCE_SEGMENTS', 'true').lower() in ('1', 'true', 'yes'),  # Merge adjacent segments showing the same video
+    'LOOP_CONTINUITY': os.getenv('LOOP_CONTINUITY', 'global'),  # global: follow the episode clock, character: resume each loop where it stopped, none: restart loops per segment. A segment's phase is part of its render cache key; global phases only depend on the segment's own position, while character phases shift for every later turn of a character whenever an earlier turn changes
+    'TALK_ON_DB': float(os.getenv('TALK_ON_DB', -35)),  # Loudness (dBFS) at which a character with an idle loop switches to talking
+    'TALK_OFF_DB': float(os.getenv('TALK_OFF_DB', -45)),  # Loudness (dBFS) at which it switches back to idle
+    'TALK_MIN_HOLD': float(os.getenv('TALK_MIN_HOLD', 0.3)),  # Shortest talking or idle run in seconds
+    'TIMESTAMP_RESOLUTION': int(os.getenv('TIMESTAMP_RESOLUTION', 100)),  # Analysis frames per second of generate_timestamps.py
+    'SPEAKER_THRESHOLD_DB': float(os.getenv('SPEAKER_THRESHOLD_DB', -40)),  # Loudness (dBFS) a speaker needs to take the floor
+    'SPEAKER_MARGIN_DB': float(os.getenv('SPEAKER_MARGIN_DB', 6)),  # Lead over the next loudest speaker needed to take the floor
+    'MIN_TURN_SECONDS': float(os.getenv('MIN_TURN_SECONDS', 1.0)),  # Shorter turns are merged into the previous speaker's turn
+    'SUBTITLES': os.getenv('SUBTITLES', 'off'),  # off, srt (write a sidecar from the script dialogue) or burn (sidecar and captions in the frames)
+    'SUBTITLE_FONT': os.getenv('SUBTITLE_FONT'),  # TrueType font for burned-in captions (needs CJK glyphs for Korean scripts)
+    'SUBTITLE_SIZE': float(os.getenv('SUBTITLE_SIZE', 0.05)),  # Caption font size as a fraction of the frame height
+    'SUBTITLE_MARGIN': float(os.getenv('SUBTITLE_MARGIN', 0.06)),  # Space below the captions as a fraction of the frame height
+    'SUBTITLE_MAX_WIDTH': float(os.getenv('SUBTITLE_MAX_WIDTH', 0.9)),  # Captions wrap at this fraction of the frame width
+    'SUBTITLE_MAX_CHARS': int(os.getenv('SUBTITLE_MAX_CHARS', 84)),  # Longer dialogue is split into several captions
+    'VISUALIZER': os.getenv('VISUALIZER', 'off'),  # off, spectrum (frequency bars) or waveform (scrolling loudness)
+    'VISUALIZER_BARS': int(os.getenv('VISUALIZER_BARS', 48)),  # Number of bars
+    'VISUALIZER_BOX': os.getenv('VISUALIZER_BOX', '0.1,0.68,0.8,0.12'),  # x,y,width,height of the bar area as fractions of the frame
+    'VISUALIZER_COLOR': os.getenv('VISUALIZER_COLOR', '#ffffff'),  # Bar color
+    'VISUALIZER_OPACITY': float(os.getenv('VISUALIZER_OPACITY', 0.8)),  # Bar opacity (0-1)
+    'STAGE_LAYOUT': os.getenv('STAGE_LAYOUT'),  # Optional JSON object (or JSON file) showing all characters on one stage
+    'RENDITIONS': os.getenv('RENDITIONS'),  # Optional JSON list (or JSON file) of output renditions rendered from one frame pass
+    'PREVIEW_FPS': int(os.getenv('PREVIEW_FPS', 12)),  # Frame rate of --preview renders
+    'PREVIEW_HEIGHT': int(os.getenv('PREVIEW_HEIGHT', 360)),  # Height of the cached preview proxies, in pixels
+    'PREVIEW_CRF': os.getenv('PREVIEW_CRF', '30'),  # Constant rate factor of --preview renders
+    'CACHE_DIR': os.getenv('CACHE_DIR'),  # Directory for intermediate files (defaults to OUTPUT_DIR/.cache)
+    'PREFLIGHT_WORKERS': int(os.getenv('PREFLIGHT_WORKERS', 8)),  # Threads probing media files before rendering
+    'EXTRACT_JOBS': int(os.getenv('EXTRACT_JOBS', 4)),  # Clips extract.py cuts at the same time
     
     # Logging settings
     'LOG_LEVEL': os.getenv('LOG_LEVEL', 'INFO'),  # DEBUG, INFO, WARNING, ERROR, CRITICAL
+    'METRICS_FILE': os.getenv('METRICS_FILE'),  # Optional JSON lines file for timing spans and progress events
 }
 
 # Ensure output directory exists
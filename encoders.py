@@ -0,0 +1,156 @@
+import logging
+import subprocess
+
+import numpy as np
+
+from ffmpeg_utils import get_ffmpeg_binary, video_encoding_args, rate_control_args, segment_keyframe_args
+
+
+def _callback_progress_logger(progress):
+    """Build a proglog logger that reports moviepy's frame bar to progress(done, total)."""
+    from proglog import ProgressBarLogger
+
+    class CallbackProgressLogger(ProgressBarLogger):
+        def bars_callback(self, bar, attr, value, old_value=None):
+            # moviepy iterates video frames over a bar named 't'
+            if bar == 't' and attr == 'index':
+                progress(value + 1, self.bars[bar]['total'])
+
+    return CallbackProgressLogger()
+
+
+def keyframe_args(config, timeline):
+    """Keyframes at every segment boundary of the timeline when FORCE_SEGMENT_KEYFRAMES is set."""
+    if not config.get('FORCE_SEGMENT_KEYFRAMES'):
+        return []
+    return segment_keyframe_args(timeline.frame_starts.tolist(), timeline.fps)
+
+
+class MoviepyEncoder:
+    def __init__(self, config, progress_logger='bar', progress=None):
+        """
+        Encoder that writes the timeline through moviepy's write_videofile.
+
+        Args:
+            config: Dictionary containing configuration parameters
+            progress_logger: moviepy/proglog progress logger ('bar', None or a logger instance)
+            progress: Optional function called with (frames done, total frames);
+                replaces progress_logger when given
+        """
+        self.config = config
+        self.progress_logger = progress_logger
+        if progress is not None:
+            self.progress_logger = _callback_progress_logger(progress)
+        self.logger = logging.getLogger(__name__)
+
+    def encode(self, timeline, output_path, audio=None):
+        """
+        Encode a bound timeline.
+
+        Args:
+            timeline: Timeline bound to its sources
+            output_path: Path of the encoded file
+            audio: Optional moviepy audio clip; without it the file is video-only
+
+        Returns:
+            str: Path of the encoded file
+        """
+        clip = timeline.to_clip()
+        # moviepy samples frames at arange(0, duration, 1/fps); stopping half a
+        # frame early yields exactly the planned number of frames
+        clip = clip.set_duration((timeline.total_frames - 0.5) / timeline.fps)
+        if audio is not None:
+            clip = clip.set_audio(audio)
+
+        clip.write_videofile(
+            output_path,
+            fps=timeline.fps,
+            codec=self.config.get('VIDEO_CODEC', 'libx264'),
+            audio=audio is not None,
+            audio_codec=self.config.get('VIDEO_AUDIO_CODEC', 'aac'),
+            threads=self.config.get('THREADS', 4),
+            preset=self.config.get('ENCODING_PRESET', 'medium'),
+            ffmpeg_params=rate_control_args(self.config) + keyframe_args(self.config, timeline),
+            logger=self.progress_logger
+        )
+        clip.close()
+        return output_path
+
+
+class FFmpegPipeEncoder:
+    def __init__(self, config, progress_logger=None, progress=None):
+        """
+        Encoder that writes raw timeline frames straight into one ffmpeg process.
+
+        Frames that already cover the canvas are written without copying;
+        smaller ones are centered in a single preallocated buffer.
+
+        Args:
+            config: Dictionary containing configuration parameters
+            progress_logger: Accepted for interface compatibility with MoviepyEncoder
+            progress: Optional function called with (frames done, total frames)
+        """
+        self.config = config
+        self.progress = progress
+        self.logger = logging.getLogger(__name__)
+
+    def encode(self, timeline, output_path, audio=None):
+        """
+        Encode a bound timeline into a video-only file.
+
+        Args:
+            timeline: Timeline bound to its sources
+            output_path: Path of the encoded file
+            audio: Not supported; the audio is muxed in afterwards
+
+        Returns:
+            str: Path of the encoded file
+        """
+        if audio is not None:
+            raise ValueError("FFmpegPipeEncoder writes video only; mux the audio afterwards")
+
+        width, height = timeline.size
+        cmd = [
+            get_ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}",
+            '-r', str(timeline.fps), '-i', '-', '-an',
+        ] + video_encoding_args(self.config) + keyframe_args(self.config, timeline) + [output_path]
+
+        canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for frame_index in range(timeline.total_frames):
+                frame = timeline.frame_at(frame_index, out=canvas)
+                process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+                if self.progress is not None:
+                    self.progress(frame_index + 1, timeline.total_frames)
+            process.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg exited early; its error message is reported below
+            pass
+        finally:
+            if not process.stdin.closed:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+            error = process.stderr.read().decode('utf-8', errors='replace').strip()
+            process.wait()
+
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed ({process.returncode}): {error[-2000:]}")
+        return output_path
+
+
+ENCODER_BACKENDS = {
+    'moviepy': MoviepyEncoder,
+    'pipe': FFmpegPipeEncoder,
+}
+
+
+def create_encoder(config, progress_logger='bar', progress=None):
+    """Create the encoder selected by ENCODER_BACKEND."""
+    backend = config.get('ENCODER_BACKEND', 'moviepy')
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend} (expected one of {', '.join(ENCODER_BACKENDS)})")
+    return ENCODER_BACKENDS[backend](config, progress_logger, progress)
@@ -0,0 +1,329 @@
+"""
+Loudness envelope of the episode audio and the talking/idle choice derived from it.
+
+The envelope holds one RMS value (in dBFS) per output frame. It is computed
+once in streaming chunks, over memory-mapped samples for PCM WAV files and
+over an ffmpeg decode for anything else, and cached next to the audio file.
+"""
+import os
+import struct
+import logging
+import subprocess
+
+import numpy as np
+
+from ffmpeg_utils import get_ffmpeg_binary, probe_audio_channels
+from render_cache import file_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Samples processed per chunk (per channel)
+CHUNK_SAMPLES = 1 << 20
+
+# Floor of the envelope, for digital silence
+SILENCE_DB = -120.0
+
+# Sample formats that can be memory-mapped directly: (format tag, bits) -> dtype
+WAV_DTYPES = {
+    (1, 16): '<i2',
+    (1, 32): '<i4',
+    (3, 32): '<f4',
+    (3, 64): '<f8',
+}
+
+
+def _wav_layout(audio_path):
+    """
+    Find the sample layout of a WAV file.
+
+    Returns:
+        tuple: (dtype, channels, sample rate, data offset, frame count), or None
+        when the file is not a WAV with a sample format NumPy can map
+    """
+    with open(audio_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if chunk_id == b'fmt ':
+                data = f.read(size)
+                tag, channels, rate = struct.unpack('<HHI', data[:8])
+                bits = struct.unpack('<H', data[14:16])[0]
+                if tag == 0xFFFE and len(data) >= 26:
+                    # WAVE_FORMAT_EXTENSIBLE: the real format is the start of the sub-format GUID
+                    tag = struct.unpack('<H', data[24:26])[0]
+                fmt = (tag, bits, channels, rate)
+            elif chunk_id == b'data':
+                if fmt is None or (fmt[0], fmt[1]) not in WAV_DTYPES:
+                    return None
+                tag, bits, channels, rate = fmt
+                dtype = np.dtype(WAV_DTYPES[(tag, bits)])
+                frames = min(size, os.path.getsize(audio_path) - f.tell()) // (dtype.itemsize * channels)
+                return dtype, channels, rate, f.tell(), frames
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+def _wav_chunks(audio_path, layout, mono=True):
+    """
+    Yield float32 chunks of a memory-mapped WAV file, scaled to [-1, 1].
+
+    Chunks are mixed down to 1-D arrays when mono is set, and have shape
+    (samples, channels) otherwise.
+    """
+    dtype, channels, _, offset, frames = layout
+    samples = np.memmap(audio_path, dtype=dtype, mode='r', offset=offset, shape=(frames, channels))
+    scale = np.float32(1.0 / np.iinfo(dtype).max if dtype.kind == 'i' else 1.0)
+    for start in range(0, frames, CHUNK_SAMPLES):
+        chunk = samples[start:start + CHUNK_SAMPLES]
+        if mono:
+            yield chunk.mean(axis=1, dtype=np.float32) * scale
+        else:
+            yield chunk.astype(np.float32) * scale
+
+
+def _ffmpeg_chunks(audio_path, sample_rate, channels=None):
+    """
+    Yield float32 chunks decoded by ffmpeg.
+
+    Without channels the audio is mixed down to 1-D chunks; otherwise chunks
+    have shape (samples, channels).
+    """
+    cmd = [
+        get_ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-i', audio_path,
+        '-vn', '-ac', str(channels or 1), '-ar', str(sample_rate), '-f', 'f32le', '-'
+    ]
+    frame_bytes = 4 * (channels or 1)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            data = process.stdout.read(CHUNK_SAMPLES * frame_bytes)
+            if not data:
+                break
+            samples = np.frombuffer(data[:len(data) // frame_bytes * frame_bytes], dtype=np.float32)
+            yield samples if channels is None else samples.reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"Could not decode audio from {audio_path}")
+
+
+def open_samples(audio_path, sample_rate=16000, mono=True):
+    """
+    Open an audio file as a stream of float32 sample chunks.
+
+    PCM and float WAV files are memory-mapped at their own sample rate;
+    anything else is decoded by ffmpeg at sample_rate.
+
+    Args:
+        audio_path: Audio file
+        sample_rate: Decode rate for files that cannot be memory-mapped
+        mono: Mix all channels down to 1-D chunks
+
+    Returns:
+        tuple: (iterator of chunks, sample rate, number of channels in the chunks)
+    """
+    layout = _wav_layout(audio_path)
+    if layout is not None:
+        return _wav_chunks(audio_path, layout, mono), layout[2], 1 if mono else layout[1]
+    if mono:
+        return _ffmpeg_chunks(audio_path, sample_rate), sample_rate, 1
+    channels = probe_audio_channels(audio_path)
+    if not channels:
+        raise ValueError(f"No audio stream found in {audio_path}")
+    return _ffmpeg_chunks(audio_path, sample_rate, channels), sample_rate, channels
+
+
+def frame_rms(chunks, sample_rate, fps):
+    """
+    Compute the RMS of every output frame from a stream of sample chunks.
+
+    Frame k covers samples [floor(k * rate / fps), floor((k + 1) * rate / fps)),
+    so frames line up with the video frames at any sample rate.
+
+    Args:
+        chunks: Iterable of float32 sample arrays, 1-D or (samples, channels)
+        sample_rate: Sample rate of the chunks
+        fps: Output frame rate
+
+    Returns:
+        np.ndarray: RMS of each frame (float32), one column per channel for 2-D chunks
+    """
+    results = []
+    carry = None
+    consumed = 0
+    frame = 0
+    for chunk in chunks:
+        data = np.concatenate([carry, chunk]) if carry is not None and len(carry) else chunk
+        end = consumed + len(data)
+        last = int(end * fps // sample_rate)
+        if last > frame:
+            bounds = (np.arange(frame, last + 1, dtype=np.int64) * sample_rate) // fps - consumed
+            squares = np.square(data[:bounds[-1]], dtype=np.float32)
+            sums = np.add.reduceat(squares, bounds[:-1], axis=0)
+            lengths = np.diff(bounds).reshape((-1,) + (1,) * (data.ndim - 1))
+            results.append(np.sqrt(sums / lengths))
+            frame = last
+            carry = data[bounds[-1]:]
+            consumed += int(bounds[-1])
+        else:
+            carry = data
+    if carry is not None and len(carry):
+        results.append(np.sqrt(np.mean(np.square(carry, dtype=np.float32), axis=0, keepdims=True)))
+    return np.concatenate(results).astype(np.float32) if results else np.empty(0, dtype=np.float32)
+
+
+def to_db(rms):
+    """Convert RMS values to dBFS, floored at SILENCE_DB."""
+    return np.maximum(20 * np.log10(np.maximum(rms, 1e-12)), SILENCE_DB).astype(np.float32)
+
+
+def compute_envelope(audio_path, fps, sample_rate=16000):
+    """
+    Compute the loudness of every output frame of an audio file.
+
+    Args:
+        audio_path: Audio file
+        fps: Output frame rate
+        sample_rate: Decode rate for files that cannot be memory-mapped
+
+    Returns:
+        np.ndarray: Loudness of each frame in dBFS (float32)
+    """
+    chunks, rate, _ = open_samples(audio_path, sample_rate)
+    return to_db(frame_rms(chunks, rate, fps))
+
+
+def load_envelope(audio_path, fps, cache_dir=None):
+    """
+    Get the loudness envelope of an audio file, computing it only once.
+
+    The envelope is cached next to the audio file (or in cache_dir when the
+    audio directory is not writable) and recomputed when the file changes.
+
+    Returns:
+        np.ndarray: Loudness of each output frame in dBFS
+    """
+    name = f"{os.path.basename(audio_path)}.rms{fps}.npz"
+    candidates = [os.path.join(os.path.dirname(os.path.abspath(audio_path)), name)]
+    if cache_dir:
+        candidates.append(os.path.join(cache_dir, 'envelopes', name))
+
+    fingerprint = file_fingerprint(audio_path)
+    for path in candidates:
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    if str(data['fingerprint']) == fingerprint:
+                        return data['envelope']
+            except (OSError, ValueError, KeyError):
+                pass
+
+    logger.info(f"Computing loudness envelope of {audio_path} at {fps} fps")
+    envelope = compute_envelope(audio_path, fps)
+    for path in candidates:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + '.tmp.npz'
+            np.savez(temp_path, envelope=envelope, fingerprint=np.array(fingerprint))
+            os.replace(temp_path, path)
+            break
+        except OSError as e:
+            logger.warning(f"Could not cache loudness envelope at {path}: {str(e)}")
+    return envelope
+
+
+def talking_mask(envelope, fps, on_db=-35.0, off_db=-45.0, min_hold=0.3):
+    """
+    Decide for every frame whether the character is talking.
+
+    Talking starts when the loudness rises above on_db and stops when it
+    falls below off_db (hysteresis). Runs shorter than min_hold seconds are
+    then absorbed by the run before them, so loops do not flicker.
+
+    Args:
+        envelope: Loudness of each frame in dBFS
+        fps: Frame rate of the envelope
+        on_db: Loudness at which talking starts
+        off_db: Loudness at which talking stops
+        min_hold: Minimum length of a talking or idle run, in seconds
+
+    Returns:
+        np.ndarray: Boolean array, True where the character talks
+    """
+    if not len(envelope):
+        return np.zeros(0, dtype=bool)
+
+    # Hysteresis: every frame takes the state of the last threshold crossing
+    events = np.where(envelope > on_db, 1, np.where(envelope < off_db, 0, -1))
+    positions = np.arange(len(events))
+    last_event = np.maximum.accumulate(np.where(events >= 0, positions, -1))
+    mask = np.where(last_event >= 0, events[np.maximum(last_event, 0)], 0).astype(bool)
+
+    return hold_runs(mask, max(1, int(round(min_hold * fps))))
+
+
+def hold_runs(labels, min_frames):
+    """
+    Merge runs of equal labels shorter than min_frames into the run before them.
+
+    A short first run is kept, since nothing precedes it.
+
+    Args:
+        labels: 1-D array of per-frame labels
+        min_frames: Minimum length of a run, in frames
+
+    Returns:
+        np.ndarray: Smoothed copy of labels
+    """
+    if not len(labels):
+        return labels.copy()
+    starts = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    bounds = np.concatenate([[0], starts, [len(labels)]])
+    values = labels[bounds[:-1]].copy()
+    for i in range(1, len(values)):
+        if bounds[i + 1] - bounds[i] < min_frames:
+            values[i] = values[i - 1]
+    return np.repeat(values, np.diff(bounds))
+
+
+def split_by_activity(segments, mask, fps):
+    """
+    Split segments that have an idle loop into talking and idle parts.
+
+    Segments without an 'idle' video are kept as they are. Split points are
+    whole frames of the audio, so the parts line up with the envelope.
+
+    Args:
+        segments: List of segment dictionaries (with audio times)
+        mask: Talking mask of the whole audio file, one value per frame
+        fps: Frame rate of the mask
+
+    Returns:
+        list: New list of segment dictionaries, without 'idle' keys
+    """
+    result = []
+    for segment in segments:
+        idle = segment.get('idle')
+        part = {k: v for k, v in segment.items() if k != 'idle'}
+        first = int(round(segment['start'] * fps))
+        last = min(int(round(segment['end'] * fps)), len(mask))
+        if not idle or last <= first:
+            result.append(part)
+            continue
+
+        window = mask[first:last]
+        changes = np.flatnonzero(np.diff(window.astype(np.int8))) + 1
+        bounds = [first] + (changes + first).tolist() + [last]
+        for i, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+            start = segment['start'] if i == 0 else lo / fps
+            end = segment['end'] if i == len(bounds) - 2 else hi / fps
+            video = segment['video'] if window[lo - first] else idle
+            result.append(dict(part, video=video, start=start, end=end))
+    return result
@@ -0,0 +1,262 @@
+import os
+import re
+import sys
+import bisect
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from config import config
+from segment_plan import compile_plan
+from timeline import segment_frame_counts
+from preview import parse_time_range
+from ffmpeg_utils import (
+    run_ffmpeg, probe_video, probe_duration, probe_keyframes, probe_video_timescale,
+    video_encoding_args, concat_stream_copy, mux_audio
+)
+
+logger = logging.getLogger(__name__)
+
+
+def speaker_turns(segments, fps):
+    """
+    Place the speaker turns of a segment plan on the output timeline.
+
+    Turn boundaries are rounded to output frames the same way the renderer
+    rounds them (see segment_frame_counts), so they fall exactly on the
+    frames where the episode switches loops. Adjacent segments of the same
+    character form one turn.
+
+    Args:
+        segments: Resolved segment dictionaries in output order
+        fps: Frame rate of the episode
+
+    Returns:
+        list: (character, first frame, last frame) tuples, last frame exclusive
+    """
+    segments = [s for s in segments if s['end'] - s['start'] > 0]
+    turns = []
+    frame = 0
+    for segment, frames in zip(segments, segment_frame_counts(segments, fps)):
+        name = segment.get('character') or os.path.splitext(os.path.basename(segment['video']))[0]
+        if turns and turns[-1][0] == name:
+            turns[-1] = (name, turns[-1][1], frame + frames)
+        elif frames > 0:
+            turns.append((name, frame, frame + frames))
+        frame += frames
+    return turns
+
+
+def clip_name(text):
+    """Turn a character name into a safe file name part."""
+    return re.sub(r'[^\w-]+', '_', text).strip('_') or 'clip'
+
+
+def plan_clips(turns, fps, total_frames, base_name, speakers=None, time_ranges=None, min_turn=0.0):
+    """
+    Choose the clips to export.
+
+    Args:
+        turns: Speaker turns (see speaker_turns)
+        fps: Frame rate of the episode
+        total_frames: Number of frames of the episode
+        base_name: Prefix of the clip file names
+        speakers: Export every turn of these characters
+        time_ranges: Export these (start, end) output ranges; end may be None
+        min_turn: Skip turns shorter than this many seconds
+
+    Returns:
+        list: Clip dictionaries with name, first_frame and last_frame (exclusive)
+    """
+    clips = []
+    if speakers or not time_ranges:
+        counts = {}
+        for name, first, last in turns:
+            if speakers and name not in speakers:
+                continue
+            if (last - first) / fps < min_turn:
+                continue
+            counts[name] = counts.get(name, 0) + 1
+            clips.append({
+                'name': f"{base_name}_{clip_name(name)}_{counts[name]:03d}.mp4",
+                'first_frame': first,
+                'last_frame': last,
+            })
+    for i, (start, end) in enumerate(time_ranges or [], 1):
+        first = int(round(start * fps))
+        last = total_frames if end is None else min(int(round(end * fps)), total_frames)
+        if last <= first:
+            logger.warning(f"Range {i} starts after the end of the episode, skipping it")
+            continue
+        clips.append({'name': f"{base_name}_range_{i:02d}.mp4", 'first_frame': first, 'last_frame': last})
+    return clips
+
+
+def cut_video(episode_path, first_frame, last_frame, fps, keyframes, output_path, cut_config, timescale=None):
+    """
+    Cut output frames [first_frame, last_frame) of the episode into a video-only file.
+
+    From the first keyframe in the range on, packets are stream-copied.
+    Only the frames before it (the tail of the GOP the cut starts in) are
+    re-encoded with the renderer's encoding settings and joined to the
+    copied part with the concat demuxer. A range without a keyframe is
+    re-encoded as a whole.
+
+    Args:
+        episode_path: Rendered episode
+        first_frame: First frame of the clip
+        last_frame: Frame after the last frame of the clip
+        fps: Frame rate of the episode
+        keyframes: Keyframe times of the episode (see probe_keyframes)
+        output_path: Path of the video-only clip
+        cut_config: Configuration dictionary with the encoding settings
+        timescale: Time base of the episode's video track, given to re-encoded parts
+
+    Returns:
+        str: 'copy', 'partial' or 'encode', depending on how much was re-encoded
+    """
+    start = first_frame / fps
+    end = last_frame / fps
+    # First keyframe at or after the cut, matched to the nearest frame
+    index = bisect.bisect_left(keyframes, start - 0.5 / fps)
+    keyframe_frame = int(round(keyframes[index] * fps)) if index < len(keyframes) else last_frame
+    timescale_args = ['-video_track_timescale', str(timescale)] if timescale else []
+
+    def encode(first, last, path):
+        run_ffmpeg(
+            ['-ss', f"{first / fps:.6f}", '-i', episode_path, '-map', '0:v:0', '-an',
+             '-frames:v', str(last - first)]
+            + video_encoding_args(cut_config) + timescale_args + [path]
+        )
+
+    def copy(first, path):
+        # Seeking half a frame past the keyframe lands on it, not on the one
+        # before; the duration counts from the seek point
+        seek = (first + 0.5) / fps
+        run_ffmpeg([
+            '-ss', f"{seek:.6f}", '-i', episode_path, '-map', '0:v:0', '-an',
+            '-t', f"{end - seek:.6f}", '-c', 'copy', '-avoid_negative_ts', 'make_zero', path
+        ])
+
+    if keyframe_frame >= last_frame:
+        encode(first_frame, last_frame, output_path)
+        return 'encode'
+    if keyframe_frame <= first_frame:
+        copy(first_frame, output_path)
+        return 'copy'
+
+    head_path = f"{output_path}.head.mp4"
+    tail_path = f"{output_path}.tail.mp4"
+    try:
+        encode(first_frame, keyframe_frame, head_path)
+        copy(keyframe_frame, tail_path)
+        concat_stream_copy([head_path, tail_path], output_path)
+    finally:
+        for path in (head_path, tail_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return 'partial'
+
+
+def extract_clips(episode_path, clips, output_dir, extract_config=None, jobs=4):
+    """
+    Export clips of a rendered episode, several at a time.
+
+    Args:
+        episode_path: Rendered episode (video with audio)
+        clips: Clip dictionaries (see plan_clips)
+        output_dir: Directory for the clips
+        extract_config: Configuration dictionary with the encoding settings (defaults to config)
+        jobs: Number of clips cut at the same time
+
+    Returns:
+        list: Paths of the exported clips
+    """
+    extract_config = extract_config or config
+    fps = probe_video(episode_path)['fps']
+    keyframes = probe_keyframes(episode_path)
+    timescale = probe_video_timescale(episode_path)
+    audio_codec = extract_config.get('VIDEO_AUDIO_CODEC', 'aac')
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"Found {len(keyframes)} keyframes in {episode_path}")
+
+    def export(clip):
+        output_path = os.path.join(output_dir, clip['name'])
+        video_path = f"{output_path}.video.mp4"
+        try:
+            mode = cut_video(episode_path, clip['first_frame'], clip['last_frame'], fps, keyframes,
+                             video_path, extract_config, timescale)
+            # The episode's audio is cut to the same frames and copied when the container allows it
+            mux_audio(video_path, episode_path, [(clip['first_frame'] / fps, clip['last_frame'] / fps)],
+                      output_path, audio_codec=audio_codec)
+        finally:
+            if os.path.exists(video_path):
+                os.remove(video_path)
+        logger.info(f"Exported {clip['name']} ({(clip['last_frame'] - clip['first_frame']) / fps:.2f}s, {mode})")
+        return output_path, mode
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(export, clips))
+
+    modes = [mode for _, mode in results]
+    logger.info(
+        f"Exported {len(results)} clips: {modes.count('copy')} stream-copied, "
+        f"{modes.count('partial')} with a re-encoded first GOP, {modes.count('encode')} re-encoded"
+    )
+    return [path for path, _ in results]
+
+
+def main():
+    """Export speaker turns or time ranges of a rendered episode as separate clips."""
+    parser = argparse.ArgumentParser(description='Export clips of a rendered episode')
+    parser.add_argument('episode', help='Rendered episode (video with audio)')
+    parser.add_argument('--timestamps', help='Timestamps file the episode was rendered from (defaults to TIMESTAMPS_FILE)')
+    parser.add_argument('--speaker', action='append',
+                        help='Export every turn of this character (repeatable); without --speaker or --range every turn is exported')
+    parser.add_argument('--range', action='append', dest='ranges',
+                        help='Export this part of the episode (e.g. 01:30-02:45, repeatable)')
+    parser.add_argument('--min-turn', type=float, default=0.0, help='Skip turns shorter than this many seconds')
+    parser.add_argument('--output-dir', help='Directory for the clips (defaults to OUTPUT_DIR/clips)')
+    parser.add_argument('--jobs', type=int, help='Number of clips cut at the same time (overrides EXTRACT_JOBS)')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, config['LOG_LEVEL']),
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stderr)]
+    )
+
+    timestamps_file = args.timestamps or config['TIMESTAMPS_FILE']
+    for path, description in ((args.episode, 'Episode'), (timestamps_file, 'Timestamps file')):
+        if not os.path.exists(path):
+            logger.error(f"{description} not found: {path}")
+            return 1
+
+    try:
+        time_ranges = [parse_time_range(value) for value in args.ranges or []]
+        # The episode is as long as the audio it was rendered from, so it resolves "end"
+        duration = probe_duration(args.episode)
+        plan = compile_plan(timestamps_file, config.get('CHARACTER_MAPPING'), duration).resolve(duration)
+        for problem in plan.issues():
+            logger.warning(problem)
+        fps = probe_video(args.episode)['fps']
+        base_name = os.path.splitext(os.path.basename(args.episode))[0]
+        clips = plan_clips(
+            speaker_turns(plan.to_segments(), fps), fps, int(round(duration * fps)), base_name,
+            speakers=set(args.speaker or []), time_ranges=time_ranges, min_turn=args.min_turn
+        )
+        if not clips:
+            logger.error("No clips match the given speakers and ranges")
+            return 1
+        output_dir = args.output_dir or os.path.join(config['OUTPUT_DIR'], 'clips')
+        paths = extract_clips(args.episode, clips, output_dir, config, args.jobs or int(config.get('EXTRACT_JOBS', 4)))
+    except (ValueError, RuntimeError, FileNotFoundError) as e:
+        logger.error(str(e))
+        return 1
+
+    print(f"\nExported {len(paths)} clips to {output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
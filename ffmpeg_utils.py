@@ -0,0 +1,306 @@
+import os
+import re
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Audio codecs each output container can hold without re-encoding
+CONTAINER_AUDIO_CODECS = {
+    '.mp4': {'aac', 'mp3', 'alac', 'ac3'},
+    '.m4v': {'aac', 'mp3', 'alac', 'ac3'},
+    '.mov': {'aac', 'mp3', 'alac', 'ac3', 'pcm_s16le', 'pcm_s24le'},
+    '.mkv': {'aac', 'mp3', 'alac', 'ac3', 'opus', 'vorbis', 'flac', 'pcm_s16le', 'pcm_s24le'},
+    '.webm': {'opus', 'vorbis'},
+}
+
+# Character inputs that are single images rather than loops
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp', '.tif', '.tiff')
+
+# Loop length reported for still images; tiles of stills are this long
+STILL_LOOP_SECONDS = 10.0
+
+
+def is_image(path):
+    """Return True if the path is a still image, judged by its extension."""
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def get_ffmpeg_binary():
+    """Return the ffmpeg binary moviepy is configured to use."""
+    from moviepy.config import get_setting
+    return get_setting('FFMPEG_BINARY')
+
+
+def run_ffmpeg(args):
+    """
+    Run ffmpeg with the given arguments and raise if it fails.
+
+    Args:
+        args: List of command line arguments (without the binary)
+    """
+    cmd = [get_ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-y'] + list(args)
+    logger.debug(f"Running: {' '.join(cmd)}")
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        error = result.stderr.decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {error[-2000:]}")
+
+
+def probe_video(video_path):
+    """
+    Read duration, fps and size of a video without keeping a reader open.
+
+    Still images are reported as STILL_LOOP_SECONDS long, with 'still' set.
+
+    Returns:
+        dict: Dictionary with duration, fps, size (width, height) and still
+    """
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video file not found: {video_path}")
+
+    infos = ffmpeg_parse_infos(video_path)
+    still = is_image(video_path)
+    return {
+        'duration': STILL_LOOP_SECONDS if still else infos['duration'],
+        'fps': None if still else infos.get('video_fps'),
+        'size': tuple(infos['video_size']),
+        'still': still,
+    }
+
+
+def probe_duration(media_path):
+    """Read the duration of an audio or video file without keeping a reader open."""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    if not os.path.exists(media_path):
+        raise FileNotFoundError(f"Media file not found: {media_path}")
+    return ffmpeg_parse_infos(media_path)['duration']
+
+
+def probe_audio_codec(media_path):
+    """
+    Return the codec name of the first audio stream of a media file.
+
+    Returns:
+        str: Codec name as reported by ffmpeg (e.g. 'aac', 'pcm_s16le'), or None
+    """
+    result = subprocess.run(
+        [get_ffmpeg_binary(), '-hide_banner', '-i', media_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    match = re.search(r"Stream #\S+.*?: Audio: (\w+)", result.stderr.decode('utf-8', errors='replace'))
+    return match.group(1) if match else None
+
+
+def probe_audio_channels(media_path):
+    """
+    Return the channel count of the first audio stream of a media file.
+
+    Returns:
+        int: Number of channels, or None when there is no audio stream
+    """
+    result = subprocess.run(
+        [get_ffmpeg_binary(), '-hide_banner', '-i', media_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    match = re.search(r"Stream #\S+.*?: Audio: [^,]+, \d+ Hz, ([^,]+)", result.stderr.decode('utf-8', errors='replace'))
+    if not match:
+        return None
+    layout = match.group(1).strip()
+    count = re.match(r"(\d+) channels", layout)
+    if count:
+        return int(count.group(1))
+    # Named layouts: "5.1(side)" -> 6, "stereo" -> 2
+    layout = layout.split('(')[0]
+    named = {'mono': 1, 'stereo': 2, 'quad': 4, 'hexagonal': 6, 'octagonal': 8}
+    if layout in named:
+        return named[layout]
+    numbers = re.match(r"(\d+)\.(\d+)", layout)
+    return int(numbers.group(1)) + int(numbers.group(2)) if numbers else None
+
+
+def probe_keyframes(video_path):
+    """
+    Return the time of every keyframe of the first video stream.
+
+    Only keyframes are decoded, so this is fast even for long episodes.
+
+    Returns:
+        list: Keyframe times in seconds, ascending
+    """
+    result = subprocess.run(
+        [get_ffmpeg_binary(), '-hide_banner', '-nostats', '-skip_frame', 'nokey', '-i', video_path,
+         '-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not read keyframes of {video_path}")
+    output = result.stderr.decode('utf-8', errors='replace')
+    return sorted(float(t) for t in re.findall(r"pts_time:\s*(-?[\d.]+)", output))
+
+
+def probe_video_timescale(media_path):
+    """
+    Return the time base denominator (tbn) of the first video stream.
+
+    Returns:
+        int: Timescale such as 12800 or 90000, or None when ffmpeg does not report one
+    """
+    result = subprocess.run(
+        [get_ffmpeg_binary(), '-hide_banner', '-i', media_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    match = re.search(r"Stream #\S+.*?: Video: .*?(\d+(?:\.\d+)?)(k?) tbn", result.stderr.decode('utf-8', errors='replace'))
+    if not match:
+        return None
+    return int(round(float(match.group(1)) * (1000 if match.group(2) else 1)))
+
+
+def rate_control_args(config, gop=None):
+    """
+    Build the quality related ffmpeg arguments from the configuration.
+
+    Args:
+        config: Configuration dictionary
+        gop: Optional fixed keyframe interval in frames, overriding KEYFRAME_INTERVAL
+
+    Returns:
+        list: ffmpeg arguments (CRF, optional x264 tune and keyframe interval)
+    """
+    args = ['-crf', str(config.get('CRF_VALUE', '23'))]
+    if config.get('X264_TUNE'):
+        args += ['-tune', config['X264_TUNE']]
+    if gop:
+        args += ['-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0']
+    elif config.get('KEYFRAME_INTERVAL'):
+        args += ['-g', str(config['KEYFRAME_INTERVAL'])]
+    return args
+
+
+def video_encoding_args(config, gop=None):
+    """
+    Build the ffmpeg video encoding arguments from the configuration.
+
+    Args:
+        config: Configuration dictionary
+        gop: Optional fixed keyframe interval in frames
+
+    Returns:
+        list: ffmpeg arguments
+    """
+    return [
+        '-c:v', config.get('VIDEO_CODEC', 'libx264'),
+        '-preset', config.get('ENCODING_PRESET', 'medium'),
+        '-pix_fmt', 'yuv420p',
+        '-threads', str(config.get('THREADS', 4)),
+    ] + rate_control_args(config, gop=gop)
+
+
+def segment_keyframe_args(frame_starts, fps):
+    """
+    Build the arguments forcing a keyframe at every segment boundary.
+
+    Args:
+        frame_starts: First output frame of every segment
+        fps: Output frame rate
+
+    Returns:
+        list: ffmpeg arguments (empty for a single segment)
+    """
+    times = [f"{frame / fps:.6f}" for frame in frame_starts if frame > 0]
+    return ['-force_key_frames', ','.join(times)] if times else []
+
+
+def encoding_settings(config, fixed_gop=False):
+    """
+    Return the subset of the configuration that affects encoded output.
+
+    Args:
+        config: Configuration dictionary
+        fixed_gop: The output is encoded with its own gop (see rate_control_args),
+            so KEYFRAME_INTERVAL does not affect it and is left out
+
+    Returns:
+        list: Values of the settings, in a fixed order
+    """
+    keys = ['VIDEO_CODEC', 'ENCODING_PRESET', 'CRF_VALUE', 'X264_TUNE']
+    if not fixed_gop:
+        keys.append('KEYFRAME_INTERVAL')
+    return [config.get(key) for key in keys]
+
+
+def write_concat_list(paths, list_path):
+    """Write an ffmpeg concat demuxer list file for the given media files."""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return list_path
+
+
+def concat_stream_copy(paths, output_path, list_path=None):
+    """
+    Join media files with identical stream parameters without re-encoding.
+
+    Args:
+        paths: Ordered list of files to join
+        output_path: Path of the joined file
+        list_path: Optional path for the concat list file
+    """
+    list_path = list_path or output_path + '.concat.txt'
+    write_concat_list(paths, list_path)
+    try:
+        run_ffmpeg([
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-map', '0:v:0', '-c', 'copy', output_path
+        ])
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+    return output_path
+
+
+def mux_audio(video_path, audio_path, ranges, output_path, audio_codec='aac'):
+    """
+    Add the given time ranges of an audio file to a video-only file.
+
+    The video stream is copied. The audio stream is copied too when the
+    ranges are contiguous and the source codec fits the output container;
+    otherwise it is encoded once with audio_codec.
+
+    Args:
+        video_path: Video-only input file
+        audio_path: Source audio file
+        ranges: List of (start, end) tuples in seconds, in output order
+        output_path: Path of the muxed file
+        audio_codec: Audio codec used when the audio has to be encoded
+
+    Returns:
+        str: Path of the muxed file
+    """
+    args = ['-i', video_path]
+    contiguous = all(abs(ranges[i][1] - ranges[i + 1][0]) < 1e-6 for i in range(len(ranges) - 1))
+
+    if contiguous:
+        start, end = ranges[0][0], ranges[-1][1]
+        args += ['-ss', f"{start:.6f}", '-t', f"{end - start:.6f}", '-i', audio_path,
+                 '-map', '0:v:0', '-map', '1:a:0']
+        source_codec = probe_audio_codec(audio_path)
+        extension = os.path.splitext(output_path)[1].lower()
+        if source_codec in CONTAINER_AUDIO_CODECS.get(extension, ()):
+            logger.info(f"Copying {source_codec} audio stream from {audio_path}")
+            audio_codec = 'copy'
+    else:
+        parts = [f"[1:a]atrim={start:.6f}:{end:.6f},asetpts=PTS-STARTPTS[a{i}]"
+                 for i, (start, end) in enumerate(ranges)]
+        labels = ''.join(f"[a{i}]" for i in range(len(ranges)))
+        parts.append(f"{labels}concat=n={len(ranges)}:v=0:a=1[aout]")
+        args += ['-i', audio_path, '-filter_complex', ';'.join(parts),
+                 '-map', '0:v:0', '-map', '[aout]']
+
+    args += ['-c:v', 'copy', '-c:a', audio_codec, '-shortest', output_path]
+    run_ffmpeg(args)
+    return output_path
@@ -0,0 +1,239 @@
+import os
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+
+from ffmpeg_utils import get_ffmpeg_binary, probe_video
+from render_cache import RenderCache, file_fingerprint
+
+
+def read_rawvideo(cmd, frames):
+    """
+    Fill a frame array from an ffmpeg command writing raw video to stdout.
+
+    Reads straight into the array, one frame at a time, and stops ffmpeg
+    once the array is full.
+
+    Args:
+        cmd: ffmpeg command line ending in a rawvideo output to '-'
+        frames: Array of shape (n, height, width, channels) to fill
+
+    Returns:
+        int: Number of complete frames read
+    """
+    frame_bytes = frames[0].nbytes
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    n_frames = 0
+    try:
+        buffer = memoryview(frames.reshape(-1))
+        while n_frames < len(frames):
+            target = buffer[n_frames * frame_bytes:(n_frames + 1) * frame_bytes]
+            read = 0
+            while read < frame_bytes:
+                chunk = process.stdout.readinto(target[read:])
+                if not chunk:
+                    break
+                read += chunk
+            if read < frame_bytes:
+                break
+            n_frames += 1
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+    return n_frames
+
+
+class CachedLoop:
+    def __init__(self, frames, fps):
+        """
+        A character loop decoded once at the output frame rate.
+
+        Behaves like a clip for the Timeline: frames are served by index as
+        views into one contiguous array, without copying or seeking.
+
+        Args:
+            frames: Array of shape (n, height, width, 3), in memory or memory-mapped
+            fps: Frame rate the loop was decoded at
+        """
+        self.frames = frames
+        self.fps = fps
+        self.n_frames = len(frames)
+        self.duration = self.n_frames / fps
+        self.size = (frames.shape[2], frames.shape[1])
+        self.nbytes = frames.nbytes
+
+    def get_frame(self, t):
+        """Return the frame shown at time t (wrapping around the loop)."""
+        return self.frames[int(t * self.fps + 1e-6) % self.n_frames]
+
+    def close(self):
+        """Release the frames (memory-mapped files stay on disk for reuse)."""
+        self.frames = None
+
+
+class LoopFrameCache:
+    def __init__(self, max_bytes, fps, mmap_dir=None, mmap_threshold_bytes=None, probe=None):
+        """
+        Initialize a cache of decoded character loops shared across segments.
+
+        Loops are evicted least recently used first once the decoded frames
+        exceed max_bytes. Loops larger than mmap_threshold_bytes are decoded
+        into a memory-mapped file in mmap_dir instead of RAM; those files are
+        reused by later runs.
+
+        The cache can be shared by several renders running in threads: each
+        loop is decoded once even when requested concurrently, and evicted
+        loops stay valid for timelines still holding them.
+
+        Args:
+            max_bytes: Memory budget for decoded frames
+            fps: Output frame rate loops are decoded at
+            mmap_dir: Directory for memory-mapped loops (None keeps everything in RAM)
+            mmap_threshold_bytes: Size above which a loop is memory-mapped
+            probe: Optional function returning media metadata (e.g. ProbeCache.probe)
+        """
+        self.max_bytes = max_bytes
+        self.fps = fps
+        self.mmap_dir = mmap_dir
+        self.mmap_threshold_bytes = mmap_threshold_bytes
+        self.probe = probe or probe_video
+        self.loops = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._decoding = {}
+        self.logger = logging.getLogger(__name__)
+        if self.mmap_dir:
+            os.makedirs(self.mmap_dir, exist_ok=True)
+
+    def get(self, video_path):
+        """
+        Get a decoded loop, decoding it on first use.
+
+        Returns:
+            CachedLoop: The decoded loop
+        """
+        with self._lock:
+            loop = self._lookup(video_path)
+            if loop is not None:
+                return loop
+            decode_lock = self._decoding.setdefault(video_path, threading.Lock())
+
+        # Concurrent requests for the same loop wait for a single decode
+        with decode_lock:
+            with self._lock:
+                loop = self._lookup(video_path)
+                if loop is not None:
+                    return loop
+            loop = self._decode(video_path)
+            with self._lock:
+                self.misses += 1
+                self.loops[video_path] = loop
+                self.total_bytes += loop.nbytes
+                self._evict(keep=video_path)
+                self._decoding.pop(video_path, None)
+        return loop
+
+    def _lookup(self, video_path):
+        """Return a cached loop and mark it recently used (caller holds the lock)."""
+        loop = self.loops.get(video_path)
+        if loop is not None:
+            self.hits += 1
+            self.loops.move_to_end(video_path)
+        return loop
+
+    def _evict(self, keep=None):
+        """Drop least recently used loops until the cache fits its budget."""
+        for path in list(self.loops):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            # Not closed: a render still using the loop keeps its frames alive
+            loop = self.loops.pop(path)
+            self.total_bytes -= loop.nbytes
+            self.logger.info(f"Evicted decoded loop {path} ({loop.nbytes / 1e6:.1f} MB)")
+
+    def _decode(self, video_path):
+        """Decode a whole loop at the output fps in one sequential ffmpeg pass."""
+        info = self.probe(video_path)
+        width, height = info['size']
+        frame_bytes = width * height * 3
+        # Still images become a one-frame loop that serves every output frame
+        still = bool(info.get('still'))
+        n_estimate = 1 if still else max(1, int(round(info['duration'] * self.fps)))
+        shape = (n_estimate, height, width, 3)
+
+        mmap_path = None
+        if self.mmap_dir and self.mmap_threshold_bytes is not None \
+                and n_estimate * frame_bytes > self.mmap_threshold_bytes:
+            key = RenderCache.make_key(file_fingerprint(video_path), self.fps)
+            mmap_path = os.path.join(self.mmap_dir, f"{key}.rgb")
+            count_path = mmap_path + '.frames'
+            # The count file is moved into place last, so it only exists once the frames are complete
+            if os.path.exists(count_path):
+                with open(count_path, 'r') as f:
+                    n_frames = int(f.read())
+                frames = np.memmap(mmap_path, dtype=np.uint8, mode='r', shape=(n_frames, height, width, 3))
+                self.logger.info(f"Mapped decoded loop {video_path} ({n_frames} frames)")
+                return CachedLoop(frames, self.fps)
+            # Other processes (chunk workers, parallel renders) may decode the same loop
+            temp_path = f"{mmap_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            frames = np.memmap(temp_path, dtype=np.uint8, mode='w+', shape=shape)
+        else:
+            frames = np.empty(shape, dtype=np.uint8)
+
+        cmd = [get_ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-i', video_path]
+        cmd += ['-frames:v', '1'] if still else ['-vf', f"fps={self.fps}"]
+        cmd += ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+        try:
+            n_frames = read_rawvideo(cmd, frames)
+            if n_frames == 0:
+                raise RuntimeError(f"Could not decode any frames from {video_path}")
+            if mmap_path:
+                frames.flush()
+                del frames
+                with open(temp_path + '.frames', 'w') as f:
+                    f.write(str(n_frames))
+                os.replace(temp_path, mmap_path)
+                os.replace(temp_path + '.frames', count_path)
+                frames = np.memmap(mmap_path, dtype=np.uint8, mode='r', shape=(n_frames, height, width, 3))
+        finally:
+            if mmap_path:
+                for path in (temp_path, temp_path + '.frames'):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        frames = frames[:n_frames]
+        self.logger.info(f"Decoded loop {video_path}: {n_frames} frames ({frames.nbytes / 1e6:.1f} MB)")
+        return CachedLoop(frames, self.fps)
+
+    def trim(self, target_bytes):
+        """
+        Evict least recently used loops until at most target_bytes are cached.
+
+        Returns:
+            int: Number of bytes released
+        """
+        with self._lock:
+            before = self.total_bytes
+            budget = self.max_bytes
+            self.max_bytes = target_bytes
+            try:
+                self._evict()
+            finally:
+                self.max_bytes = budget
+            return before - self.total_bytes
+
+    def clear(self):
+        """Drop all decoded loops."""
+        with self._lock:
+            for loop in self.loops.values():
+                loop.close()
+            self.loops.clear()
+            self.total_bytes = 0
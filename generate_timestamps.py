@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import config
+from envelope import open_samples, frame_rms, to_db, hold_runs, SILENCE_DB
+from segment_plan import CharacterMatcher
+
+logger = logging.getLogger(__name__)
+
+
+def speaker_levels(audio_paths, fps, workers=4):
+    """
+    Compute the loudness of every speaker at the analysis rate.
+
+    Args:
+        audio_paths: One audio file per speaker, or a single multichannel
+            file with one speaker per channel
+        fps: Analysis frames per second
+        workers: Number of files decoded at the same time
+
+    Returns:
+        np.ndarray: Array of shape (frames, speakers) in dBFS
+    """
+    if len(audio_paths) == 1:
+        chunks, rate, channels = open_samples(audio_paths[0], mono=False)
+        logger.info(f"Analysing {channels} channels of {audio_paths[0]}")
+        return to_db(frame_rms(chunks, rate, fps).reshape(-1, channels))
+
+    def track_levels(path):
+        chunks, rate, _ = open_samples(path)
+        return to_db(frame_rms(chunks, rate, fps))
+
+    logger.info(f"Analysing {len(audio_paths)} speaker tracks")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        tracks = list(executor.map(track_levels, audio_paths))
+
+    # Tracks of slightly different lengths are padded with silence
+    levels = np.full((max(len(t) for t in tracks), len(tracks)), SILENCE_DB, dtype=np.float32)
+    for i, track in enumerate(tracks):
+        levels[:len(track), i] = track
+    return levels
+
+
+def detect_turns(levels, fps, threshold_db=-40.0, margin_db=6.0, min_turn=1.0):
+    """
+    Decide which speaker holds the floor in every analysis frame.
+
+    A frame is decisive when the loudest speaker is above threshold_db and
+    at least margin_db louder than the next one, so bleed between
+    microphones does not switch speakers. Other frames (silence, crosstalk)
+    keep the previous speaker, and turns shorter than min_turn seconds are
+    merged into the turn before them.
+
+    Args:
+        levels: Array of shape (frames, speakers) in dBFS
+        fps: Analysis frames per second
+        threshold_db: Loudness a speaker needs to take the floor
+        margin_db: Lead over the next loudest speaker needed to take the floor
+        min_turn: Minimum turn length in seconds
+
+    Returns:
+        np.ndarray: Speaker index of every frame
+    """
+    frames, speakers = levels.shape
+    loudest = np.argmax(levels, axis=1)
+    top = levels[np.arange(frames), loudest]
+    if speakers > 1:
+        second = np.partition(levels, -2, axis=1)[:, -2]
+    else:
+        second = np.full(frames, SILENCE_DB, dtype=np.float32)
+    decisive = (top > threshold_db) & (top - second >= margin_db)
+    if not decisive.any():
+        raise ValueError(f"No speech above {threshold_db} dBFS found")
+
+    # Every frame takes the speaker of the last decisive frame; the lead-in
+    # before the first one belongs to the first speaker
+    positions = np.arange(frames)
+    last_decisive = np.maximum.accumulate(np.where(decisive, positions, -1))
+    labels = np.where(last_decisive >= 0, loudest[np.maximum(last_decisive, 0)], loudest[np.argmax(decisive)])
+    return hold_runs(labels, max(1, int(round(min_turn * fps))))
+
+
+def turns_to_segments(labels, fps, speaker_names, character_mapping=None):
+    """
+    Convert per-frame speaker labels into a JSON segment list.
+
+    Args:
+        labels: Speaker index of every analysis frame
+        fps: Analysis frames per second
+        speaker_names: Character name of each speaker index
+        character_mapping: Optional custom character to video mapping
+
+    Returns:
+        list: Segment dictionaries (video, start, end, character) as read by load_segments
+    """
+    matcher = CharacterMatcher(character_mapping)
+    starts = np.concatenate([[0], np.flatnonzero(labels[1:] != labels[:-1]) + 1])
+    ends = np.append(starts[1:], len(labels))
+
+    segments = []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        name = speaker_names[labels[start]]
+        video = matcher.match(name)
+        segment = {
+            'video': video['talking'] if isinstance(video, dict) else video,
+            'start': round(start / fps, 3),
+            'end': 'end' if i == len(starts) - 1 else round(end / fps, 3),
+            'character': name,
+        }
+        if isinstance(video, dict) and video.get('idle'):
+            segment['idle'] = video['idle']
+        segments.append(segment)
+    return segments
+
+
+def generate_timestamps(audio_paths, speaker_names=None, generate_config=None):
+    """
+    Generate a segment list from per-speaker audio.
+
+    Args:
+        audio_paths: One audio file per speaker, or one multichannel file
+        speaker_names: Character name of each file or channel; defaults to
+            the file names (or "Speaker 1", "Speaker 2", ... for channels)
+        generate_config: Configuration dictionary (defaults to config)
+
+    Returns:
+        list: Segment dictionaries as read by load_segments
+    """
+    generate_config = generate_config or config
+    fps = int(generate_config.get('TIMESTAMP_RESOLUTION', 100))
+    levels = speaker_levels(audio_paths, fps, int(generate_config.get('PREFLIGHT_WORKERS', 8)))
+
+    if speaker_names is None:
+        if len(audio_paths) > 1:
+            speaker_names = [os.path.splitext(os.path.basename(path))[0] for path in audio_paths]
+        else:
+            speaker_names = [f"Speaker {i + 1}" for i in range(levels.shape[1])]
+    if len(speaker_names) != levels.shape[1]:
+        raise ValueError(f"Got {len(speaker_names)} speaker names for {levels.shape[1]} speakers")
+
+    labels = detect_turns(
+        levels, fps,
+        threshold_db=float(generate_config.get('SPEAKER_THRESHOLD_DB', -40)),
+        margin_db=float(generate_config.get('SPEAKER_MARGIN_DB', 6)),
+        min_turn=float(generate_config.get('MIN_TURN_SECONDS', 1.0)),
+    )
+    segments = turns_to_segments(labels, fps, speaker_names, generate_config.get('CHARACTER_MAPPING'))
+    logger.info(f"Found {len(segments)} turns in {len(labels) / fps:.2f}s of audio")
+    return segments
+
+
+def main():
+    """Write a JSON timestamps file from per-speaker audio tracks."""
+    parser = argparse.ArgumentParser(description='Generate timestamps from per-speaker audio tracks')
+    parser.add_argument('audio', nargs='+',
+                        help='One audio file per speaker, or one multichannel file with one speaker per channel')
+    parser.add_argument('--speakers', help='Comma separated character names, in file or channel order')
+    parser.add_argument('--output', help='Write the JSON segment list to this file instead of stdout')
+    parser.add_argument('--resolution', type=int, help='Analysis frames per second (overrides TIMESTAMP_RESOLUTION)')
+    parser.add_argument('--threshold-db', type=float, help='Loudness needed to take the floor (overrides SPEAKER_THRESHOLD_DB)')
+    parser.add_argument('--margin-db', type=float, help='Lead over the next speaker needed to take the floor (overrides SPEAKER_MARGIN_DB)')
+    parser.add_argument('--min-turn', type=float, help='Minimum turn length in seconds (overrides MIN_TURN_SECONDS)')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, config['LOG_LEVEL']),
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stderr)]
+    )
+
+    generate_config = dict(config)
+    if args.resolution:
+        generate_config['TIMESTAMP_RESOLUTION'] = args.resolution
+    if args.threshold_db is not None:
+        generate_config['SPEAKER_THRESHOLD_DB'] = args.threshold_db
+    if args.margin_db is not None:
+        generate_config['SPEAKER_MARGIN_DB'] = args.margin_db
+    if args.min_turn is not None:
+        generate_config['MIN_TURN_SECONDS'] = args.min_turn
+
+    for path in args.audio:
+        if not os.path.exists(path):
+            logger.error(f"Audio file not found: {path}")
+            return 1
+    speakers = [name.strip() for name in args.speakers.split(',')] if args.speakers else None
+
+    try:
+        segments = generate_timestamps(args.audio, speakers, generate_config)
+    except (ValueError, RuntimeError) as e:
+        logger.error(str(e))
+        return 1
+
+    output = json.dumps(segments, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        logger.info(f"Wrote {len(segments)} segments to {args.output}")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
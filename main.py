@@ -1,114 +1,45 @@
 import os
 import argparse
 import logging
-import json
 import sys
 from datetime import datetime
 
-from video_editor import VideoEditor
+from segment_plan import compile_plan
 from config import config
 
-def validate_timestamps_file(file_path):
+def validate_timestamps_file(file_path, character_mapping=None):
     """
     Validate that the timestamps file is properly formatted (JSON or TXT).
     
     Args:
         file_path: Path to the timestamps file
+        character_mapping: Optional custom character to video mapping
         
     Returns:
-        bool: True if valid, raises exception if invalid
+        SegmentPlan: The compiled plan, raises exception if invalid
     """
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"Timestamps file not found: {file_path}")
-    
-    file_extension = os.path.splitext(file_path)[1].lower()
-    
-    if file_extension == '.txt':
-        return validate_txt_format(file_path)
-    elif file_extension == '.json':
-        return validate_json_format(file_path)
-    else:
-        # Try to detect format automatically - first check if it looks like JSON
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                first_char = f.read(1)
-            if first_char in ['{', '[']:
-                return validate_json_format(file_path)
-            else:
-                return validate_txt_format(file_path)
-        except:
-            return validate_txt_format(file_path)
+    return compile_plan(file_path, character_mapping)
 
-def validate_json_format(file_path):
-    """Validate JSON format timestamps file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Check if it's a list of segments or a dictionary of timestamps
-        if isinstance(data, list):
-            # Validate each segment has required fields
-            for i, segment in enumerate(data):
-                if not all(k in segment for k in ['video', 'start', 'end']):
-                    raise ValueError(f"Segment {i} is missing required fields (video, start, end)")
-        elif isinstance(data, dict):
-            # Validate each timestamp entry
-            for video_path, times in data.items():
-                if not all(k in times for k in ['start_time', 'end_time']):
-                    raise ValueError(f"Entry for {video_path} is missing required fields (start_time, end_time)")
-        else:
-            raise ValueError("JSON must be either a list of segments or a dictionary of timestamps")
-            
-        return True
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Invalid JSON format: {str(e)}")
-
-def validate_txt_format(file_path):
-    """Validate TXT format timestamps file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        timestamp_count = 0
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Check if line contains timestamp
-            if ':' in line and len(line.split()) >= 2:
-                parts = line.split(' ', 1)
-                if len(parts) >= 2:
-                    time_part = parts[0]
-                    # Validate time format
-                    if is_valid_time_format(time_part):
-                        timestamp_count += 1
+def check_plan_media(plan, probe_config):
+    """
+    Probe every video the plan maps characters to, through the probe cache.
+    
+    Args:
+        plan: Compiled SegmentPlan
+        probe_config: Configuration dictionary with CACHE_DIR, OUTPUT_DIR and PREFLIGHT_WORKERS
         
-        if timestamp_count == 0:
-            raise ValueError("No valid timestamps found in TXT file")
-            
-        return True
-    except Exception as e:
-        raise ValueError(f"Invalid TXT format: {str(e)}")
-
-def is_valid_time_format(time_str):
-    """Check if string is in valid time format (MM:SS or HH:MM:SS)."""
-    try:
-        parts = time_str.split(':')
-        if len(parts) == 2:
-            # MM:SS format
-            int(parts[0])  # Minutes
-            int(parts[1])  # Seconds
-            return True
-        elif len(parts) == 3:
-            # HH:MM:SS format
-            int(parts[0])  # Hours
-            int(parts[1])  # Minutes
-            int(parts[2])  # Seconds
-            return True
-        return False
-    except ValueError:
-        return False
+    Returns:
+        list: Descriptions of missing, unreadable or video-less files
+    """
+    from media_probe import ProbeCache
+    
+    cache_dir = probe_config.get('CACHE_DIR') or os.path.join(probe_config['OUTPUT_DIR'], '.cache')
+    videos = list(dict.fromkeys(
+        path for segment in plan.to_segments() for path in (segment['video'], segment.get('idle')) if path
+    ))
+    probe_cache = ProbeCache(os.path.join(cache_dir, 'media_probe.json'))
+    _, problems = probe_cache.check([], video_paths=videos, workers=int(probe_config.get('PREFLIGHT_WORKERS', 8)))
+    return problems
 
 def check_file_exists(file_path, description):
     """Check if a file exists and raise an error if it doesn't."""
@@ -124,6 +55,48 @@ def main():
     parser.add_argument('--timestamps', help='Path to the timestamps file (JSON or TXT format)')
     parser.add_argument('--output', help='Name of the output video file')
     parser.add_argument('--output-dir', help='Directory for output files')
+    parser.add_argument('--render-mode', choices=['compose', 'tiles'],
+                        help='Render mode: compose (re-encode every frame) or tiles (stream-copy loop tiles)')
+    parser.add_argument('--workers', type=int,
+                        help='Number of worker processes rendering chunks in parallel')
+    parser.add_argument('--window-seconds', type=float,
+                        help='Render in fixed time windows (e.g. 300) to keep memory constant on long episodes')
+    parser.add_argument('--render-cache', action='store_true',
+                        help='Reuse previously rendered segments and only re-encode the ones that changed')
+    parser.add_argument('--frame-cache-mb', type=int,
+                        help='Decode each character loop once and keep up to this many MB of frames in memory')
+    parser.add_argument('--audio-mode', choices=['clip', 'mux'],
+                        help='Audio handling in compose mode: clip (moviepy audio track) or mux (mux the audio file once)')
+    parser.add_argument('--encoder', choices=['moviepy', 'pipe'],
+                        help='Encoder backend: moviepy (write_videofile) or pipe (raw frames into one ffmpeg process)')
+    parser.add_argument('--preset', help='Encoding preset (e.g. ultrafast, veryfast, medium, slow)')
+    parser.add_argument('--crf', help='Constant rate factor (0-51, lower means better quality)')
+    parser.add_argument('--threads', type=int, help='Number of threads per encode')
+    parser.add_argument('--segment-keyframes', action='store_true',
+                        help='Start every segment with a keyframe so extract.py can cut speaker turns without re-encoding')
+    parser.add_argument('--loop-continuity', choices=['none', 'character', 'global'],
+                        help='Loop phase across segments: restart (none), resume per character, or follow the episode clock (global)')
+    parser.add_argument('--no-coalesce', action='store_true',
+                        help='Keep adjacent segments of the same video separate')
+    parser.add_argument('--subtitles', choices=['off', 'srt', 'burn'],
+                        help='Write an .srt sidecar from the script dialogue (srt) and also burn the captions in (burn)')
+    parser.add_argument('--subtitle-font', help='TrueType font for burned-in captions')
+    parser.add_argument('--visualizer', choices=['off', 'spectrum', 'waveform'],
+                        help='Draw animated audio bars: frequency spectrum or scrolling waveform')
+    parser.add_argument('--stage-layout',
+                        help='JSON file or string of a stage layout showing every character at once (size, background, active, characters)')
+    parser.add_argument('--renditions',
+                        help='JSON file or string listing output renditions (name, width, height, fit, crop, codec, preset, crf)')
+    parser.add_argument('--preview', action='store_true',
+                        help='Render a fast low-resolution preview from cached proxies, with the original audio')
+    parser.add_argument('--preview-range',
+                        help='With --preview, only render this part of the episode (e.g. 01:30-02:45)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only compile and validate the timestamps file, probe the mapped videos and print the segment plan as JSON')
+    parser.add_argument('--plan-output', help='With --dry-run, write the segment plan to this file instead of stdout')
+    parser.add_argument('--strict', action='store_true',
+                        help='With --dry-run, fail when the plan has gaps, overlaps or empty segments, or a video is missing, unreadable or has no video stream')
+    parser.add_argument('--metrics', help='Write timing spans and progress (fps, ETA) as JSON lines to this file')
     args = parser.parse_args()
     
     # Update config with command line arguments if provided
@@ -133,6 +106,48 @@ def main():
         config['TIMESTAMPS_FILE'] = args.timestamps
     if args.output_dir:
         config['OUTPUT_DIR'] = args.output_dir
+    if args.render_mode:
+        config['RENDER_MODE'] = args.render_mode
+    if args.audio_mode:
+        config['AUDIO_MODE'] = args.audio_mode
+    if args.encoder:
+        config['ENCODER_BACKEND'] = args.encoder
+    if args.preset:
+        config['ENCODING_PRESET'] = args.preset
+    if args.crf:
+        config['CRF_VALUE'] = args.crf
+    if args.threads:
+        config['THREADS'] = args.threads
+    if args.segment_keyframes:
+        config['FORCE_SEGMENT_KEYFRAMES'] = True
+    if args.metrics:
+        config['METRICS_FILE'] = args.metrics
+    if args.workers:
+        config['WORKERS'] = args.workers
+    if args.window_seconds:
+        config['WINDOW_SECONDS'] = args.window_seconds
+    if args.render_cache:
+        config['RENDER_CACHE'] = True
+    if args.frame_cache_mb is not None:
+        config['FRAME_CACHE_MB'] = args.frame_cache_mb
+    if args.loop_continuity:
+        config['LOOP_CONTINUITY'] = args.loop_continuity
+    if args.no_coalesce:
+        config['COALESCE_SEGMENTS'] = False
+    if args.subtitles:
+        config['SUBTITLES'] = args.subtitles
+    if args.subtitle_font:
+        config['SUBTITLE_FONT'] = args.subtitle_font
+    if args.visualizer:
+        config['VISUALIZER'] = args.visualizer
+    if args.stage_layout:
+        config['STAGE_LAYOUT'] = args.stage_layout
+    if args.renditions:
+        config['RENDITIONS'] = args.renditions
+    if args.preview:
+        config['PREVIEW'] = True
+    if args.preview_range:
+        config['PREVIEW_RANGE'] = args.preview_range
     
     # Set up logging
     log_file = os.path.join(config['OUTPUT_DIR'], f"podcast_automation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
@@ -141,30 +156,54 @@ def main():
         format='%(asctime)s - %(levelname)s - %(message)s',
         handlers=[
             logging.FileHandler(log_file),
-            logging.StreamHandler(sys.stdout)
+            # Keep stdout clean for the plan JSON in dry-run mode
+            logging.StreamHandler(sys.stderr if args.dry_run else sys.stdout)
         ]
     )
     logger = logging.getLogger(__name__)
     
     # Output file name (default or from args)
-    output_filename = args.output or f"podcast_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
+    output_prefix = 'preview' if args.preview else 'podcast'
+    output_filename = args.output or f"{output_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
     
     try:
         # Validate inputs
         logger.info("Validating input files...")
-        check_file_exists(config['AUDIO_FILE'], "Audio file")
         check_file_exists(config['TIMESTAMPS_FILE'], "Timestamps file")
-        validate_timestamps_file(config['TIMESTAMPS_FILE'])
+        plan = validate_timestamps_file(config['TIMESTAMPS_FILE'], config.get('CHARACTER_MAPPING'))
+        problems = plan.issues()
+        for problem in problems:
+            logger.warning(problem)
+        
+        if args.dry_run:
+            for problem in check_plan_media(plan, config):
+                logger.warning(problem)
+                problems.append(problem)
+            if args.plan_output:
+                with open(args.plan_output, 'w', encoding='utf-8') as f:
+                    f.write(plan.to_json(indent=2))
+            else:
+                print(plan.to_json(indent=2))
+            return 1 if args.strict and problems else 0
+        
+        check_file_exists(config['AUDIO_FILE'], "Audio file")
+        
+        # Imported here so dry runs never load the editor and moviepy.editor
+        from video_editor import VideoEditor
         
         # Create video editor and generate video
         logger.info("Initializing video editor...")
-        video_editor = VideoEditor(config)
+        video_editor = VideoEditor(config, plan=plan)
         
         logger.info(f"Generating podcast video: {output_filename}")
-        output_path = video_editor.create_final_video(output_filename)
+        try:
+            output_path = video_editor.create_final_video(output_filename)
+        finally:
+            video_editor.close()
+        output_paths = output_path if isinstance(output_path, list) else [output_path]
         
-        logger.info(f"Video created successfully! Output: {output_path}")
-        print(f"\nSuccess! Your podcast video has been created at: {output_path}")
+        logger.info(f"Video created successfully! Output: {', '.join(output_paths)}")
+        print(f"\nSuccess! Your podcast video has been created at: {', '.join(output_paths)}")
         
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
@@ -0,0 +1,175 @@
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg_utils import probe_audio_codec, is_image, STILL_LOOP_SECONDS
+from render_cache import file_fingerprint
+
+
+def probe_media(media_path):
+    """
+    Read the metadata of an audio or video file with ffmpeg.
+
+    Still images are reported as STILL_LOOP_SECONDS long, with 'still' set.
+
+    Returns:
+        dict: duration, fps and size (None for audio-only files), audio codec and still
+    """
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    infos = ffmpeg_parse_infos(media_path)
+    still = is_image(media_path)
+    return {
+        'duration': STILL_LOOP_SECONDS if still else infos['duration'],
+        'fps': infos.get('video_fps') if infos.get('video_found') and not still else None,
+        'size': list(infos['video_size']) if infos.get('video_found') else None,
+        'audio_codec': probe_audio_codec(media_path) if infos.get('audio_found') else None,
+        'still': still,
+    }
+
+
+class ProbeCache:
+    def __init__(self, cache_file):
+        """
+        On-disk cache of media metadata keyed by path, size and mtime.
+
+        A file that changes gets a new key, so stale entries are never
+        returned. The cache is safe to use from several threads.
+
+        Args:
+            cache_file: JSON file holding the cached metadata
+        """
+        self.cache_file = cache_file
+        self.entries = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Ignoring unreadable probe cache {cache_file}: {str(e)}")
+
+    def probe(self, media_path):
+        """
+        Get the metadata of a media file, probing it only on a cache miss.
+
+        Returns:
+            dict: duration, fps, size and audio codec
+        """
+        if not os.path.exists(media_path):
+            raise FileNotFoundError(f"Media file not found: {media_path}")
+
+        key = file_fingerprint(media_path)
+        with self._lock:
+            info = self.entries.get(key)
+        if info is None:
+            info = probe_media(media_path)
+            with self._lock:
+                self.entries[key] = info
+                self.dirty = True
+
+        info = dict(info)
+        if info['size'] is not None:
+            info['size'] = tuple(info['size'])
+        return info
+
+    def motion(self, media_path):
+        """
+        Return how much a video loop moves (0 for still images), measuring it only once.
+
+        Returns:
+            float: Largest mean absolute difference of any thumbnail block to the first frame (0-255)
+        """
+        from stills import measure_motion
+
+        info = self.probe(media_path)
+        if info.get('still'):
+            return 0.0
+        # Stored as block_motion: scores of the older whole-frame metric are not comparable
+        if info.get('block_motion') is None:
+            key = file_fingerprint(media_path)
+            info['block_motion'] = measure_motion(media_path)
+            with self._lock:
+                self.entries[key] = dict(self.entries.get(key, {}), block_motion=info['block_motion'])
+                self.dirty = True
+        return info['block_motion']
+
+    def duration(self, media_path):
+        """Return the duration of a media file in seconds."""
+        return self.probe(media_path)['duration']
+
+    def save(self):
+        """Write the cache to disk if anything changed."""
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            temp_path = self.cache_file + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.cache_file)
+            self.dirty = False
+
+    def check(self, media_paths, video_paths=(), workers=8):
+        """
+        Probe every media file concurrently and collect all problems.
+
+        Args:
+            media_paths: Paths of media files that may be audio only
+            video_paths: Paths of media files that must have a video stream
+            workers: Number of probing threads
+
+        Returns:
+            tuple: Metadata of every readable file keyed by path, and a list of problems
+        """
+        media_paths = list(dict.fromkeys(list(media_paths) + list(video_paths)))
+        video_paths = set(video_paths)
+        results = {}
+        problems = []
+
+        def probe_one(path):
+            try:
+                return path, self.probe(path), None
+            except FileNotFoundError:
+                return path, None, f"missing: {path}"
+            except Exception as e:
+                message = str(e).strip().splitlines()
+                return path, None, f"unreadable: {path} ({message[-1] if message else type(e).__name__})"
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for path, info, problem in executor.map(probe_one, media_paths):
+                if problem:
+                    problems.append(problem)
+                elif path in video_paths and info['size'] is None:
+                    problems.append(f"no video stream: {path}")
+                else:
+                    results[path] = info
+
+        self.save()
+        return results, problems
+
+    def preflight(self, media_paths, video_paths=(), workers=8):
+        """
+        Probe every media file concurrently and report all problems at once.
+
+        Args:
+            media_paths: Paths of media files that may be audio only
+            video_paths: Paths of media files that must have a video stream
+            workers: Number of probing threads
+
+        Returns:
+            dict: Metadata of every file, keyed by path
+        """
+        results, problems = self.check(media_paths, video_paths, workers)
+        if problems:
+            message = f"Preflight failed for {len(problems)} file(s):\n  " + '\n  '.join(problems)
+            if all(problem.startswith('missing') for problem in problems):
+                raise FileNotFoundError(message)
+            raise ValueError(message)
+        self.logger.info(f"Preflight OK: {len(results)} media files")
+        return results
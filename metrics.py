@@ -0,0 +1,118 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Metrics:
+    def __init__(self, path=None, callback=None, job_id=None, progress_interval=1.0):
+        """
+        Emit structured timing spans and render progress as JSON lines.
+
+        Every event is a dictionary with at least 'event' and 'time'. Events
+        are appended to path (one JSON object per line, flushed immediately)
+        and/or passed to callback. Without a sink, all methods are no-ops.
+
+        Args:
+            path: Optional JSON lines file
+            callback: Optional function called with every event dictionary
+            job_id: Optional identifier added to every event
+            progress_interval: Minimum seconds between two progress events
+        """
+        self.path = path
+        self.callback = callback
+        self.job_id = job_id
+        self.progress_interval = progress_interval
+        self._file = open(path, 'a', encoding='utf-8') if path else None
+        self._lock = threading.Lock()
+        self._progress = {}
+
+    @property
+    def enabled(self):
+        return self._file is not None or self.callback is not None
+
+    def emit(self, event, **fields):
+        """Emit one event."""
+        if not self.enabled:
+            return
+        record = {'event': event, 'time': round(time.time(), 3)}
+        if self.job_id is not None:
+            record['job'] = self.job_id
+        record.update(fields)
+        self._write(record)
+
+    def _write(self, record):
+        """Send one finished event to the sinks."""
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(record) + '\n')
+                self._file.flush()
+            if self.callback is not None:
+                self.callback(record)
+
+    def for_job(self, job_id):
+        """
+        Return a Metrics tagging every event with job_id and writing to the same sinks.
+
+        Used to share one metrics file between renders running concurrently.
+        """
+        if not self.enabled:
+            return Metrics(job_id=job_id, progress_interval=self.progress_interval)
+        return Metrics(callback=self._write, job_id=job_id, progress_interval=self.progress_interval)
+
+    @contextmanager
+    def span(self, name, **fields):
+        """Time a stage, emitting span_start and span_end events around it."""
+        started = time.time()
+        self.emit('span_start', span=name, **fields)
+        status = 'ok'
+        try:
+            yield
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            self.emit('span_end', span=name, status=status, duration=round(time.time() - started, 4), **fields)
+
+    def progress(self, stage, done, total, unit='frames'):
+        """
+        Report progress of a long running stage.
+
+        Events are throttled to one per progress_interval, plus the final one.
+        They carry the rate since the stage started and the estimated time left.
+
+        Args:
+            stage: Name of the stage (e.g. 'encode')
+            done: Units completed so far
+            total: Total units
+            unit: Name of the unit
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        state = self._progress.setdefault(stage, {'started': now, 'last': 0.0})
+        if done < total and now - state['last'] < self.progress_interval:
+            return
+        state['last'] = now
+
+        elapsed = now - state['started']
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 else None
+        self.emit(
+            'progress', stage=stage, unit=unit, done=done, total=total,
+            percent=round(100.0 * done / total, 2) if total else 100.0,
+            rate=round(rate, 2), elapsed=round(elapsed, 2),
+            eta_seconds=round(eta, 1) if eta is not None else None
+        )
+        if done >= total:
+            self._progress.pop(stage, None)
+
+    def progress_callback(self, stage, unit='frames'):
+        """Return a function (done, total) reporting progress for one stage."""
+        return lambda done, total: self.progress(stage, done, total, unit)
+
+    def close(self):
+        """Close the metrics file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,208 @@
+import os
+import logging
+import threading
+
+from timeline import Timeline
+from frame_cache import LoopFrameCache
+from encoders import FFmpegPipeEncoder
+from ffmpeg_utils import probe_video, run_ffmpeg, mux_audio
+from render_cache import RenderCache, file_fingerprint
+from segment_plan import parse_time
+from metrics import Metrics
+
+# Renders sharing a proxy directory in one process encode each proxy only once
+_proxy_locks = {}
+_proxy_locks_guard = threading.Lock()
+
+
+def parse_time_range(value):
+    """
+    Parse a preview range such as "01:30-02:45" or "90-165" into seconds.
+
+    Either side may be empty ("10:00-" or "-1:00").
+
+    Returns:
+        tuple: (start, end) in seconds; end is None for "until the end"
+    """
+    if '-' not in value:
+        raise ValueError(f"Invalid time range (expected START-END): {value}")
+    start, end = value.split('-', 1)
+    start = parse_time(start.strip()) if start.strip() else 0.0
+    end = parse_time(end.strip()) if end.strip() else None
+    if end is not None and end <= start:
+        raise ValueError(f"Invalid time range (end before start): {value}")
+    return start, end
+
+
+def audio_ranges(segments, start=0.0, end=None):
+    """
+    Map an output time range to the audio ranges of the segments it covers.
+
+    Args:
+        segments: List of segment dictionaries, in output order
+        start: Start of the range in output time
+        end: End of the range in output time (None for the end of the episode)
+
+    Returns:
+        list: List of (start, end) tuples in audio time
+    """
+    ranges = []
+    offset = 0.0
+    for segment in segments:
+        duration = segment['end'] - segment['start']
+        if duration <= 0:
+            continue
+        lo = max(start, offset)
+        hi = offset + duration if end is None else min(end, offset + duration)
+        if hi > lo:
+            ranges.append((segment['start'] + lo - offset, segment['start'] + hi - offset))
+        offset += duration
+    return ranges
+
+
+class ProxyCache:
+    def __init__(self, cache_dir, fps, height, probe=None):
+        """
+        Cache of downscaled, low frame rate copies of the character loops.
+
+        Proxies are encoded once per source file, frame rate and height, and
+        reused by every later preview.
+
+        Args:
+            cache_dir: Directory where the proxies are kept
+            fps: Frame rate of the proxies
+            height: Height of the proxies in pixels (width keeps the aspect ratio)
+            probe: Optional function returning media metadata (e.g. ProbeCache.probe)
+        """
+        self.fps = fps
+        self.height = height
+        self.probe = probe or probe_video
+        self.proxy_dir = os.path.join(cache_dir, 'proxies')
+        os.makedirs(self.proxy_dir, exist_ok=True)
+        self.logger = logging.getLogger(__name__)
+
+    def get(self, video_path):
+        """
+        Get the proxy of a character loop, encoding it if needed.
+
+        Returns:
+            str: Path of the proxy
+        """
+        key = RenderCache.make_key(file_fingerprint(video_path), self.fps, self.height)
+        info = self.probe(video_path)
+        # Images stay images, so they are still decoded as a single frame
+        still = bool(info.get('still'))
+        proxy_path = os.path.join(self.proxy_dir, f"{key}.png" if still else f"{key}.mp4")
+
+        with _proxy_locks_guard:
+            lock = _proxy_locks.setdefault(proxy_path, threading.Lock())
+        with lock:
+            if not os.path.exists(proxy_path):
+                # Never upscale small sources
+                height = min(self.height, info['size'][1])
+                self.logger.info(f"Encoding {height}p proxy of {video_path}")
+                temp_path = f"{proxy_path}.{os.getpid()}.part{os.path.splitext(proxy_path)[1]}"
+                if still:
+                    run_ffmpeg(['-i', video_path, '-vf', f"scale=-2:{height - height % 2}", '-frames:v', '1', temp_path])
+                else:
+                    run_ffmpeg([
+                        '-i', video_path, '-an',
+                        '-vf', f"fps={self.fps},scale=-2:{height - height % 2}",
+                        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '28', '-pix_fmt', 'yuv420p',
+                        temp_path
+                    ])
+                os.replace(temp_path, proxy_path)
+        return proxy_path
+
+
+class PreviewRenderer:
+    def __init__(self, config, cache_dir, metrics=None, probe=None):
+        """
+        Initialize the PreviewRenderer.
+
+        Renders the timeline from cached proxies at a low frame rate with the
+        ultrafast preset and muxes the original audio, optionally only for
+        part of the episode.
+
+        Args:
+            config: Dictionary containing configuration parameters
+            cache_dir: Directory where the proxies are kept
+            metrics: Optional Metrics receiving timing spans and progress events
+            probe: Optional function returning media metadata (e.g. ProbeCache.probe)
+        """
+        self.config = config
+        self.metrics = metrics or Metrics()
+        self.probe = probe or probe_video
+        self.fps = int(config.get('PREVIEW_FPS', 12))
+        self.video_audio_codec = config.get('VIDEO_AUDIO_CODEC', 'aac')
+        self.proxies = ProxyCache(cache_dir, self.fps, int(config.get('PREVIEW_HEIGHT', 360)), self.probe)
+        self.logger = logging.getLogger(__name__)
+
+    def encoding_config(self):
+        """Encoding settings of the preview: fast to encode, not to archive."""
+        preview_config = dict(self.config)
+        preview_config.update({
+            'ENCODING_PRESET': 'ultrafast',
+            'CRF_VALUE': self.config.get('PREVIEW_CRF', '30'),
+            'X264_TUNE': None,
+            'KEYFRAME_INTERVAL': None,
+        })
+        return preview_config
+
+    def render(self, segments, audio_file, output_path, time_range=None, overlay=None):
+        """
+        Render a preview of the episode.
+
+        Args:
+            segments: List of segment dictionaries with video path, start and end times
+            audio_file: Path to the source audio file
+            output_path: Path of the preview
+            time_range: Optional (start, end) in output seconds; end may be None
+            overlay: Optional layer drawn over every frame (e.g. a SubtitleLayer)
+
+        Returns:
+            str: Path to the created preview
+        """
+        segments = [s for s in segments if s['end'] - s['start'] > 0]
+        if not segments:
+            raise ValueError("No valid segments to process")
+
+        videos = list(dict.fromkeys(s['video'] for s in segments))
+        with self.metrics.span('proxies', videos=len(videos)):
+            proxies = {path: self.proxies.get(path) for path in videos}
+
+        timeline = Timeline.from_segments([dict(s, video=proxies[s['video']]) for s in segments], self.fps)
+        timeline.overlay = overlay
+        start, end = time_range or (0.0, None)
+        if time_range is not None:
+            first_frame = min(int(round(start * self.fps)), timeline.total_frames)
+            last_frame = timeline.total_frames if end is None else min(int(round(end * self.fps)), timeline.total_frames)
+            if last_frame <= first_frame:
+                raise ValueError(f"Preview range starts after the end of the episode ({timeline.duration:.2f}s)")
+            timeline = timeline.slice(first_frame, last_frame)
+            start, end = first_frame / self.fps, last_frame / self.fps
+
+        # Proxies are small, so every loop is decoded into memory once
+        loops = LoopFrameCache(int(self.config.get('PREVIEW_CACHE_MB', 1024)) * 1024 * 1024, self.fps,
+                               probe=self.probe)
+        video_only_path = output_path + '.video.mp4'
+        try:
+            with self.metrics.span('open_clips', videos=len(timeline.videos)):
+                timeline.bind({path: loops.get(path) for path in timeline.videos})
+            self.logger.info(
+                f"Rendering {timeline.duration:.2f}s preview at {self.fps} fps, {timeline.size[0]}x{timeline.size[1]}"
+            )
+            progress = self.metrics.progress_callback('encode') if self.metrics.enabled else None
+            with self.metrics.span('encode', frames=timeline.total_frames):
+                FFmpegPipeEncoder(self.encoding_config(), progress=progress).encode(timeline, video_only_path)
+            with self.metrics.span('mux'):
+                mux_audio(
+                    video_only_path, audio_file, audio_ranges(segments, start, end),
+                    output_path, audio_codec=self.video_audio_codec
+                )
+        finally:
+            loops.clear()
+            if os.path.exists(video_only_path):
+                os.remove(video_only_path)
+
+        return output_path
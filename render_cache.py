@@ -0,0 +1,92 @@
+import os
+import hashlib
+import logging
+
+
+def file_fingerprint(path):
+    """Identify a file by its absolute path, size and modification time."""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class RenderCache:
+    def __init__(self, cache_dir, max_bytes):
+        """
+        Initialize an on-disk, content-addressed cache of rendered files.
+
+        Entries are evicted least recently used first once the cache grows
+        beyond max_bytes. Access times are tracked through file mtimes.
+
+        Args:
+            cache_dir: Directory holding the cached files
+            max_bytes: Size limit of the cache in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash the given key parts into a cache key."""
+        return hashlib.sha256('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+    def path_for(self, key, extension='.mp4'):
+        """Return the path an entry is stored at."""
+        return os.path.join(self.cache_dir, key[:2], key + extension)
+
+    def get(self, key, extension='.mp4'):
+        """
+        Look up a cached file and mark it as recently used.
+
+        Returns:
+            str: Path to the cached file, or None on a miss
+        """
+        path = self.path_for(key, extension)
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None)
+        return path
+
+    def put(self, key, source_path, extension='.mp4'):
+        """
+        Move a rendered file into the cache.
+
+        Returns:
+            str: Path to the cached file
+        """
+        path = self.path_for(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+        return path
+
+    def evict(self, keep=()):
+        """
+        Remove least recently used entries until the cache fits its size limit.
+
+        Args:
+            keep: Paths that must not be evicted
+        """
+        keep = {os.path.abspath(p) for p in keep}
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            os.remove(path)
+            total -= size
+            removed += 1
+
+        if removed:
+            self.logger.info(f"Evicted {removed} cached renders, cache size now {total / 1e6:.1f} MB")
@@ -0,0 +1,268 @@
+import os
+import json
+import logging
+import subprocess
+
+import numpy as np
+
+from ffmpeg_utils import get_ffmpeg_binary, video_encoding_args
+from encoders import keyframe_args
+
+# Settings a rendition may override, by rendition key
+RENDITION_SETTINGS = {
+    'codec': 'VIDEO_CODEC',
+    'preset': 'ENCODING_PRESET',
+    'crf': 'CRF_VALUE',
+    'tune': 'X264_TUNE',
+}
+
+def load_renditions(value):
+    """
+    Load rendition specs from a JSON file, a JSON string or a list.
+
+    Each rendition is a dictionary with "name", "width" and "height", and
+    optionally "fit" (crop, pad or stretch; default crop), "crop" (an
+    explicit [x, y, width, height] box on the canvas), "codec", "preset",
+    "crf" and "tune".
+
+    Returns:
+        list: Validated rendition dictionaries
+    """
+    if isinstance(value, str):
+        if os.path.exists(value):
+            with open(value, 'r', encoding='utf-8') as f:
+                value = f.read()
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid renditions JSON: {str(e)}")
+    if not isinstance(value, list) or not value:
+        raise ValueError("Renditions must be a non-empty list")
+
+    renditions = []
+    names = set()
+    for i, rendition in enumerate(value):
+        if not all(k in rendition for k in ['name', 'width', 'height']):
+            raise ValueError(f"Rendition {i} is missing required fields (name, width, height)")
+        if rendition['name'] in names:
+            raise ValueError(f"Duplicate rendition name: {rendition['name']}")
+        if rendition.get('fit', 'crop') not in ('crop', 'pad', 'stretch'):
+            raise ValueError(f"Rendition {rendition['name']} has an invalid fit: {rendition['fit']}")
+        if int(rendition['width']) % 2 or int(rendition['height']) % 2:
+            raise ValueError(f"Rendition {rendition['name']} needs an even width and height for yuv420p")
+        names.add(rendition['name'])
+        renditions.append(dict(rendition, width=int(rendition['width']), height=int(rendition['height'])))
+    return renditions
+
+
+def rendition_path(output_path, rendition):
+    """Return the output path of a rendition, e.g. episode_720p.mp4."""
+    base, extension = os.path.splitext(output_path)
+    return f"{base}_{rendition['name']}{extension or '.mp4'}"
+
+
+class FrameScaler:
+    def __init__(self, canvas_size, rendition):
+        """
+        Crop and scale canvas frames to a rendition with precomputed indices.
+
+        Integer downscales are box-filtered by summing strided slices in
+        uint16; other ratios use bilinear interpolation with precomputed
+        taps and weights. The same geometry is available as an ffmpeg
+        filter chain (see filter), which MultiRenditionEncoder uses so the
+        per-frame scaling runs inside ffmpeg.
+
+        Args:
+            canvas_size: (width, height) of the timeline frames
+            rendition: Rendition dictionary
+        """
+        canvas_width, canvas_height = canvas_size
+        width, height = rendition['width'], rendition['height']
+        fit = rendition.get('fit', 'crop')
+
+        # Source box on the canvas
+        if rendition.get('crop'):
+            x, y, box_width, box_height = [int(v) for v in rendition['crop']]
+        elif fit == 'crop':
+            box_width = min(canvas_width, int(round(canvas_height * width / height)))
+            box_height = min(canvas_height, int(round(canvas_width * height / width)))
+            x, y = (canvas_width - box_width) // 2, (canvas_height - box_height) // 2
+        else:
+            x, y, box_width, box_height = 0, 0, canvas_width, canvas_height
+        if x < 0 or y < 0 or x + box_width > canvas_width or y + box_height > canvas_height:
+            raise ValueError(f"Crop box of rendition {rendition['name']} is outside the {canvas_width}x{canvas_height} canvas")
+        self.box = (slice(y, y + box_height), slice(x, x + box_width))
+        self.box_geometry = (x, y, box_width, box_height)
+        self.canvas_size = (canvas_width, canvas_height)
+
+        # Scaled size and its position on the output frame
+        if fit == 'pad':
+            scale = min(width / box_width, height / box_height)
+            scaled = (max(2, int(box_width * scale) // 2 * 2), max(2, int(box_height * scale) // 2 * 2))
+        else:
+            scaled = (width, height)
+        self.scaled = scaled
+        self.offset = ((width - scaled[0]) // 2, (height - scaled[1]) // 2)
+        self.size = (width, height)
+        self.identity = (box_width, box_height) == scaled
+
+        self.factor = None
+        # Sums of up to 16x16 uint8 pixels fit in uint16
+        if box_width % scaled[0] == 0 and box_height % scaled[1] == 0 \
+                and box_width // scaled[0] == box_height // scaled[1] and box_width // scaled[0] <= 16:
+            self.factor = box_width // scaled[0]
+        else:
+            self.y0, self.y1, self.wy = self._taps(box_height, scaled[1])
+            self.x0, self.x1, self.wx = self._taps(box_width, scaled[0])
+
+    @staticmethod
+    def _taps(source, target):
+        """Source indices and weights of a bilinear resize along one axis."""
+        positions = np.clip((np.arange(target) + 0.5) * source / target - 0.5, 0, source - 1)
+        first = np.floor(positions).astype(np.intp)
+        second = np.minimum(first + 1, source - 1)
+        weight = (positions - first).astype(np.float32)
+        return first, second, weight
+
+    def _resize(self, frame):
+        if self.identity:
+            return frame
+        if self.factor is not None:
+            factor = self.factor
+            total = np.zeros((self.scaled[1], self.scaled[0], 3), dtype=np.uint16)
+            for dy in range(factor):
+                for dx in range(factor):
+                    total += frame[dy::factor, dx::factor]
+            area = factor * factor
+            total += area // 2
+            if area & (area - 1) == 0:
+                total >>= area.bit_length() - 1
+            else:
+                total //= area
+            return total.astype(np.uint8)
+
+        wy = self.wy[:, None, None]
+        wx = self.wx[None, :, None]
+        top = frame[self.y0].astype(np.float32)
+        bottom = frame[self.y1].astype(np.float32)
+        rows = top + (bottom - top) * wy
+        left = rows[:, self.x0]
+        right = rows[:, self.x1]
+        return (left + (right - left) * wx + 0.5).astype(np.uint8)
+
+    def filter(self):
+        """
+        Return the ffmpeg filter chain producing this rendition from a canvas frame.
+
+        Returns:
+            str: Comma separated crop, scale and pad filters ('null' when the canvas is used as it is)
+        """
+        x, y, box_width, box_height = self.box_geometry
+        filters = []
+        if (box_width, box_height) != self.canvas_size:
+            filters.append(f"crop={box_width}:{box_height}:{x}:{y}")
+        if not self.identity:
+            # Area averaging for downscales, like the box filter above
+            downscale = self.scaled[0] <= box_width and self.scaled[1] <= box_height
+            filters.append(f"scale={self.scaled[0]}:{self.scaled[1]}:flags={'area' if downscale else 'bilinear'}")
+        if self.scaled != self.size:
+            filters.append(f"pad={self.size[0]}:{self.size[1]}:{self.offset[0]}:{self.offset[1]}:black")
+        return ','.join(filters) or 'null'
+
+    def __call__(self, frame):
+        """Return the rendition frame for one canvas frame."""
+        scaled = self._resize(frame[self.box][:, :, :3])
+        if self.scaled == self.size:
+            return np.ascontiguousarray(scaled)
+        out = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+        x, y = self.offset
+        out[y:y + self.scaled[1], x:x + self.scaled[0]] = scaled
+        return out
+
+
+class MultiRenditionEncoder:
+    def __init__(self, config, renditions, progress=None):
+        """
+        Encode one timeline into several renditions from a single frame pass.
+
+        Every timeline frame is produced once and written once into a single
+        ffmpeg process. Its filter graph splits the canvas and crops, scales
+        and pads it for each rendition (see FrameScaler.filter). Each
+        rendition then has its own encoder, and the encoders run in parallel
+        inside ffmpeg.
+
+        Args:
+            config: Dictionary containing configuration parameters
+            renditions: Rendition dictionaries (see load_renditions)
+            progress: Optional function called with (frames done, total frames)
+        """
+        self.config = config
+        self.renditions = renditions
+        self.progress = progress
+        self.logger = logging.getLogger(__name__)
+
+    def rendition_config(self, rendition):
+        """Return the encoding configuration of one rendition."""
+        rendition_config = dict(self.config)
+        for key, setting in RENDITION_SETTINGS.items():
+            if key in rendition:
+                rendition_config[setting] = rendition[key]
+        return rendition_config
+
+    def command(self, timeline, output_paths):
+        """Build the ffmpeg command encoding every rendition from raw canvas frames on stdin."""
+        width, height = timeline.size
+        count = len(self.renditions)
+        graph = f"[0:v]split={count}" + ''.join(f"[s{i}]" for i in range(count))
+        for i, rendition in enumerate(self.renditions):
+            graph += f";[s{i}]{FrameScaler(timeline.size, rendition).filter()}[v{i}]"
+
+        cmd = [
+            get_ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}",
+            '-r', str(timeline.fps), '-i', '-', '-filter_complex', graph,
+        ]
+        for i, (rendition, output_path) in enumerate(zip(self.renditions, output_paths)):
+            rendition_config = self.rendition_config(rendition)
+            cmd += ['-map', f"[v{i}]", '-an'] + video_encoding_args(rendition_config) \
+                + keyframe_args(rendition_config, timeline) + [output_path]
+        return cmd
+
+    def encode(self, timeline, output_paths):
+        """
+        Encode a bound timeline into video-only files, one per rendition.
+
+        Args:
+            timeline: Timeline bound to its sources
+            output_paths: Output path of each rendition, in rendition order
+
+        Returns:
+            list: The output paths
+        """
+        cmd = self.command(timeline, output_paths)
+        width, height = timeline.size
+        canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for frame_index in range(timeline.total_frames):
+                frame = timeline.frame_at(frame_index, out=canvas)
+                process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+                if self.progress is not None:
+                    self.progress(frame_index + 1, timeline.total_frames)
+            process.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg exited early; its error message is reported below
+            pass
+        finally:
+            if not process.stdin.closed:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+            error = process.stderr.read().decode('utf-8', errors='replace').strip()
+            process.wait()
+
+        if process.returncode != 0:
+            names = ', '.join(r['name'] for r in self.renditions)
+            raise RuntimeError(f"ffmpeg failed encoding renditions {names} ({process.returncode}): {error[-2000:]}")
+        return list(output_paths)
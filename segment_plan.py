@@ -0,0 +1,368 @@
+"""
+Compile timestamps scripts (TXT or JSON) into an immutable segment plan.
+
+This module only depends on the standard library, so scripts can be
+validated without importing moviepy.
+"""
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default character to video mapping
+DEFAULT_CHARACTER_MAPPING = {
+    '말하는 감자': 'input/말하는 감자.mov',
+    '말하는 토마토': 'input/말하는 토마토.mov',
+}
+
+# Marker for "until the end of the audio file"
+END = 'end'
+
+
+def is_valid_time_format(time_str):
+    """Check if string is in valid time format (MM:SS or HH:MM:SS)."""
+    try:
+        parts = time_str.split(':')
+        if len(parts) == 2:
+            # MM:SS format
+            int(parts[0])  # Minutes
+            int(parts[1])  # Seconds
+            return True
+        elif len(parts) == 3:
+            # HH:MM:SS format
+            int(parts[0])  # Hours
+            int(parts[1])  # Minutes
+            int(parts[2])  # Seconds
+            return True
+        return False
+    except ValueError:
+        return False
+
+
+def parse_time(time_value, audio_duration=None):
+    """
+    Parse time values in various formats to seconds.
+
+    Args:
+        time_value: Time value in seconds (float/int), string format "MM:SS", or "end"
+        audio_duration: Duration of the audio file, used for "end"
+
+    Returns:
+        float: Time in seconds, or None for "end" when the audio duration is unknown
+    """
+    if isinstance(time_value, (int, float)):
+        return float(time_value)
+    elif isinstance(time_value, str):
+        # Handle special "end" keyword
+        if time_value.lower() == END:
+            return audio_duration
+        # Handle "MM:SS" format
+        elif ':' in time_value:
+            parts = time_value.split(':')
+            if len(parts) == 2:
+                return int(parts[0]) * 60 + float(parts[1])
+            elif len(parts) == 3:
+                return int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2])
+        # Try direct conversion
+        return float(time_value)
+    else:
+        raise ValueError(f"Invalid time format: {time_value}")
+
+
+class Segment:
+    """
+    One segment of the plan: a video shown from start to end (seconds).
+
+    When idle is set, video is the talking loop and idle is shown while the
+    character is silent. text holds the dialogue spoken in the segment.
+    """
+
+    __slots__ = ('video', 'start', 'end', 'character', 'idle', 'text')
+
+    def __init__(self, video, start, end, character=None, idle=None, text=None):
+        object.__setattr__(self, 'video', video)
+        object.__setattr__(self, 'start', start)
+        object.__setattr__(self, 'end', end)
+        object.__setattr__(self, 'character', character)
+        object.__setattr__(self, 'idle', idle)
+        object.__setattr__(self, 'text', text)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Segment is immutable")
+
+    def __repr__(self):
+        return (f"Segment(video={self.video!r}, start={self.start}, end={self.end}, "
+                f"character={self.character!r}, idle={self.idle!r}, text={self.text!r})")
+
+    def replace(self, **changes):
+        """Return a copy of the segment with some fields changed."""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return Segment(**fields)
+
+    def to_dict(self):
+        data = {'video': self.video, 'start': self.start, 'end': END if self.end is None else self.end}
+        if self.character is not None:
+            data['character'] = self.character
+        if self.idle is not None:
+            data['idle'] = self.idle
+        if self.text is not None:
+            data['text'] = self.text
+        return data
+
+
+class CharacterMatcher:
+    def __init__(self, character_mapping=None, default_dir='input'):
+        """
+        Resolve character names to video files.
+
+        Keys are matched case-insensitively, and a key also matches when one
+        name contains the other. A mapping value is either a video path or a
+        dictionary with a "talking" and an optional "idle" loop. The mapping
+        is lowered once and every name is resolved only once per matcher.
+
+        Args:
+            character_mapping: Custom mapping, merged over the default one
+            default_dir: Directory used for characters without a mapping
+        """
+        mapping = dict(DEFAULT_CHARACTER_MAPPING)
+        if character_mapping:
+            mapping.update(character_mapping)
+        self.keys = [(key.lower(), video_path) for key, video_path in mapping.items()]
+        self.default_dir = default_dir
+        self.resolved = {}
+
+    def match(self, character_name):
+        """Return the video path (or talking/idle dictionary) for a character name."""
+        if character_name in self.resolved:
+            return self.resolved[character_name]
+
+        character_lower = character_name.lower()
+        for key, video_path in self.keys:
+            if key in character_lower or character_lower in key:
+                logger.debug(f"Mapped character '{character_name}' to video '{video_path}'")
+                break
+        else:
+            # If no mapping found, use the character name as filename
+            video_path = f"{self.default_dir}/{character_name}.mov"
+            logger.warning(f"No mapping found for character '{character_name}', using default path: {video_path}")
+
+        self.resolved[character_name] = video_path
+        return video_path
+
+
+class SegmentPlan:
+    def __init__(self, segments, source=None):
+        """
+        An immutable, ordered list of segments compiled from a timestamps script.
+
+        Args:
+            segments: Iterable of Segment records
+            source: Path of the script the plan was compiled from
+        """
+        self.segments = tuple(segments)
+        self.source = source
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __getitem__(self, index):
+        return self.segments[index]
+
+    @property
+    def videos(self):
+        """Distinct video paths (talking and idle loops), in order of first use."""
+        paths = []
+        for segment in self.segments:
+            paths.append(segment.video)
+            if segment.idle is not None:
+                paths.append(segment.idle)
+        return list(dict.fromkeys(paths))
+
+    def resolve(self, audio_duration):
+        """Return a plan where open ends ("end") are replaced by the audio duration."""
+        return SegmentPlan(
+            (s.replace(end=audio_duration) if s.end is None else s for s in self.segments),
+            self.source
+        )
+
+    def issues(self, tolerance=1e-3):
+        """
+        Check the plan for invalid durations, gaps and overlaps.
+
+        Returns:
+            list: Human readable descriptions of every problem found
+        """
+        problems = []
+        for i, segment in enumerate(self.segments):
+            if segment.end is not None and segment.end - segment.start <= 0:
+                problems.append(f"Segment {i} has a non-positive duration ({segment.start:.3f}s - {segment.end:.3f}s)")
+            if i == 0 or self.segments[i - 1].end is None:
+                continue
+            previous_end = self.segments[i - 1].end
+            if segment.start - previous_end > tolerance:
+                problems.append(f"Gap of {segment.start - previous_end:.3f}s before segment {i} at {previous_end:.3f}s")
+            elif previous_end - segment.start > tolerance:
+                problems.append(f"Segment {i} overlaps the previous one by {previous_end - segment.start:.3f}s")
+        return problems
+
+    def to_segments(self):
+        """Return the segments as dictionaries, as used by the renderers."""
+        segments = []
+        for s in self.segments:
+            segment = {'video': s.video, 'start': s.start, 'end': s.end, 'character': s.character}
+            if s.idle is not None:
+                segment['idle'] = s.idle
+            if s.text is not None:
+                segment['text'] = s.text
+            segments.append(segment)
+        return segments
+
+    def to_json(self, indent=None):
+        """Serialize the plan to JSON."""
+        return json.dumps(
+            {'source': self.source, 'segments': [s.to_dict() for s in self.segments]},
+            ensure_ascii=False, indent=indent
+        )
+
+    @classmethod
+    def from_json(cls, text):
+        """Load a plan serialized with to_json."""
+        data = json.loads(text)
+        segments = [
+            Segment(s['video'], s['start'], None if s['end'] == END else s['end'],
+                    s.get('character'), s.get('idle'), s.get('text'))
+            for s in data['segments']
+        ]
+        return cls(segments, data.get('source'))
+
+
+def detect_format(file_path):
+    """Return 'txt' or 'json' for a timestamps file."""
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension in ('.txt', '.json'):
+        return file_extension[1:]
+
+    # Try to auto-detect format - check first character
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            first_char = f.read(1)
+        return 'json' if first_char in ['{', '['] else 'txt'
+    except (OSError, UnicodeDecodeError):
+        return 'txt'
+
+
+def _compile_json(file_path, audio_duration):
+    """Compile a JSON timestamps file."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON format: {str(e)}")
+
+    segments = []
+    if isinstance(data, dict):
+        # Specification format: video path -> start/end times ("start_time"/"end_time",
+        # or "start"/"end"); missing times default to 0 and show up as plan issues
+        for video_path, times in data.items():
+            if not isinstance(times, dict):
+                raise ValueError(f"Entry for {video_path} must be an object with start_time and end_time")
+            segments.append(Segment(
+                video_path,
+                parse_time(times.get('start_time', times.get('start', 0)), audio_duration),
+                parse_time(times.get('end_time', times.get('end', 0)), audio_duration),
+            ))
+        # Sort segments by start time
+        segments.sort(key=lambda s: s.start)
+    elif isinstance(data, list):
+        for i, segment in enumerate(data):
+            if not all(k in segment for k in ['video', 'start', 'end']):
+                raise ValueError(f"Segment {i} is missing required fields (video, start, end)")
+            segments.append(Segment(
+                segment['video'],
+                parse_time(segment['start'], audio_duration),
+                parse_time(segment['end'], audio_duration),
+                segment.get('character'),
+                segment.get('idle'),
+                segment.get('text'),
+            ))
+    else:
+        raise ValueError("JSON must be either a list of segments or a dictionary of timestamps")
+    return segments
+
+
+def _compile_txt(file_path, matcher, audio_duration):
+    """
+    Compile a TXT script.
+
+    Expected format:
+    MM:SS 캐릭터이름
+    대사내용
+
+    MM:SS 캐릭터이름
+    대사내용
+
+    Dialogue lines under a header are kept as the segment's text.
+    """
+    headers = []
+    dialogue = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            # Check if line starts with timestamp (MM:SS format)
+            if ':' in line and len(line.split()) >= 2:
+                parts = line.split(' ', 2)
+                if len(parts) >= 2 and is_valid_time_format(parts[0]):
+                    headers.append((parse_time(parts[0]), ' '.join(parts[1:])))
+                    dialogue.append([])
+                    continue
+            if dialogue:
+                dialogue[-1].append(line)
+
+    if not headers:
+        raise ValueError("Invalid TXT format: No valid timestamps found in TXT file")
+
+    segments = []
+    for i, (start_time, character) in enumerate(headers):
+        # Determine end time (next segment's start time or end of audio)
+        end_time = headers[i + 1][0] if i + 1 < len(headers) else audio_duration
+        video = matcher.match(character)
+        text = ' '.join(dialogue[i]) or None
+        if isinstance(video, dict):
+            segments.append(Segment(video['talking'], start_time, end_time, character, video.get('idle'), text))
+        else:
+            segments.append(Segment(video, start_time, end_time, character, text=text))
+    return segments
+
+
+def compile_plan(file_path, character_mapping=None, audio_duration=None):
+    """
+    Parse and validate a TXT or JSON timestamps file into a SegmentPlan.
+
+    Args:
+        file_path: Path to the timestamps file
+        character_mapping: Optional custom character to video mapping (TXT scripts)
+        audio_duration: Duration of the audio file; when None, "end" stays open
+            and can be filled in later with SegmentPlan.resolve
+
+    Returns:
+        SegmentPlan: The compiled plan
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Timestamps file not found: {file_path}")
+
+    if detect_format(file_path) == 'json':
+        segments = _compile_json(file_path, audio_duration)
+    else:
+        segments = _compile_txt(file_path, CharacterMatcher(character_mapping), audio_duration)
+
+    plan = SegmentPlan(segments, source=file_path)
+    logger.info(f"Compiled {len(plan)} segments from {file_path}")
+    return plan
@@ -0,0 +1,473 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import http.client
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import config
+from metrics import Metrics
+from batch import BatchRunner
+
+# Finished jobs kept for status queries; older ones are forgotten
+MAX_FINISHED_JOBS = 200
+
+# Decoded loop budget of the service when neither --frame-cache-mb nor
+# FRAME_CACHE_MB sets one; the memory watcher trims it under pressure
+DEFAULT_FRAME_CACHE_MB = 2048
+
+
+def available_memory_bytes():
+    """Return the memory available to new allocations (Linux only), or None."""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RenderService:
+    def __init__(self, config, max_jobs=1, threads_per_encode=None, min_free_mb=512, memory_check_interval=5.0):
+        """
+        Render jobs submitted by clients while keeping caches warm between them.
+
+        Jobs are queued and rendered at most max_jobs at a time by a shared
+        BatchRunner, so probe metadata, decoded loops and tiles stay warm.
+        When available system memory drops below min_free_mb, decoded loops
+        are evicted least recently used first.
+
+        Args:
+            config: Base configuration, overridden per job by the request
+            max_jobs: Maximum number of jobs rendered at the same time
+            threads_per_encode: Encoder threads per job (overrides THREADS)
+            min_free_mb: Available memory below which decoded loops are evicted
+            memory_check_interval: Seconds between two memory checks
+        """
+        self.config = config
+        self.min_free_bytes = min_free_mb * 1024 * 1024
+        self.memory_check_interval = memory_check_interval
+        self.metrics = Metrics(config.get('METRICS_FILE'), callback=self._on_event)
+        self.runner = BatchRunner(config, max_jobs, threads_per_encode, metrics=self.metrics)
+        self.executor = ThreadPoolExecutor(max_workers=self.runner.max_jobs)
+        self.jobs = OrderedDict()
+        self.condition = threading.Condition()
+        self._next_id = 1
+        self._stop_event = threading.Event()
+        self.logger = logging.getLogger(__name__)
+
+        self._monitor = threading.Thread(target=self._watch_memory, daemon=True)
+        self._monitor.start()
+
+    def submit(self, request):
+        """
+        Queue a job.
+
+        Args:
+            request: Dictionary with audio, timestamps and output, and optional
+                output_dir and config overrides
+
+        Returns:
+            str: Identifier of the queued job
+        """
+        if not all(k in request for k in ['audio', 'timestamps', 'output']):
+            raise ValueError("Job is missing required fields (audio, timestamps, output)")
+
+        with self.condition:
+            # Chunk renders keep their intermediates per output file name (see batch.load_manifest)
+            output_name = os.path.basename(request['output'])
+            for other in self.jobs.values():
+                if other['status'] in ('queued', 'running') \
+                        and os.path.basename(other['request']['output']) == output_name:
+                    raise ValueError(f"Output file name {output_name} is already used by {other['id']}")
+            job_id = f"job-{self._next_id:05d}"
+            self._next_id += 1
+            job = dict(request, name=job_id)
+            self.jobs[job_id] = {
+                'id': job_id, 'status': 'queued', 'submitted': round(time.time(), 3),
+                'request': request, 'events': [], 'result': None,
+            }
+            self._forget_finished()
+        self.executor.submit(self._run, job)
+        self.logger.info(f"Queued {job_id}: {request['output']}")
+        return job_id
+
+    def _run(self, job):
+        """Render one queued job."""
+        self._update(job['name'], status='running')
+        result = self.runner.run_job(job)
+        self._update(job['name'], status=result['status'], result=result)
+
+    def _update(self, job_id, **fields):
+        with self.condition:
+            self.jobs[job_id].update(fields)
+            self.condition.notify_all()
+
+    def _on_event(self, record):
+        """Keep the events of every job for status queries and streaming."""
+        job_id = record.get('job')
+        with self.condition:
+            if job_id in self.jobs:
+                self.jobs[job_id]['events'].append(record)
+                self.condition.notify_all()
+
+    def _forget_finished(self):
+        """Drop the oldest finished jobs beyond MAX_FINISHED_JOBS (caller holds the condition)."""
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ('ok', 'error')]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def job_status(self, job_id):
+        """Return the status of a job without its event history, or None."""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            status = {k: v for k, v in job.items() if k != 'events'}
+            progress = [e for e in job['events'] if e['event'] == 'progress']
+            status['progress'] = progress[-1] if progress else None
+            return status
+
+    def stream_events(self, job_id, timeout=30.0):
+        """
+        Yield the events of a job as they arrive, until it finishes.
+
+        Yields None after timeout seconds without events, so callers can
+        keep the connection alive.
+        """
+        index = 0
+        while True:
+            with self.condition:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    return
+                if index >= len(job['events']) and job['status'] not in ('ok', 'error'):
+                    self.condition.wait(timeout)
+                events = job['events'][index:]
+                finished = job['status'] in ('ok', 'error')
+            index += len(events)
+            if not events and not finished:
+                yield None
+            for event in events:
+                yield event
+            if finished and index >= len(job['events']):
+                return
+
+    def status(self):
+        """Return queue and cache statistics."""
+        with self.condition:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        caches = list(self.runner.frame_caches.values())
+        available = available_memory_bytes()
+        return {
+            'jobs': counts,
+            'max_jobs': self.runner.max_jobs,
+            'available_memory_mb': available // (1024 * 1024) if available is not None else None,
+            'frame_cache': None if not caches else {
+                'loops': sum(len(c.loops) for c in caches),
+                'mb': round(sum(c.total_bytes for c in caches) / 1e6, 1),
+                'hits': sum(c.hits for c in caches),
+                'misses': sum(c.misses for c in caches),
+            },
+            'probe_cache_entries': len(self.runner.probe_cache.entries),
+        }
+
+    def _watch_memory(self):
+        """Evict decoded loops while the system is short of memory."""
+        while not self._stop_event.wait(self.memory_check_interval):
+            caches = list(self.runner.frame_caches.values())
+            available = available_memory_bytes()
+            if not caches or available is None or available >= self.min_free_bytes:
+                continue
+            shortfall = self.min_free_bytes - available
+            released = 0
+            for frame_cache in caches:
+                if released >= shortfall:
+                    break
+                released += frame_cache.trim(max(0, frame_cache.total_bytes - (shortfall - released)))
+            if released:
+                self.logger.warning(
+                    f"Low memory ({available / 1e6:.0f} MB available): evicted {released / 1e6:.0f} MB of decoded loops"
+                )
+
+    def close(self):
+        """Stop accepting work, wait for running jobs and release the caches."""
+        self._stop_event.set()
+        self.executor.shutdown(wait=True)
+        for frame_cache in self.runner.frame_caches.values():
+            frame_cache.clear()
+        self.runner.probe_cache.save()
+        self.metrics.close()
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the render service:
+
+    POST /jobs              queue a job, returns {"id": ...}
+    GET  /jobs/<id>         status, latest progress and result of a job
+    GET  /jobs/<id>/events  JSON lines of the job's events until it finishes
+    GET  /status            queue and cache statistics
+    """
+
+    service = None
+
+    def _send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self._send_json(404, {'error': f"Not found: {self.path}"})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            job_id = self.service.submit(request)
+        except ValueError as e:
+            return self._send_json(400, {'error': str(e)})
+        self._send_json(202, {'id': job_id})
+
+    def do_GET(self):
+        parts = [p for p in self.path.split('/') if p]
+        if parts == ['status']:
+            return self._send_json(200, self.service.status())
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            status = self.service.job_status(parts[1])
+            if status is None:
+                return self._send_json(404, {'error': f"Unknown job: {parts[1]}"})
+            if len(parts) == 2:
+                return self._send_json(200, status)
+            if parts[2] == 'events':
+                return self._stream(parts[1])
+        self._send_json(404, {'error': f"Not found: {self.path}"})
+
+    def _stream(self, job_id):
+        """Stream events as JSON lines; the body ends when the connection closes."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            for event in self.service.stream_events(job_id):
+                # Blank lines keep idle connections alive
+                line = '\n' if event is None else json.dumps(event, ensure_ascii=False) + '\n'
+                self.wfile.write(line.encode('utf-8'))
+                self.wfile.flush()
+            status = self.service.job_status(job_id)
+            if status is None:
+                # Evicted (or never known) while streaming
+                end = {'event': 'job_unknown', 'job': job_id, 'code': 404, 'error': f"Unknown job: {job_id}"}
+            else:
+                end = {'event': 'job_end', 'job': job_id, 'result': status['result']}
+            self.wfile.write((json.dumps(end, ensure_ascii=False) + '\n').encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('local', 0)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def create_server(service, host='127.0.0.1', port=8765, socket_path=None):
+    """Create the HTTP server on a local TCP port or a Unix socket."""
+    handler = type('BoundRenderRequestHandler', (RenderRequestHandler,), {'service': service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def _connect(args, timeout=None):
+    if args.socket:
+        return UnixHTTPConnection(args.socket, timeout=timeout)
+    return http.client.HTTPConnection(args.host, args.port, timeout=timeout)
+
+
+def _request(args, method, path, data=None):
+    """Send one request to the service and return (status code, decoded JSON)."""
+    connection = _connect(args)
+    try:
+        body = json.dumps(data).encode('utf-8') if data is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        connection.close()
+
+
+def wait_for_job(args, job_id):
+    """
+    Follow the event stream of a job until it finishes.
+
+    Returns:
+        dict: The job result
+    """
+    connection = _connect(args)
+    try:
+        connection.request('GET', f"/jobs/{job_id}/events")
+        response = connection.getresponse()
+        for line in response:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if event['event'] == 'job_end':
+                return event['result']
+            if event['event'] == 'job_unknown':
+                raise RuntimeError(event['error'])
+            if event['event'] == 'progress':
+                eta = event.get('eta_seconds')
+                print(f"{event['stage']}: {event['percent']:.1f}%"
+                      + (f" (ETA {eta:.0f}s)" if eta is not None else ''), file=sys.stderr)
+            elif event['event'] == 'span_end':
+                print(f"{event['span']}: {event['status']} in {event['duration']:.2f}s", file=sys.stderr)
+    finally:
+        connection.close()
+    raise RuntimeError(f"Lost the event stream of {job_id}")
+
+
+def serve(args):
+    """Run the render service until interrupted."""
+    service_config = dict(config)
+    if args.output_dir:
+        service_config['OUTPUT_DIR'] = args.output_dir
+    if args.frame_cache_mb is not None:
+        service_config['FRAME_CACHE_MB'] = args.frame_cache_mb
+    elif int(service_config.get('FRAME_CACHE_MB', 0)) <= 0:
+        # Keeping decoded loops warm between jobs is the point of the service
+        service_config['FRAME_CACHE_MB'] = DEFAULT_FRAME_CACHE_MB
+    os.makedirs(service_config['OUTPUT_DIR'], exist_ok=True)
+
+    logging.basicConfig(
+        level=getattr(logging, service_config['LOG_LEVEL']),
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(os.path.join(service_config['OUTPUT_DIR'], 'render_service.log')),
+            logging.StreamHandler(sys.stderr)
+        ]
+    )
+    logger = logging.getLogger(__name__)
+
+    # Pay the moviepy import once, before the first job arrives
+    import video_editor  # noqa: F401
+
+    service = RenderService(service_config, args.max_jobs, args.threads_per_encode, args.min_free_mb)
+    server = create_server(service, args.host, args.port, args.socket)
+    logger.info(f"Render service listening on {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down render service")
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+def main():
+    """Run the render service, or talk to a running one."""
+    parser = argparse.ArgumentParser(description='Local render service that keeps caches warm between jobs')
+    parser.add_argument('--host', default='127.0.0.1', help='Host of the service')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port of the service')
+    parser.add_argument('--socket', help='Unix socket of the service (instead of a TCP port)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='Run the render service')
+    serve_parser.add_argument('--max-jobs', type=int, default=1, help='Maximum number of jobs rendered at the same time')
+    serve_parser.add_argument('--threads-per-encode', type=int, help='Encoder threads per job (overrides THREADS)')
+    serve_parser.add_argument('--output-dir', help='Default directory for output files')
+    serve_parser.add_argument('--frame-cache-mb', type=int,
+                              help=f"Memory budget for decoded character loops (default FRAME_CACHE_MB, "
+                                   f"or {DEFAULT_FRAME_CACHE_MB} when that is 0; 0 disables the cache)")
+    serve_parser.add_argument('--min-free-mb', type=int, default=512,
+                              help='Evict decoded loops when available memory drops below this')
+
+    submit_parser = commands.add_parser('submit', help='Submit a render job')
+    submit_parser.add_argument('--audio', required=True, help='Path to the audio file')
+    submit_parser.add_argument('--timestamps', required=True, help='Path to the timestamps file')
+    submit_parser.add_argument('--output', required=True, help='Name of the output video file')
+    submit_parser.add_argument('--output-dir', help='Directory for the output file')
+    submit_parser.add_argument('--config', help='JSON object of configuration overrides for this job')
+    submit_parser.add_argument('--wait', action='store_true', help='Stream progress and wait for the job to finish')
+
+    status_parser = commands.add_parser('status', help='Show the service or job status')
+    status_parser.add_argument('job', nargs='?', help='Job identifier')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        return serve(args)
+
+    if args.command == 'status':
+        code, data = _request(args, 'GET', f"/jobs/{args.job}" if args.job else '/status')
+        print(json.dumps(data, indent=2, ensure_ascii=False))
+        return 0 if code == 200 else 1
+
+    # Paths are resolved here, since the service may run in another directory
+    request = {
+        'audio': os.path.abspath(args.audio),
+        'timestamps': os.path.abspath(args.timestamps),
+        'output': args.output,
+    }
+    if args.output_dir:
+        request['output_dir'] = os.path.abspath(args.output_dir)
+    if args.config:
+        request['config'] = json.loads(args.config)
+    code, data = _request(args, 'POST', '/jobs', request)
+    if code != 202:
+        print(f"Error: {data.get('error')}", file=sys.stderr)
+        return 1
+    print(data['id'])
+    if not args.wait:
+        return 0
+
+    result = wait_for_job(args, data['id'])
+    if result['status'] != 'ok':
+        print(f"Error: {result.get('error')}", file=sys.stderr)
+        return 1
+    outputs = result['output'] if isinstance(result['output'], list) else [result['output']]
+    print(f"Success! Your podcast video has been created at: {', '.join(outputs)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+import os
+import json
+import logging
+
+import numpy as np
+
+from timeline import Timeline, segment_frame_counts
+from frame_cache import CachedLoop, read_rawvideo
+from ffmpeg_utils import get_ffmpeg_binary, probe_video
+from stills import read_frame
+from renditions import FrameScaler
+
+# How the active speaker is shown
+ACTIVE_STYLES = ('enlarge', 'highlight', 'both')
+
+STAGE_DEFAULTS = {
+    'size': [1920, 1080],
+    'background': '#1e1e28',
+    'active': 'both',
+    'scale': 1.2,
+    'highlight': '#ffd24a',
+    'border': 6,
+    'alpha': False,
+}
+
+
+def parse_color(value):
+    """Parse a "#rrggbb" color into an (r, g, b) tuple."""
+    value = value.lstrip('#')
+    if len(value) != 6:
+        raise ValueError(f"Invalid color (expected #rrggbb): #{value}")
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def load_stage_layout(value):
+    """
+    Load a stage layout from a JSON file, a JSON string or a dictionary.
+
+    Keys (all optional): "size" [width, height], "background" (image path or
+    "#rrggbb"), "active" (enlarge, highlight or both), "scale" (size of the
+    active speaker relative to the others), "highlight" (border color),
+    "border" (border width in pixels), "alpha" (blend loops with an alpha
+    channel over the background) and "characters", a list of
+    {"character": name, "box": [x, y, width, height]}. Characters without a
+    box are placed in a row.
+
+    Returns:
+        dict: Layout with defaults filled in
+    """
+    if isinstance(value, str):
+        if os.path.exists(value):
+            with open(value, 'r', encoding='utf-8') as f:
+                value = f.read()
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid stage layout JSON: {str(e)}")
+    if not isinstance(value, dict):
+        raise ValueError("Stage layout must be a JSON object")
+
+    layout = dict(STAGE_DEFAULTS, **value)
+    layout['size'] = [int(v) for v in layout['size']]
+    if layout['size'][0] % 2 or layout['size'][1] % 2:
+        raise ValueError("Stage size needs an even width and height for yuv420p")
+    if layout['active'] not in ACTIVE_STYLES:
+        raise ValueError(f"Invalid active style: {layout['active']} (expected one of {', '.join(ACTIVE_STYLES)})")
+    for i, slot in enumerate(layout.get('characters') or []):
+        if 'character' not in slot:
+            raise ValueError(f"Stage character {i} is missing the \"character\" field")
+        if 'box' in slot and len(slot['box']) != 4:
+            raise ValueError(f"Box of stage character {slot['character']} must be [x, y, width, height]")
+    return layout
+
+
+def stage_cast(segments):
+    """
+    Collect the characters of an episode, in order of first appearance.
+
+    Must run before segments are split into talking and idle parts, while
+    each segment still names its idle loop.
+
+    Returns:
+        dict: Character name (or video path) -> {'talking': path, 'idle': path or None}
+    """
+    cast = {}
+    for segment in segments:
+        name = segment.get('character') or segment['video']
+        entry = cast.setdefault(name, {'talking': segment['video'], 'idle': None})
+        if segment.get('idle') and not entry['idle']:
+            entry['idle'] = segment['idle']
+    return cast
+
+
+def row_boxes(count, size):
+    """Default boxes: characters side by side in the lower part of the stage."""
+    width, height = size
+    cell = width / count
+    box_width = int(cell * 0.9)
+    box_height = int(height * 0.6)
+    y = int(height * 0.9) - box_height
+    return [[int(cell * i + (cell - box_width) / 2), y, box_width, box_height] for i in range(count)]
+
+
+def fit_box(source_size, box):
+    """Largest even-sized rectangle with the source aspect ratio, bottom-centered in box."""
+    x, y, width, height = box
+    scale = min(width / source_size[0], height / source_size[1])
+    fitted_width = max(2, int(source_size[0] * scale) // 2 * 2)
+    fitted_height = max(2, int(source_size[1] * scale) // 2 * 2)
+    return [x + (width - fitted_width) // 2, y + height - fitted_height, fitted_width, fitted_height]
+
+
+def enlarge_box(box, scale, size):
+    """Scale a box around its bottom center, kept inside the stage."""
+    x, y, width, height = box
+    new_width = min(int(width * scale), size[0])
+    new_height = min(int(height * scale), size[1])
+    new_x = min(max(0, x + (width - new_width) // 2), size[0] - new_width)
+    new_y = min(max(0, y + height - new_height), size[1] - new_height)
+    return [new_x, new_y, new_width, new_height]
+
+
+def decode_scaled(video_path, fps, size, info, alpha=False, first_frame_only=False):
+    """
+    Decode a loop at the output frame rate, scaled to size, into one array.
+
+    Args:
+        video_path: Loop or image
+        fps: Output frame rate
+        size: (width, height) of the decoded frames
+        info: Probe metadata of the file (duration, still)
+        alpha: Keep the alpha channel (RGBA frames)
+        first_frame_only: Decode only the first frame
+
+    Returns:
+        CachedLoop: The scaled loop
+    """
+    width, height = size
+    single = first_frame_only or bool(info.get('still'))
+    n_frames = 1 if single else max(1, int(round(info['duration'] * fps)))
+    frames = np.empty((n_frames, height, width, 4 if alpha else 3), dtype=np.uint8)
+
+    cmd = [get_ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-i', video_path]
+    cmd += ['-vf', f"scale={width}:{height}", '-frames:v', '1'] if single else \
+        ['-vf', f"fps={fps},scale={width}:{height}"]
+    cmd += ['-f', 'rawvideo', '-pix_fmt', 'rgba' if alpha else 'rgb24', '-']
+    n_read = read_rawvideo(cmd, frames)
+    if n_read == 0:
+        raise RuntimeError(f"Could not decode any frames from {video_path}")
+    return CachedLoop(frames[:n_read], fps)
+
+
+class StageCompositor:
+    def __init__(self, timeline, characters, cast, layout, probe=None):
+        """
+        Composite every character onto a static stage, one output frame at a time.
+
+        The timeline decides who speaks: its entries are the active speaker's
+        loops (talking or idle parts) with their loop phases. The other
+        characters show their idle loop on the episode clock, or the first
+        frame of their loop when they have no idle loop.
+
+        Static layers are prepared once: the background, the slot geometry
+        and the highlight border. Every loop is decoded once, already scaled
+        to its slot, so a frame costs one background copy and a few array
+        slice assignments into a reused buffer.
+
+        Behaves like a Timeline for the encoders (fps, size, total_frames,
+        frame_at, to_clip and an optional overlay).
+
+        Args:
+            timeline: Timeline of the active speaker's loops
+            characters: Character name of each timeline entry
+            cast: Dictionary of character -> {'talking', 'idle'} (see stage_cast)
+            layout: Stage layout (see load_stage_layout)
+            probe: Optional function returning media metadata (e.g. ProbeCache.probe)
+        """
+        self.timeline = timeline
+        self.layout = layout
+        self.probe = probe or probe_video
+        self.fps = timeline.fps
+        self.total_frames = timeline.total_frames
+        self.duration = timeline.duration
+        self.size = tuple(layout['size'])
+        self.videos = timeline.videos
+        self.overlay = None
+        self.start_time = 0.0
+        self.logger = logging.getLogger(__name__)
+
+        configured = {slot['character']: slot.get('box') for slot in layout.get('characters') or []}
+        names = [name for name in configured if name in cast] + [name for name in cast if name not in configured]
+        free_boxes = iter(row_boxes(max(1, sum(1 for name in names if not configured.get(name))), self.size))
+        self.names = names
+        self.boxes = [list(configured.get(name) or next(free_boxes)) for name in names]
+        self.cast = cast
+        index = {name: i for i, name in enumerate(names)}
+        self.entry_slots = np.array([index[name] for name in characters], dtype=np.int32)
+
+        enlarge = layout['active'] in ('enlarge', 'both')
+        self.active_boxes = [
+            enlarge_box(box, float(layout['scale']), self.size) if enlarge else list(box) for box in self.boxes
+        ]
+        self.highlight = parse_color(layout['highlight']) if layout['active'] in ('highlight', 'both') else None
+        self.alpha = bool(layout.get('alpha'))
+
+        self.background = None
+        self.idle_loops = []
+        self.active_loops = {}
+
+    @classmethod
+    def from_segments(cls, segments, fps, cast, layout, probe=None):
+        """Build a compositor from compacted segment dictionaries."""
+        timeline = Timeline.from_segments(segments, fps)
+        valid = [s for s in segments if s['end'] - s['start'] > 0]
+        characters = [
+            segment.get('character') or segment['video']
+            for segment, frames in zip(valid, segment_frame_counts(valid, fps)) if frames > 0
+        ]
+        return cls(timeline, characters, cast, layout, probe)
+
+    def __len__(self):
+        return len(self.timeline)
+
+    @property
+    def frame_starts(self):
+        """First output frame of every timeline entry (speaker turns and talking/idle parts)."""
+        return self.timeline.frame_starts
+
+    def _background(self):
+        width, height = self.size
+        background = self.layout['background']
+        if background.startswith('#'):
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            frame[:] = parse_color(background)
+            return frame
+        info = self.probe(background)
+        image = read_frame(background, info['size'])
+        scaler = FrameScaler(info['size'], {'name': 'background', 'width': width, 'height': height, 'fit': 'crop'})
+        return scaler(image)
+
+    def _scaled(self, video_path, box, first_frame_only=False):
+        info = self.probe(video_path)
+        x, y, width, height = fit_box(info['size'], box)
+        loop = decode_scaled(video_path, self.fps, (width, height), info, self.alpha, first_frame_only)
+        return loop, (x, y)
+
+    def load(self):
+        """Render the static layers and decode every loop, scaled to its slot."""
+        self.background = np.ascontiguousarray(self._background())
+        self.idle_loops = []
+        for name, box in zip(self.names, self.boxes):
+            loops = self.cast[name]
+            if loops['idle']:
+                self.idle_loops.append(self._scaled(loops['idle'], box))
+            else:
+                self.idle_loops.append(self._scaled(loops['talking'], box, first_frame_only=True))
+
+        self.active_loops = {}
+        sources = {}
+        for entry, video_id in enumerate(self.timeline.video_ids.tolist()):
+            slot = int(self.entry_slots[entry])
+            key = (slot, video_id)
+            if key not in self.active_loops:
+                video_path = self.timeline.videos[video_id]
+                self.active_loops[key] = self._scaled(video_path, self.active_boxes[slot])
+                sources.setdefault(video_path, self.active_loops[key][0])
+        self.timeline.bind(sources, self.size)
+
+        total = sum(loop.nbytes for loop, _ in self.idle_loops + list(self.active_loops.values()))
+        self.logger.info(
+            f"Prepared stage of {len(self.names)} characters, {self.size[0]}x{self.size[1]}: "
+            f"{len(self.idle_loops) + len(self.active_loops)} scaled loops ({total / 1e6:.1f} MB)"
+        )
+        return self
+
+    def _paste(self, out, frame, position):
+        x, y = position
+        height, width = frame.shape[:2]
+        region = out[y:y + height, x:x + width]
+        if frame.shape[2] == 3:
+            region[...] = frame
+        else:
+            alpha = frame[:, :, 3:].astype(np.uint16)
+            region[...] = (region * (255 - alpha) + frame[:, :, :3] * alpha + 127) // 255
+
+    def _border(self, out, box):
+        x, y, width, height = box
+        border = int(self.layout['border'])
+        top, bottom = max(0, y - border), min(self.size[1], y + height + border)
+        left, right = max(0, x - border), min(self.size[0], x + width + border)
+        out[top:y, left:right] = self.highlight
+        out[y + height:bottom, left:right] = self.highlight
+        out[top:bottom, left:x] = self.highlight
+        out[top:bottom, x + width:right] = self.highlight
+
+    def frame_at(self, frame_index, out=None):
+        """
+        Produce output frame frame_index.
+
+        Args:
+            frame_index: Output frame index
+            out: Optional preallocated (height, width, 3) uint8 buffer, reused for every frame
+
+        Returns:
+            np.ndarray: The frame
+        """
+        if out is None:
+            out = self.background.copy()
+        else:
+            np.copyto(out, self.background)
+
+        entry = int(np.searchsorted(self.timeline.frame_starts, frame_index, side='right')) - 1
+        active = int(self.entry_slots[entry])
+        t = frame_index / self.fps
+        for slot, (loop, position) in enumerate(self.idle_loops):
+            if slot != active:
+                self._paste(out, loop.get_frame(t), position)
+
+        _, local_time = self.timeline.locate_frame(frame_index)
+        loop, position = self.active_loops[(active, int(self.timeline.video_ids[entry]))]
+        if self.highlight is not None:
+            frame_height, frame_width = loop.frames.shape[1:3]
+            self._border(out, (position[0], position[1], frame_width, frame_height))
+        self._paste(out, loop.get_frame(local_time), position)
+
+        if self.overlay is not None:
+            out = self.overlay.apply(out, self.start_time + t, out)
+        return out
+
+    def make_frame(self, t):
+        """Produce the output frame at time t."""
+        return self.frame_at(min(int(t * self.fps + 1e-6), self.total_frames - 1))
+
+    def to_clip(self):
+        """Wrap the compositor in a single moviepy VideoClip."""
+        from moviepy.editor import VideoClip
+        return VideoClip(self.make_frame, duration=self.duration)
+
+    def close(self):
+        """Release the decoded loops."""
+        for loop, _ in self.idle_loops + list(self.active_loops.values()):
+            loop.close()
+        self.idle_loops = []
+        self.active_loops = {}
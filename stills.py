@@ -0,0 +1,84 @@
+import subprocess
+
+import numpy as np
+
+from ffmpeg_utils import get_ffmpeg_binary, probe_video
+from frame_cache import CachedLoop
+
+# Side of the grayscale thumbnails compared when measuring motion
+MOTION_SAMPLE_WIDTH = 64
+
+# Side of the thumbnail blocks compared separately, so a small moving area
+# (a mouth in a talking-head loop) is not averaged away by the static rest
+MOTION_BLOCK_WIDTH = 8
+
+
+def read_frame(path, size):
+    """
+    Decode the first frame of an image or video as an RGB array.
+
+    Args:
+        path: Image or video file
+        size: (width, height) of the file
+
+    Returns:
+        np.ndarray: Array of shape (height, width, 3)
+    """
+    width, height = size
+    cmd = [
+        get_ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-i', path,
+        '-frames:v', '1', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0 or len(result.stdout) < width * height * 3:
+        raise RuntimeError(f"Could not decode a frame from {path}: {result.stderr.decode('utf-8', errors='replace')[-500:]}")
+    return np.frombuffer(result.stdout[:width * height * 3], dtype=np.uint8).reshape(height, width, 3)
+
+
+def measure_motion(path):
+    """
+    Measure how much a loop moves.
+
+    Every frame is reduced to a small grayscale thumbnail and compared with
+    the first one, block by block.
+
+    Returns:
+        float: Largest mean absolute difference of any block to the first frame (0-255)
+    """
+    cmd = [
+        get_ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-i', path,
+        '-vf', f"scale={MOTION_SAMPLE_WIDTH}:{MOTION_SAMPLE_WIDTH},format=gray",
+        '-f', 'rawvideo', '-'
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not decode {path}: {result.stderr.decode('utf-8', errors='replace')[-500:]}")
+    frame_bytes = MOTION_SAMPLE_WIDTH * MOTION_SAMPLE_WIDTH
+    frames = np.frombuffer(result.stdout, dtype=np.uint8)
+    frames = frames[:len(frames) // frame_bytes * frame_bytes].reshape(-1, MOTION_SAMPLE_WIDTH, MOTION_SAMPLE_WIDTH)
+    if len(frames) < 2:
+        return 0.0
+    differences = np.abs(frames[1:].astype(np.int16) - frames[0].astype(np.int16))
+    blocks = MOTION_SAMPLE_WIDTH // MOTION_BLOCK_WIDTH
+    differences = differences.reshape(-1, blocks, MOTION_BLOCK_WIDTH, blocks, MOTION_BLOCK_WIDTH)
+    return float(differences.mean(axis=(2, 4)).max())
+
+
+def load_still(path, fps, size=None):
+    """
+    Load the frame of a still character as a one-frame loop.
+
+    The Timeline then serves the same array for every output frame, so the
+    source is decoded once and the encoder sees identical frames.
+
+    Args:
+        path: Image, or video whose first frame is used
+        fps: Output frame rate
+        size: Optional (width, height) of the file; probed when not given
+
+    Returns:
+        CachedLoop: Loop of a single frame
+    """
+    if size is None:
+        size = probe_video(path)['size']
+    return CachedLoop(read_frame(path, size)[np.newaxis], fps)
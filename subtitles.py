@@ -0,0 +1,356 @@
+import math
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+SUBTITLE_MODES = ('off', 'srt', 'burn')
+
+# Fonts tried when SUBTITLE_FONT is not set, CJK fonts first for Korean scripts;
+# a font missing glyphs of the captions is skipped
+DEFAULT_FONTS = [
+    'NotoSansCJK-Regular.ttc', 'NotoSansKR-Regular.otf', 'AppleSDGothicNeo.ttc', 'malgun.ttf',
+    'DejaVuSans.ttf', 'Arial.ttf',
+]
+
+# Private use character no font draws; its mask is the font's missing-glyph box
+MISSING_GLYPH_PROBE = '\ue000'
+
+# Rasterized captions kept per frame size; cues are shown in order, so a
+# small window covers every caption on screen and the ones around it
+ATLAS_ENTRIES = 64
+
+
+def subtitle_style(config):
+    """Collect the caption style settings from the configuration."""
+    return {
+        'font': config.get('SUBTITLE_FONT'),
+        'size': float(config.get('SUBTITLE_SIZE', 0.05)),
+        'margin': float(config.get('SUBTITLE_MARGIN', 0.06)),
+        'max_width': float(config.get('SUBTITLE_MAX_WIDTH', 0.9)),
+    }
+
+
+def split_caption(text, max_chars):
+    """
+    Split dialogue into captions of at most max_chars characters.
+
+    Text is broken between words; scripts without spaces (or single words
+    longer than max_chars) are broken between characters.
+
+    Returns:
+        list: Caption strings
+    """
+    words = text.split()
+    captions = []
+    current = ''
+    for word in words:
+        while len(word) > max_chars:
+            if current:
+                captions.append(current)
+                current = ''
+            captions.append(word[:max_chars])
+            word = word[max_chars:]
+        if not word:
+            continue
+        candidate = f"{current} {word}" if current else word
+        if len(candidate) > max_chars:
+            captions.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        captions.append(current)
+    return captions
+
+
+def caption_cues(segments, max_chars=84):
+    """
+    Place the dialogue of every segment on the output timeline.
+
+    Long dialogue is split into several captions that share the segment's
+    time in proportion to their length.
+
+    Args:
+        segments: List of segment dictionaries in output order, with an optional 'text'
+        max_chars: Maximum length of one caption
+
+    Returns:
+        list: (start, end, text) tuples in output seconds
+    """
+    cues = []
+    elapsed = 0.0
+    for segment in segments:
+        duration = segment['end'] - segment['start']
+        if duration <= 0:
+            continue
+        text = (segment.get('text') or '').strip()
+        if text:
+            parts = split_caption(text, max_chars)
+            total = sum(len(part) for part in parts)
+            start = elapsed
+            for i, part in enumerate(parts):
+                end = elapsed + duration if i == len(parts) - 1 else start + duration * len(part) / total
+                cues.append((start, end, part))
+                start = end
+        elapsed += duration
+    return cues
+
+
+def format_srt_time(seconds):
+    """Format seconds as an SRT timestamp (HH:MM:SS,mmm)."""
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+def write_srt(cues, output_path):
+    """
+    Write captions as an SRT file.
+
+    Args:
+        cues: List of (start, end, text) tuples in output seconds
+        output_path: Path of the .srt file
+
+    Returns:
+        str: Path of the written file
+    """
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for i, (start, end, text) in enumerate(cues, 1):
+            f.write(f"{i}\n{format_srt_time(start)} --> {format_srt_time(end)}\n{text}\n\n")
+    return output_path
+
+
+def missing_glyphs(font, characters):
+    """
+    Find the characters a font draws as its missing-glyph box.
+
+    Args:
+        font: PIL font
+        characters: Iterable of characters to check
+
+    Returns:
+        set: Characters without a glyph
+    """
+    def mask(character):
+        left, top, right, bottom = font.getbbox(character)
+        image = Image.new('L', (max(1, math.ceil(right - left)), max(1, math.ceil(bottom - top))))
+        ImageDraw.Draw(image).text((-left, -top), character, font=font, fill=255)
+        return image.size, image.tobytes()
+
+    missing = mask(MISSING_GLYPH_PROBE)
+    return {c for c in set(characters) if not c.isspace() and mask(c) == missing}
+
+
+def load_font(font_path, size, characters=''):
+    """
+    Load a TrueType font, falling back to common system fonts and then to PIL's default.
+
+    Default fonts missing glyphs for any of characters are skipped, unless
+    none of them covers every character.
+
+    Args:
+        font_path: Font chosen by the user (SUBTITLE_FONT), or None
+        size: Font size in pixels
+        characters: Characters the captions use
+
+    Returns:
+        ImageFont: The font
+    """
+    fallback = None
+    for candidate in ([font_path] if font_path else []) + DEFAULT_FONTS:
+        try:
+            font = ImageFont.truetype(candidate, size)
+        except OSError:
+            if candidate == font_path:
+                logger.warning(f"Could not load subtitle font {font_path}, falling back to a default font")
+            continue
+        missing = missing_glyphs(font, characters)
+        if candidate == font_path:
+            if missing:
+                logger.warning(f"Subtitle font {font_path} has no glyphs for {''.join(sorted(missing)[:10])}")
+            return font
+        if not missing:
+            return font
+        fallback = fallback or font
+    if fallback is not None:
+        logger.warning("No default subtitle font covers every caption character; set SUBTITLE_FONT")
+        return fallback
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow < 10.1 has a single fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def wrap_lines(text, font, max_width):
+    """
+    Wrap a caption to lines no wider than max_width pixels.
+
+    Returns:
+        list: Lines of text
+    """
+    lines = []
+    current = ''
+    # Scripts without spaces are wrapped between characters
+    tokens = text.split(' ') if ' ' in text else list(text)
+    separator = ' ' if ' ' in text else ''
+    for token in tokens:
+        candidate = f"{current}{separator}{token}" if current else token
+        if current and font.getlength(candidate) > max_width:
+            lines.append(current)
+            current = token
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+class CaptionAtlas:
+    def __init__(self, frame_size, style, characters=''):
+        """
+        Rasterized captions for one frame size.
+
+        Every caption is wrapped and drawn once with PIL, cropped to its
+        visible pixels and stored premultiplied, so showing it on a frame is
+        a single vectorized blend of the caption box.
+
+        Args:
+            frame_size: (width, height) of the frames the captions are burned into
+            style: Caption style (see subtitle_style)
+            characters: Characters of all captions, used to pick a font with their glyphs
+        """
+        width, height = frame_size
+        self.font_size = max(8, int(round(style['size'] * height)))
+        self.font = load_font(style['font'], self.font_size, characters)
+        self.max_width = int(style['max_width'] * width)
+        self.outline = max(1, self.font_size // 12)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _rasterize(self, text):
+        lines = '\n'.join(wrap_lines(text, self.font, self.max_width - 2 * self.outline))
+        probe = ImageDraw.Draw(Image.new('L', (1, 1)))
+        spacing = self.font_size // 4
+        left, top, right, bottom = probe.multiline_textbbox(
+            (0, 0), lines, font=self.font, spacing=spacing, align='center', stroke_width=self.outline
+        )
+        # Newer Pillow versions return fractional coordinates for centered multi-line text
+        left, top = math.floor(left), math.floor(top)
+        right, bottom = math.ceil(right), math.ceil(bottom)
+        image = Image.new('RGBA', (right - left + 2, bottom - top + 2), (0, 0, 0, 0))
+        ImageDraw.Draw(image).multiline_text(
+            (1 - left, 1 - top), lines, font=self.font, fill=(255, 255, 255, 255), spacing=spacing,
+            align='center', stroke_width=self.outline, stroke_fill=(0, 0, 0, 255)
+        )
+
+        pixels = np.asarray(image)
+        rows = np.flatnonzero(pixels[:, :, 3].any(axis=1))
+        columns = np.flatnonzero(pixels[:, :, 3].any(axis=0))
+        if not len(rows):
+            return None
+        pixels = pixels[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1]
+        alpha = pixels[:, :, 3:].astype(np.uint16)
+        premultiplied = pixels[:, :, :3].astype(np.uint16) * alpha + 127
+        return premultiplied, (255 - alpha)
+
+    def get(self, text):
+        """
+        Get a rasterized caption.
+
+        Returns:
+            tuple: (premultiplied color + rounding, 255 - alpha) as uint16 arrays, or None for blank text
+        """
+        with self.lock:
+            if text in self.entries:
+                self.entries.move_to_end(text)
+                return self.entries[text]
+        entry = self._rasterize(text)
+        with self.lock:
+            self.entries[text] = entry
+            while len(self.entries) > ATLAS_ENTRIES:
+                self.entries.popitem(last=False)
+        return entry
+
+
+class SubtitleLayer:
+    def __init__(self, cues, style):
+        """
+        Burn captions into timeline frames.
+
+        Cue lookup is a binary search per frame; frames without a caption
+        are passed through untouched.
+
+        Args:
+            cues: List of (start, end, text) tuples in output seconds
+            style: Caption style (see subtitle_style)
+        """
+        self.cues = [tuple(cue) for cue in cues]
+        self.style = dict(style)
+        self.starts = np.array([cue[0] for cue in self.cues], dtype=np.float64)
+        self.ends = np.array([cue[1] for cue in self.cues], dtype=np.float64)
+        # Every character of the captions, for choosing a font that covers them
+        self.characters = ''.join(sorted({c for cue in self.cues for c in cue[2]}))
+        self.atlases = {}
+        self.lock = threading.Lock()
+
+    def cues_between(self, start, end):
+        """Return the cues overlapping [start, end), shifted so that start is 0."""
+        return [(max(0.0, s - start), e - start, text) for s, e, text in self.cues if s < end and e > start]
+
+    def atlas(self, frame_size):
+        """Return the caption atlas for a frame size."""
+        with self.lock:
+            if frame_size not in self.atlases:
+                self.atlases[frame_size] = CaptionAtlas(frame_size, self.style, self.characters)
+            return self.atlases[frame_size]
+
+    def apply(self, frame, t, out=None):
+        """
+        Burn the caption shown at time t into a frame.
+
+        Source frames are never modified: the frame is copied into out (or
+        a new array) first unless it already is out.
+
+        Args:
+            frame: Frame of shape (height, width, 3)
+            t: Output time in seconds
+            out: Optional writable buffer of the same shape
+
+        Returns:
+            np.ndarray: The frame with its caption
+        """
+        index = int(np.searchsorted(self.starts, t, side='right')) - 1
+        if index < 0 or t >= self.ends[index]:
+            return frame
+
+        height, width = frame.shape[:2]
+        entry = self.atlas((width, height)).get(self.cues[index][2])
+        if entry is None:
+            return frame
+        if frame is not out:
+            if out is None:
+                out = np.array(frame[:, :, :3])
+            else:
+                np.copyto(out, frame[:, :, :3])
+
+        premultiplied, inverse_alpha = entry
+        box_height = min(premultiplied.shape[0], height)
+        box_width = min(premultiplied.shape[1], width)
+        y = max(0, height - int(self.style['margin'] * height) - box_height)
+        x = (width - box_width) // 2
+        region = out[y:y + box_height, x:x + box_width]
+        region[...] = (region * inverse_alpha[:box_height, :box_width]
+                       + premultiplied[:box_height, :box_width]) // 255
+        return out
+
+    def write_srt(self, output_path):
+        """Write the cues as an SRT sidecar."""
+        return write_srt(self.cues, output_path)
@@ -0,0 +1,173 @@
+import os
+import hashlib
+import logging
+import threading
+
+from ffmpeg_utils import (
+    probe_video, run_ffmpeg, video_encoding_args, encoding_settings, concat_stream_copy, mux_audio
+)
+from timeline import Timeline
+from metrics import Metrics
+
+# Timescale shared by every intermediate so the concat demuxer can copy them
+TRACK_TIMESCALE = '90000'
+
+# Renders sharing a tile directory in one process encode each tile only once
+_tile_locks = {}
+_tile_locks_guard = threading.Lock()
+
+
+def _tile_lock(path):
+    """Return the lock serializing the encode of one tile file."""
+    with _tile_locks_guard:
+        return _tile_locks.setdefault(path, threading.Lock())
+
+
+class TileRenderer:
+    def __init__(self, config, cache_dir, metrics=None, probe=None):
+        """
+        Initialize the TileRenderer.
+
+        Args:
+            config: Dictionary containing configuration parameters
+            cache_dir: Directory where normalized loop tiles are kept
+            metrics: Optional Metrics receiving timing spans and progress events
+            probe: Optional function returning media metadata (e.g. ProbeCache.probe)
+        """
+        self.config = config
+        self.metrics = metrics or Metrics()
+        self.probe = probe or probe_video
+        self.video_fps = config.get('VIDEO_FPS', 30)
+        self.video_audio_codec = config.get('VIDEO_AUDIO_CODEC', 'aac')
+        self.tile_dir = os.path.join(cache_dir, 'tiles')
+        os.makedirs(self.tile_dir, exist_ok=True)
+        self.logger = logging.getLogger(__name__)
+
+    def _tile_key(self, video_path, size):
+        """
+        Build a cache key from the source file and the encoding parameters.
+
+        Tiles and their pieces are encoded with a GOP of one loop, so
+        KEYFRAME_INTERVAL is not part of the key.
+        """
+        stat = os.stat(video_path)
+        parts = [
+            os.path.abspath(video_path), stat.st_size, stat.st_mtime,
+            self.video_fps, size[0], size[1],
+        ] + encoding_settings(self.config, fixed_gop=True)
+        return hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:20]
+
+    def _encode(self, input_args, frames, gop, output_path):
+        """Encode a normalized intermediate, writing it atomically."""
+        temp_path = f"{output_path}.{os.getpid()}.part.mp4"
+        run_ffmpeg(
+            input_args
+            + ['-an', '-frames:v', str(frames)]
+            + video_encoding_args(self.config, gop=gop)
+            + ['-video_track_timescale', TRACK_TIMESCALE, temp_path]
+        )
+        os.replace(temp_path, output_path)
+
+    def get_tile(self, video_path, info, size):
+        """
+        Get the normalized tile for a character loop, encoding it if needed.
+
+        The tile holds exactly one loop at the output fps and resolution and
+        is a single GOP, so it can be repeated with stream copy.
+
+        Returns:
+            tuple: (tile path, number of frames in the loop)
+        """
+        loop_frames = max(1, int(round(info['duration'] * self.video_fps)))
+        tile_path = os.path.join(self.tile_dir, f"{self._tile_key(video_path, size)}.mp4")
+
+        with _tile_lock(tile_path):
+            if not os.path.exists(tile_path):
+                width, height = size
+                filters = (
+                    f"fps={self.video_fps},tpad=stop_mode=clone:stop_duration=1,"
+                    f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+                )
+                # Images are repeated for the whole tile; static content costs x264 almost nothing
+                input_args = ['-loop', '1', '-framerate', str(self.video_fps)] if info.get('still') else []
+                self.logger.info(f"Encoding loop tile for {video_path} ({loop_frames} frames)")
+                with self.metrics.span('encode_tile', video=video_path, frames=loop_frames):
+                    self._encode(input_args + ['-i', video_path, '-vf', filters], loop_frames, loop_frames, tile_path)
+
+        return tile_path, loop_frames
+
+    def get_piece(self, tile_path, loop_frames, frames, start=0):
+        """
+        Get frames [start, start + frames) of a tile, re-encoding only that piece.
+
+        Pieces starting at frame 0 are the remainders at the end of a segment;
+        pieces starting later continue a loop from its phase.
+        """
+        name = f"_r{frames}" if start == 0 else f"_s{start}_{frames}"
+        piece_path = f"{os.path.splitext(tile_path)[0]}{name}.mp4"
+        with _tile_lock(piece_path):
+            if not os.path.exists(piece_path):
+                self.logger.debug(f"Encoding {frames}-frame piece of {tile_path} from frame {start}")
+                input_args = ['-i', tile_path]
+                if start:
+                    input_args += ['-vf', f"trim=start_frame={start}:end_frame={start + frames},setpts=PTS-STARTPTS"]
+                self._encode(input_args, frames, loop_frames, piece_path)
+        return piece_path
+
+    def render(self, segments, audio_file, output_path):
+        """
+        Render the episode from loop tiles and mux the audio.
+
+        Args:
+            segments: List of segment dictionaries with video path, start and end times
+            audio_file: Path to the source audio file
+            output_path: Path of the final video
+
+        Returns:
+            str: Path to the created video
+        """
+        segments = [s for s in segments if s['end'] - s['start'] > 0]
+        if not segments:
+            raise ValueError("No valid segments to process")
+
+        timeline = Timeline.from_segments(segments, self.video_fps)
+        infos = {path: self.probe(path) for path in timeline.videos}
+
+        # Same canvas as a compose concatenation: the largest clip, others centered
+        size = (
+            max(info['size'][0] for info in infos.values()),
+            max(info['size'][1] for info in infos.values()),
+        )
+
+        pieces = []
+        with self.metrics.span('process_segments', segments=len(timeline)):
+            for i, (video_path, phase, frames) in enumerate(timeline.entries()):
+                tile_path, loop_frames = self.get_tile(video_path, infos[video_path], size)
+                # A loop resumed mid-way starts with the rest of the loop
+                offset = int(round(phase * self.video_fps)) % loop_frames
+                if offset:
+                    head = min(frames, loop_frames - offset)
+                    pieces.append(self.get_piece(tile_path, loop_frames, head, start=offset))
+                    frames -= head
+                loops, remainder = divmod(frames, loop_frames)
+                pieces.extend([tile_path] * loops)
+                if remainder:
+                    pieces.append(self.get_piece(tile_path, loop_frames, remainder))
+                self.metrics.progress('process_segments', i + 1, len(timeline), unit='segments')
+
+        self.logger.info(f"Joining {len(pieces)} tiles for {len(segments)} segments")
+        video_only_path = output_path + '.video.mp4'
+        try:
+            with self.metrics.span('concatenate', pieces=len(pieces)):
+                concat_stream_copy(pieces, video_only_path)
+            with self.metrics.span('mux'):
+                mux_audio(
+                    video_only_path, audio_file,
+                    [(s['start'], s['end']) for s in segments],
+                    output_path, audio_codec=self.video_audio_codec
+                )
+        finally:
+            if os.path.exists(video_only_path):
+                os.remove(video_only_path)
+
+        return output_path
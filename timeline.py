@@ -0,0 +1,304 @@
+import numpy as np
+
+# How a character loop continues across segment boundaries
+LOOP_CONTINUITY_MODES = ('none', 'character', 'global')
+
+
+def segment_frame_counts(segments, fps):
+    """
+    Convert segment durations to whole output frames.
+
+    Boundaries are rounded on the cumulative timeline so rounding errors
+    never accumulate over long episodes.
+
+    Args:
+        segments: List of segment dictionaries with start and end times
+        fps: Output frame rate
+
+    Returns:
+        list: Number of output frames for each segment
+    """
+    counts = []
+    elapsed = 0.0
+    for segment in segments:
+        first_frame = int(round(elapsed * fps))
+        elapsed += segment['end'] - segment['start']
+        counts.append(int(round(elapsed * fps)) - first_frame)
+    return counts
+
+
+def coalesce_segments(segments, tolerance=1e-6):
+    """
+    Merge adjacent segments that show the same video over contiguous audio.
+
+    Segments with a non-positive duration are dropped.
+
+    Args:
+        segments: List of segment dictionaries, in output order
+        tolerance: Maximum gap in seconds between segments that are merged
+
+    Returns:
+        list: New list of segment dictionaries
+    """
+    merged = []
+    for segment in segments:
+        if segment['end'] - segment['start'] <= 0:
+            continue
+        previous = merged[-1] if merged else None
+        if previous is not None and previous['video'] == segment['video'] \
+                and abs(segment['start'] - previous['end']) < tolerance:
+            merged[-1] = dict(previous, end=segment['end'])
+        else:
+            merged.append(dict(segment))
+    return merged
+
+
+def assign_loop_phases(segments, fps, continuity='global'):
+    """
+    Set the loop phase of every segment so loops continue across segments.
+
+    With 'character', each video resumes where it stopped the last time it
+    was shown. With 'global', every loop follows the episode clock, as if
+    all characters were playing all the time. With 'none', phases are kept
+    as they are (loops restart unless a phase was given).
+
+    Phases are derived from whole output frames, so they match the frames
+    the Timeline renders exactly.
+
+    Args:
+        segments: List of segment dictionaries, in output order
+        fps: Output frame rate
+        continuity: One of LOOP_CONTINUITY_MODES
+
+    Returns:
+        list: New list of segment dictionaries with a 'phase' in seconds
+    """
+    if continuity not in LOOP_CONTINUITY_MODES:
+        raise ValueError(
+            f"Unknown loop continuity: {continuity} (expected one of {', '.join(LOOP_CONTINUITY_MODES)})"
+        )
+    segments = [s for s in segments if s['end'] - s['start'] > 0]
+    shown = {}
+    elapsed = 0
+    phased = []
+    for segment, frames in zip(segments, segment_frame_counts(segments, fps)):
+        if continuity == 'global':
+            phase = elapsed / fps
+        elif continuity == 'character':
+            phase = shown.get(segment['video'], 0) / fps
+        else:
+            phase = segment.get('phase', 0.0)
+        phased.append(dict(segment, phase=phase))
+        shown[segment['video']] = shown.get(segment['video'], 0) + frames
+        elapsed += frames
+    return phased
+
+
+class OverlayStack:
+    def __init__(self, layers):
+        """
+        Several overlays drawn over the same frame, in order.
+
+        Args:
+            layers: Objects with an apply(frame, t, out) method
+        """
+        self.layers = list(layers)
+
+    def apply(self, frame, t, out=None):
+        """Draw every layer at time t; see Timeline.frame_at for the buffer rules."""
+        for layer in self.layers:
+            result = layer.apply(frame, t, out)
+            if out is None and result is not frame:
+                # The first layer that draws copies the source; the others draw on that copy
+                out = result
+            frame = result
+        return frame
+
+
+class Timeline:
+    def __init__(self, videos, video_ids, frame_counts, phases, fps):
+        """
+        Initialize a flat timeline of looped character videos.
+
+        Every entry plays one video, looped from its loop phase, for a whole
+        number of output frames. Entry start frames are kept in a sorted
+        array, so mapping an output time to a source frame is a binary search
+        and does not depend on the number of segments.
+
+        Args:
+            videos: List of distinct video paths
+            video_ids: Index into videos for each entry
+            frame_counts: Number of output frames for each entry
+            phases: Offset into the loop (seconds) at the start of each entry
+            fps: Output frame rate
+        """
+        self.fps = fps
+        self.videos = list(videos)
+        self.video_ids = np.asarray(video_ids, dtype=np.int32)
+        self.frame_counts = np.asarray(frame_counts, dtype=np.int64)
+        self.phases = np.asarray(phases, dtype=np.float64)
+        self.frame_starts = np.cumsum(self.frame_counts) - self.frame_counts
+        self.total_frames = int(self.frame_counts.sum())
+        self.duration = self.total_frames / fps
+
+        self.sources = None
+        self.loop_durations = None
+        self.size = None
+
+        # Optional layer drawn over every frame (e.g. subtitles.SubtitleLayer),
+        # looked up by output time; start_time is the time of frame 0
+        self.overlay = None
+        self.start_time = 0.0
+
+    @classmethod
+    def from_segments(cls, segments, fps):
+        """
+        Build a timeline from segment dictionaries.
+
+        Segments are placed back to back in output order; segments shorter
+        than one output frame are dropped.
+        """
+        segments = [s for s in segments if s['end'] - s['start'] > 0]
+        videos, video_ids, counts, phases = [], [], [], []
+        index = {}
+        for segment, frames in zip(segments, segment_frame_counts(segments, fps)):
+            if frames <= 0:
+                continue
+            if segment['video'] not in index:
+                index[segment['video']] = len(videos)
+                videos.append(segment['video'])
+            video_ids.append(index[segment['video']])
+            counts.append(frames)
+            phases.append(segment.get('phase', 0.0))
+        return cls(videos, video_ids, counts, phases, fps)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a timeline serialized with to_dict."""
+        return cls(data['videos'], data['video_ids'], data['frame_counts'], data['phases'], data['fps'])
+
+    def to_dict(self):
+        """Serialize the timeline (without bound sources) to plain Python types."""
+        return {
+            'fps': self.fps,
+            'videos': self.videos,
+            'video_ids': self.video_ids.tolist(),
+            'frame_counts': self.frame_counts.tolist(),
+            'phases': self.phases.tolist(),
+        }
+
+    def __len__(self):
+        return len(self.frame_counts)
+
+    def entries(self):
+        """Iterate over (video path, phase, frame count) for every entry."""
+        for video_id, phase, frames in zip(self.video_ids, self.phases, self.frame_counts):
+            yield self.videos[video_id], float(phase), int(frames)
+
+    def slice(self, first_frame, last_frame):
+        """
+        Return the part of the timeline covering output frames [first_frame, last_frame).
+
+        Entries cut at the start keep playing their loop where they were,
+        so the slice renders exactly the same frames as the full timeline.
+        """
+        first = int(np.searchsorted(self.frame_starts, first_frame, side='right')) - 1
+        last = int(np.searchsorted(self.frame_starts, last_frame, side='left'))
+
+        starts = np.maximum(self.frame_starts[first:last], first_frame)
+        ends = np.minimum(self.frame_starts[first:last] + self.frame_counts[first:last], last_frame)
+        phases = self.phases[first:last] + (starts - self.frame_starts[first:last]) / self.fps
+
+        video_ids = self.video_ids[first:last]
+        used = sorted(set(video_ids.tolist()))
+        remap = {old: new for new, old in enumerate(used)}
+        sliced = Timeline(
+            [self.videos[i] for i in used],
+            [remap[i] for i in video_ids.tolist()],
+            ends - starts, phases, self.fps
+        )
+        if self.sources is not None:
+            sliced.bind({path: self.sources[path] for path in sliced.videos}, self.size)
+        sliced.overlay = self.overlay
+        sliced.start_time = self.start_time + first_frame / self.fps
+        return sliced
+
+    def bind(self, sources, size=None):
+        """
+        Attach the clips that provide frames for each video.
+
+        Args:
+            sources: Dictionary mapping video paths to clips (anything with
+                get_frame, duration and size)
+            size: Output canvas size; defaults to the largest source, like a
+                compose concatenation
+        """
+        self.sources = sources
+        self.loop_durations = np.array([sources[path].duration for path in self.videos], dtype=np.float64)
+        if size is None:
+            size = (max(sources[p].size[0] for p in self.videos), max(sources[p].size[1] for p in self.videos))
+        self.size = tuple(size)
+        return self
+
+    def locate_frame(self, frame_index):
+        """
+        Map an output frame index to its source video and the time within that video.
+
+        Returns:
+            tuple: (video path, local time in seconds)
+        """
+        entry = int(np.searchsorted(self.frame_starts, frame_index, side='right')) - 1
+        video_id = self.video_ids[entry]
+        local_time = self.phases[entry] + (frame_index - self.frame_starts[entry]) / self.fps
+        return self.videos[video_id], local_time % self.loop_durations[video_id]
+
+    def locate(self, t):
+        """
+        Map an output time to its source video and the time within that video.
+
+        Returns:
+            tuple: (video path, local time in seconds)
+        """
+        return self.locate_frame(min(int(t * self.fps + 1e-6), self.total_frames - 1))
+
+    def frame_at(self, frame_index, out=None):
+        """
+        Produce output frame frame_index.
+
+        Full-canvas source frames are returned as they are. Smaller ones are
+        centered on the canvas, written into out when given so the caller
+        can reuse one buffer for every frame. The overlay, if any, is drawn
+        on a copy (in out when given), never on the source frame.
+
+        Args:
+            frame_index: Output frame index
+            out: Optional preallocated (height, width, 3) uint8 canvas with a black border
+
+        Returns:
+            np.ndarray: The frame
+        """
+        video_path, local_time = self.locate_frame(frame_index)
+        frame = self.sources[video_path].get_frame(local_time)
+        height, width = frame.shape[:2]
+        if (width, height) != self.size:
+            if out is None:
+                out = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+            else:
+                out.fill(0)
+            x = (self.size[0] - width) // 2
+            y = (self.size[1] - height) // 2
+            out[y:y + height, x:x + width] = frame[:, :, :3]
+            frame = out
+
+        if self.overlay is not None:
+            frame = self.overlay.apply(frame, self.start_time + frame_index / self.fps, out)
+        return frame
+
+    def make_frame(self, t):
+        """Produce the output frame at time t, centered on the canvas."""
+        return self.frame_at(min(int(t * self.fps + 1e-6), self.total_frames - 1))
+
+    def to_clip(self):
+        """Wrap the timeline in a single moviepy VideoClip."""
+        from moviepy.editor import VideoClip
+        return VideoClip(self.make_frame, duration=self.duration)
@@ -1,25 +1,76 @@
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips
+from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_audioclips
 import os
-import json
 import logging
 from datetime import datetime
+from contextlib import contextmanager
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tile_renderer import TileRenderer
+from chunk_renderer import ChunkRenderer
+from preview import PreviewRenderer, parse_time_range
+from renditions import MultiRenditionEncoder, load_renditions, rendition_path
+from timeline import Timeline, OverlayStack, coalesce_segments, assign_loop_phases
+from render_cache import RenderCache
+from frame_cache import LoopFrameCache
+from ffmpeg_utils import mux_audio
+from encoders import create_encoder
+from metrics import Metrics
+from segment_plan import compile_plan
+from media_probe import ProbeCache
+from stills import load_still
+from envelope import load_envelope, talking_mask, split_by_activity
+from stage import StageCompositor, load_stage_layout, stage_cast
+from subtitles import SUBTITLE_MODES, SubtitleLayer, caption_cues, subtitle_style
+from visualizer import VISUALIZER_MODES, VisualizerLayer, visualizer_style, load_visualizer_data, output_order
 
 class VideoEditor:
-    def __init__(self, config):
+    def __init__(self, config, metrics=None, plan=None, probe_cache=None, frame_cache=None):
         """
         Initialize the VideoEditor with the provided configuration.
         
         Args:
             config: Dictionary containing configuration parameters
+            metrics: Optional Metrics receiving timing spans and progress events;
+                defaults to a JSON lines file at METRICS_FILE when configured
+            plan: Optional SegmentPlan already compiled from the timestamps file
+            probe_cache: Optional ProbeCache shared with other renders
+            frame_cache: Optional LoopFrameCache shared with other renders; it is
+                left untouched by close()
         """
         self.config = config
+        self.plan = plan
+        self._owns_metrics = metrics is None
+        self.metrics = metrics or Metrics(config.get('METRICS_FILE'))
         self.audio_file = config.get('AUDIO_FILE')
         self.timestamps_file = config.get('TIMESTAMPS_FILE')
         self.output_dir = config.get('OUTPUT_DIR')
         self.video_fps = config.get('VIDEO_FPS', 30)
         self.video_codec = config.get('VIDEO_CODEC', 'libx264')
         self.video_audio_codec = config.get('VIDEO_AUDIO_CODEC', 'aac')
+        self.render_mode = config.get('RENDER_MODE', 'compose')
+        self.workers = int(config.get('WORKERS', 1))
+        self.audio_mode = config.get('AUDIO_MODE', 'clip')
+        self.encoder_backend = config.get('ENCODER_BACKEND', 'moviepy')
+        self.render_cache_enabled = bool(config.get('RENDER_CACHE', False))
+        self.render_cache_max_mb = int(config.get('RENDER_CACHE_MAX_MB', 10240))
+        self.window_seconds = float(config.get('WINDOW_SECONDS') or 0)
+        self.static_threshold = float(config.get('STATIC_MOTION_THRESHOLD', 0))
+        self.coalesce = bool(config.get('COALESCE_SEGMENTS', True))
+        self.loop_continuity = config.get('LOOP_CONTINUITY', 'global')
+        self.talk_on_db = float(config.get('TALK_ON_DB', -35.0))
+        self.talk_off_db = float(config.get('TALK_OFF_DB', -45.0))
+        self.talk_min_hold = float(config.get('TALK_MIN_HOLD', 0.3))
+        self.subtitles_mode = config.get('SUBTITLES', 'off')
+        if self.subtitles_mode not in SUBTITLE_MODES:
+            raise ValueError(f"Unknown SUBTITLES mode: {self.subtitles_mode} (expected one of {', '.join(SUBTITLE_MODES)})")
+        self.visualizer_style = visualizer_style(config)
+        if self.visualizer_style['mode'] not in VISUALIZER_MODES:
+            raise ValueError(f"Unknown VISUALIZER mode: {self.visualizer_style['mode']} (expected one of {', '.join(VISUALIZER_MODES)})")
+        self.stage_layout = load_stage_layout(config['STAGE_LAYOUT']) if config.get('STAGE_LAYOUT') else None
+        self.preview = bool(config.get('PREVIEW', False))
+        self.preview_range = config.get('PREVIEW_RANGE')
+        self.cache_dir = config.get('CACHE_DIR') or os.path.join(self.output_dir, '.cache')
         
         # Set up logging
         logging.basicConfig(
@@ -39,206 +90,154 @@ class VideoEditor:
         if not os.path.exists(self.audio_file):
             raise FileNotFoundError(f"Audio file not found: {self.audio_file}")
         
-        self.audio_clip = AudioFileClip(self.audio_file)
-        self.audio_duration = self.audio_clip.duration
+        # Media metadata is cached on disk, keyed by path, size and mtime
+        self.probe_cache = probe_cache or ProbeCache(os.path.join(self.cache_dir, 'media_probe.json'))
+        
+        # The audio reader is only opened when a moviepy audio track is needed
+        self._audio_clip = None
+        self.audio_duration = self.probe_cache.duration(self.audio_file)
+        self.probe_cache.save()
         self.logger.info(f"Loaded audio file: {self.audio_file} (duration: {self.audio_duration:.2f}s)")
         
         # Cache for video clips to avoid reloading
         self.video_cache = {}
+        
+        # Images and loops without visible motion, rendered from a single frame
+        self.stills = set()
+        
+        # Captions and audio bars drawn into the frames of the current render, if any
+        self.subtitle_layer = None
+        self.visualizer_layer = None
+        
+        # Talking and idle loop of every character, for the stage layout
+        self.cast = {}
+        self.stage_compositor = None
+        
+        # Wall time spent in each stage of the last render, in seconds
+        self.stage_timings = {}
+        
+        # Optional cache of loops decoded once and shared by all segments
+        self.frame_cache = frame_cache
+        self._owns_frame_cache = frame_cache is None
+        if frame_cache is None and int(config.get('FRAME_CACHE_MB', 0)) > 0:
+            self.frame_cache = LoopFrameCache(
+                int(config['FRAME_CACHE_MB']) * 1024 * 1024,
+                self.video_fps,
+                mmap_dir=os.path.join(self.cache_dir, 'frames'),
+                mmap_threshold_bytes=int(config.get('FRAME_CACHE_MMAP_MB', 256)) * 1024 * 1024,
+                probe=self.probe_cache.probe
+            )
+
+    @property
+    def audio_clip(self):
+        """The source audio as a moviepy clip, opened on first use."""
+        if self._audio_clip is None:
+            self._audio_clip = AudioFileClip(self.audio_file)
+        return self._audio_clip
+
+    @contextmanager
+    def _stage(self, name, **fields):
+        """Time a stage of the render, emit it as a metrics span and add it to stage_timings."""
+        stage_start = time.time()
+        try:
+            with self.metrics.span(name, **fields):
+                yield
+        finally:
+            self.stage_timings[name] = self.stage_timings.get(name, 0.0) + time.time() - stage_start
 
     def load_segments(self):
         """
-        Load and parse the timestamps file (JSON or TXT format).
+        Load the segment plan (compiling the timestamps file if needed).
         
         Returns:
             list: List of segment dictionaries with video path, start and end times
         """
-        if not os.path.exists(self.timestamps_file):
-            raise FileNotFoundError(f"Timestamps file not found: {self.timestamps_file}")
+        with self._stage('map_characters'):
+            if self.plan is None:
+                self.plan = compile_plan(
+                    self.timestamps_file, self.config.get('CHARACTER_MAPPING'), self.audio_duration
+                )
+            plan = self.plan.resolve(self.audio_duration)
+        for problem in plan.issues():
+            self.logger.warning(problem)
+        return plan.to_segments()
+
+    def compact_segments(self, segments):
+        """
+        Merge adjacent segments of the same video and set continuous loop phases.
         
-        # Check file extension to determine format
-        file_extension = os.path.splitext(self.timestamps_file)[1].lower()
+        Segments with an idle loop are first split into talking and idle
+        parts from the loudness envelope of the audio.
         
-        if file_extension == '.txt':
-            return self._load_segments_from_txt()
-        elif file_extension == '.json':
-            return self._load_segments_from_json()
-        else:
-            # Try to auto-detect format - check first character
-            try:
-                with open(self.timestamps_file, 'r', encoding='utf-8') as f:
-                    first_char = f.read(1)
-                if first_char in ['{', '[']:
-                    return self._load_segments_from_json()
-                else:
-                    return self._load_segments_from_txt()
-            except:
-                return self._load_segments_from_txt()
-
-    def _load_segments_from_json(self):
-        """Load segments from JSON format."""
-        with open(self.timestamps_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Check if the JSON format matches the specification format
-        if isinstance(data, dict):
-            # Convert specification format to internal format
-            segments = []
-            for video_path, times in data.items():
-                # Handle time format (either "00:00" or numeric seconds)
-                start = self._parse_time(times.get('start_time', times.get('start', 0)))
-                end = self._parse_time(times.get('end_time', times.get('end', 0)))
-                
-                segments.append({
-                    'video': video_path,
-                    'start': start,
-                    'end': end
-                })
-            # Sort segments by start time
-            segments.sort(key=lambda x: x['start'])
-            return segments
-        elif isinstance(data, list):
-            # Already in the expected format
-            # Convert any time strings to seconds
-            for segment in data:
-                segment['start'] = self._parse_time(segment.get('start', 0))
-                segment['end'] = self._parse_time(segment.get('end', 0))
-            return data
+        Args:
+            segments: List of segment dictionaries
+            
+        Returns:
+            list: Compacted segment dictionaries with a 'phase' each
+        """
+        if self.stage_layout is not None:
+            self.cast = stage_cast(segments)
+        if any(segment.get('idle') for segment in segments):
+            envelope = load_envelope(self.audio_file, self.video_fps, self.cache_dir)
+            mask = talking_mask(envelope, self.video_fps, self.talk_on_db, self.talk_off_db, self.talk_min_hold)
+            split = split_by_activity(segments, mask, self.video_fps)
+            self.logger.info(f"Split {len(segments)} segments into {len(split)} talking/idle parts")
+            segments = split
+        if self.coalesce:
+            compacted = coalesce_segments(segments)
+            self.logger.info(f"Coalesced {len(segments)} segments into {len(compacted)}")
         else:
-            raise ValueError("Invalid JSON timestamp format. Expected a list of segments or a dictionary mapping videos to timestamps.")
+            compacted = [s for s in segments if s['end'] - s['start'] > 0]
+        return assign_loop_phases(compacted, self.video_fps, self.loop_continuity)
 
-    def _load_segments_from_txt(self):
+    def preflight(self, segments):
         """
-        Load segments from TXT format.
-        Expected format:
-        MM:SS 캐릭터이름
-        대사내용
+        Probe every video used by the segments and the audio file concurrently.
         
-        MM:SS 캐릭터이름  
-        대사내용
-        """
-        segments = []
-        current_segments = []
+        Fails before any rendering starts if a file is missing or unreadable,
+        or if a video has no video stream.
         
-        with open(self.timestamps_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # Parse lines to extract timestamps and characters
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Check if line starts with timestamp (MM:SS format)
-            if ':' in line and len(line.split()) >= 2:
-                parts = line.split(' ', 2)
-                if len(parts) >= 2:
-                    time_part = parts[0]
-                    character_part = ' '.join(parts[1:])
-                    
-                    # Validate time format
-                    if self._is_valid_time_format(time_part):
-                        current_segments.append({
-                            'time': time_part,
-                            'character': character_part
-                        })
-        
-        # Convert parsed segments to video segments
-        for i, segment in enumerate(current_segments):
-            start_time = self._parse_time(segment['time'])
-            
-            # Determine end time (next segment's start time or end of audio)
-            if i + 1 < len(current_segments):
-                end_time = self._parse_time(current_segments[i + 1]['time'])
-            else:
-                end_time = self.audio_duration
-            
-            # Map character to video file
-            video_path = self._map_character_to_video(segment['character'])
+        Args:
+            segments: List of segment dictionaries
             
-            segments.append({
-                'video': video_path,
-                'start': start_time,
-                'end': end_time
-            })
-        
-        self.logger.info(f"Loaded {len(segments)} segments from TXT file")
-        return segments
-
-    def _is_valid_time_format(self, time_str):
-        """Check if string is in valid time format (MM:SS or HH:MM:SS)."""
-        try:
-            parts = time_str.split(':')
-            if len(parts) == 2:
-                # MM:SS format
-                int(parts[0])  # Minutes
-                int(parts[1])  # Seconds
-                return True
-            elif len(parts) == 3:
-                # HH:MM:SS format
-                int(parts[0])  # Hours
-                int(parts[1])  # Minutes
-                int(parts[2])  # Seconds
-                return True
-            return False
-        except ValueError:
-            return False
-
-    def _map_character_to_video(self, character_name):
-        """
-        Map character names to video file paths.
-        You can customize this mapping in the config or create a separate mapping file.
-        """
-        # Default character to video mapping
-        character_mapping = {
-            '말하는 감자': 'input/말하는 감자.mov',
-            '말하는 토마토': 'input/말하는 토마토.mov',
-        }
-        
-        # Check if custom mapping exists in config
-        if 'CHARACTER_MAPPING' in self.config:
-            character_mapping.update(self.config['CHARACTER_MAPPING'])
-        
-        # Find matching character (case-insensitive and partial matching)
-        character_lower = character_name.lower()
-        for char_key, video_path in character_mapping.items():
-            if char_key.lower() in character_lower or character_lower in char_key.lower():
-                self.logger.debug(f"Mapped character '{character_name}' to video '{video_path}'")
-                return video_path
-        
-        # If no mapping found, use the character name as filename
-        default_path = f"input/{character_name}.mov"
-        self.logger.warning(f"No mapping found for character '{character_name}', using default path: {default_path}")
-        return default_path
+        Returns:
+            dict: Metadata of every media file, keyed by path
+        """
+        workers = int(self.config.get('PREFLIGHT_WORKERS', 8))
+        videos = list(dict.fromkeys(
+            path for segment in segments for path in (segment['video'], segment.get('idle')) if path
+        ))
+        infos = self.probe_cache.preflight([self.audio_file], video_paths=videos, workers=workers)
+        self.stills = self.find_stills(videos, workers)
+        return infos
 
-    def _parse_time(self, time_value):
+    def find_stills(self, video_paths, workers=8):
         """
-        Parse time values in various formats to seconds.
+        Find the images and the loops that barely move.
+        
+        Loops whose frames never differ from the first one by more than
+        STATIC_MOTION_THRESHOLD (mean absolute difference of the most moving
+        8x8 block of a 64x64 thumbnail, 0-255) are treated as stills; a
+        threshold of 0 only accepts images.
         
         Args:
-            time_value: Time value in seconds (float/int), string format "MM:SS", or "end"
+            video_paths: Distinct video paths
+            workers: Number of threads measuring motion
             
         Returns:
-            float: Time in seconds
-        """
-        if isinstance(time_value, (int, float)):
-            return float(time_value)
-        elif isinstance(time_value, str):
-            # Handle special "end" keyword
-            if time_value.lower() == 'end':
-                self.logger.info(f"Using audio file end time: {self.audio_duration:.2f}s")
-                return self.audio_duration
-            # Handle "MM:SS" format
-            elif ':' in time_value:
-                parts = time_value.split(':')
-                if len(parts) == 2:
-                    return int(parts[0]) * 60 + float(parts[1])
-                elif len(parts) == 3:
-                    return int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2])
-            # Try direct conversion
-            return float(time_value)
-        else:
-            raise ValueError(f"Invalid time format: {time_value}")
+            set: Paths rendered from a single frame
+        """
+        def is_still(path):
+            if self.probe_cache.probe(path).get('still'):
+                return True
+            return self.static_threshold > 0 and self.probe_cache.motion(path) <= self.static_threshold
+        
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            stills = {path for path, still in zip(video_paths, executor.map(is_still, video_paths)) if still}
+        self.probe_cache.save()
+        for path in stills:
+            self.logger.info(f"Rendering {path} as a still")
+        return stills
 
     def get_video_clip(self, video_path):
         """
@@ -248,17 +247,135 @@ class VideoEditor:
             video_path: Path to the video file
             
         Returns:
-            VideoFileClip: The loaded video clip
+            VideoFileClip: The loaded video clip (a one-frame CachedLoop for stills)
         """
+        if video_path in self.stills and video_path in self.video_cache:
+            return self.video_cache[video_path]
         if video_path not in self.video_cache:
             if not os.path.exists(video_path):
                 raise FileNotFoundError(f"Video file not found: {video_path}")
+            
+            if video_path in self.stills:
+                # A single decoded frame, served for every output frame
+                self.video_cache[video_path] = load_still(
+                    video_path, self.video_fps, self.probe_cache.probe(video_path)['size']
+                )
+                self.logger.info(f"Loaded still: {video_path}")
+                return self.video_cache[video_path]
                 
             self.video_cache[video_path] = VideoFileClip(video_path)
             self.logger.info(f"Loaded video: {video_path} (duration: {self.video_cache[video_path].duration:.2f}s)")
             
         return self.video_cache[video_path].copy()
 
+    def build_timeline(self, segments):
+        """
+        Build a flat timeline of the segments, bound to the cached video clips
+        or, when the frame cache is enabled, to the decoded loops.
+        
+        With a stage layout, the timeline of the active speaker is wrapped in
+        a StageCompositor that shows every character at once.
+        
+        Args:
+            segments: List of segment dictionaries
+            
+        Returns:
+            Timeline: Timeline mapping output times to source video frames
+            (or a StageCompositor producing the same frames interface)
+        """
+        if self.stage_layout is not None:
+            compositor = StageCompositor.from_segments(
+                segments, self.video_fps, self.cast, self.stage_layout, probe=self.probe_cache.probe
+            )
+            compositor.overlay = self.overlay
+            if len(compositor):
+                with self._stage('prepare_stage', characters=len(self.cast)):
+                    compositor.load()
+                self.stage_compositor = compositor
+            return compositor
+        
+        timeline = Timeline.from_segments(segments, self.video_fps)
+        timeline.overlay = self.overlay
+        if len(timeline):
+            def get_source(path):
+                if self.frame_cache is None or path in self.stills:
+                    return self.get_video_clip(path)
+                return self.frame_cache.get(path)
+            
+            with self._stage('open_clips', videos=len(timeline.videos)):
+                timeline.bind({path: get_source(path) for path in timeline.videos})
+        return timeline
+
+    def prepare_subtitles(self, segments, output_filename):
+        """
+        Write the .srt sidecar of the dialogue and, in burn mode, set up the
+        caption layer drawn over the frames.
+        
+        Must run before compact_segments, while every segment still carries
+        its own dialogue.
+        
+        Args:
+            segments: List of segment dictionaries in output order
+            output_filename: Name of the output file; the sidecar gets the same base name
+            
+        Returns:
+            str: Path of the .srt file
+        """
+        cues = caption_cues(segments, int(self.config.get('SUBTITLE_MAX_CHARS', 84)))
+        layer = SubtitleLayer(cues, subtitle_style(self.config))
+        srt_path = os.path.join(self.output_dir, os.path.splitext(output_filename)[0] + '.srt')
+        layer.write_srt(srt_path)
+        self.logger.info(f"Wrote {len(cues)} captions to {srt_path}")
+        
+        if self.subtitles_mode == 'burn' and cues:
+            self.subtitle_layer = layer
+        return srt_path
+
+    def prepare_visualizer(self, segments):
+        """
+        Compute (or load from the cache) the audio bars of the episode and
+        set up the layer drawing them.
+        
+        Args:
+            segments: Compacted segment dictionaries in output order
+            
+        Returns:
+            VisualizerLayer: The layer
+        """
+        levels = load_visualizer_data(self.audio_file, self.video_fps, self.visualizer_style, self.cache_dir)
+        self.visualizer_layer = VisualizerLayer(
+            output_order(levels, segments, self.video_fps), self.video_fps, self.visualizer_style
+        )
+        self.logger.info(f"Prepared {self.visualizer_style['mode']} visualizer ({levels.nbytes / 1e6:.1f} MB of levels)")
+        return self.visualizer_layer
+
+    @property
+    def overlay(self):
+        """Layers drawn over every frame: the visualizer, then the captions."""
+        layers = [layer for layer in (self.visualizer_layer, self.subtitle_layer) if layer is not None]
+        if len(layers) > 1:
+            return OverlayStack(layers)
+        return layers[0] if layers else None
+
+    def build_audio(self, segments):
+        """
+        Build the audio track matching the segments.
+        
+        Args:
+            segments: List of segment dictionaries
+            
+        Returns:
+            AudioClip: One subclip when the segments are contiguous, otherwise
+            the concatenation of each segment's audio
+        """
+        segments = [s for s in segments if s['end'] - s['start'] > 0]
+        contiguous = all(
+            abs(segments[i]['end'] - segments[i + 1]['start']) < 1e-6 for i in range(len(segments) - 1)
+        )
+        if contiguous:
+            return self.audio_clip.subclip(segments[0]['start'], segments[-1]['end'])
+        return concatenate_audioclips([self.audio_clip.subclip(s['start'], s['end']) for s in segments])
+
     def process_segment(self, segment):
         """
         Process a single segment by cutting and looping video as needed.
@@ -267,7 +384,7 @@ class VideoEditor:
             segment: Dictionary with video path, start and end times
             
         Returns:
-            VideoFileClip: Processed video clip with audio
+            VideoClip: Processed video clip with audio
         """
         video_path = segment['video']
         start_time = segment['start']
@@ -279,33 +396,14 @@ class VideoEditor:
             self.logger.warning(f"Skipping segment with invalid duration: {segment}")
             return None
             
-        # Get the base video clip
         try:
-            video_clip = self.get_video_clip(video_path)
-            video_duration = video_clip.duration
-            
-            # Process the video based on needed duration
-            if segment_duration <= video_duration:
-                # Use just a portion of the video
-                processed_video = video_clip.subclip(0, min(segment_duration, video_duration))
-                self.logger.info(f"Using {segment_duration:.2f}s portion of {video_path}")
-            else:
-                # Need to loop the video
-                loops_needed = int(segment_duration // video_duration)
-                remainder = segment_duration % video_duration
-                
-                self.logger.info(
-                    f"Looping {video_path} {loops_needed} times with {remainder:.2f}s remainder "
-                    f"for {segment_duration:.2f}s segment"
-                )
-                
-                # Create loops plus remainder
-                clips = [video_clip.copy() for _ in range(loops_needed)]
-                if remainder > 0:
-                    remainder_clip = video_clip.subclip(0, remainder)
-                    clips.append(remainder_clip)
-                
-                processed_video = concatenate_videoclips(clips, method="compose")
+            timeline = self.build_timeline([segment])
+            if not len(timeline):
+                self.logger.warning(f"Skipping segment shorter than one frame: {segment}")
+                return None
+            
+            self.logger.info(f"Looping {video_path} for {segment_duration:.2f}s segment")
+            processed_video = timeline.to_clip()
             
             # Cut the audio segment
             audio_segment = self.audio_clip.subclip(start_time, end_time)
@@ -319,66 +417,113 @@ class VideoEditor:
             self.logger.error(f"Error processing segment {segment}: {str(e)}")
             raise
 
-    def create_final_video(self, output_filename):
+    def create_final_video(self, output_filename, renditions=None):
         """
-        Create the final video by processing all segments and concatenating them.
+        Create the final video by mapping all segments onto one timeline and encoding it.
         
         Args:
             output_filename: Name of the output file
+            renditions: Optional list of renditions (see renditions.load_renditions);
+                defaults to RENDITIONS from the configuration
             
         Returns:
-            str: Path to the created video
+            str: Path to the created video, or a list of paths (one per rendition)
         """
+        if renditions is None and self.config.get('RENDITIONS'):
+            renditions = self.config['RENDITIONS']
+        if renditions is not None:
+            renditions = load_renditions(renditions)
         start_time = time.time()
+        self.stage_timings = {}
+        self.subtitle_layer = None
+        self.visualizer_layer = None
         self.logger.info(f"Starting to create final video: {output_filename}")
+        self.metrics.emit('render_start', output=output_filename, mode='preview' if self.preview else self.render_mode)
+        status = 'error'
         
         try:
             # Load segments
-            segments = self.load_segments()
+            with self._stage('load_segments'):
+                segments = self.load_segments()
             self.logger.info(f"Loaded {len(segments)} segments from {self.timestamps_file}")
             
-            # Process each segment
-            processed_clips = []
-            for i, segment in enumerate(segments):
-                self.logger.info(f"Processing segment {i+1}/{len(segments)}: {segment}")
-                processed_clip = self.process_segment(segment)
-                if processed_clip is not None:
-                    processed_clips.append(processed_clip)
+            with self._stage('preflight'):
+                self.preflight(segments)
+            
+            if self.subtitles_mode != 'off':
+                with self._stage('subtitles'):
+                    self.prepare_subtitles(segments, output_filename)
+            
+            with self._stage('compact_timeline', segments=len(segments)):
+                segments = self.compact_segments(segments)
             
-            if not processed_clips:
+            if self.visualizer_style['mode'] != 'off':
+                with self._stage('visualizer'):
+                    self.prepare_visualizer(segments)
+            
+            if self.preview:
+                output_path = self._create_preview(segments, output_filename, start_time)
+                status = 'ok'
+                return output_path
+            if renditions:
+                output_paths = self._create_renditions(segments, output_filename, renditions, start_time)
+                status = 'ok'
+                return output_paths
+            if self.stage_layout is not None and (self.render_mode == 'tiles' or self.workers > 1
+                                                  or self.render_cache_enabled or self.window_seconds > 0):
+                self.logger.warning("The stage layout is composited in a single pass; ignoring tile and chunk settings")
+            elif self.render_mode == 'tiles':
+                output_path = self._create_video_from_tiles(segments, output_filename, start_time)
+                status = 'ok'
+                return output_path
+            elif self.workers > 1 or self.render_cache_enabled or self.window_seconds > 0:
+                output_path = self._create_video_in_chunks(segments, output_filename, start_time)
+                status = 'ok'
+                return output_path
+            
+            # Map every output frame to its source video through one flat timeline
+            with self._stage('build_timeline', segments=len(segments)):
+                timeline = self.build_timeline(segments)
+            if not len(timeline):
                 raise ValueError("No valid segments to process")
-                
-            # Concatenate all processed segments
-            self.logger.info(f"Concatenating {len(processed_clips)} processed clips")
-            final_clip = concatenate_videoclips(processed_clips, method="compose")
+            
+            self.logger.info(f"Built timeline of {len(timeline)} segments from {len(timeline.videos)} videos")
+            progress = self.metrics.progress_callback('encode') if self.metrics.enabled else None
+            encoder = create_encoder(self.config, progress=progress)
             
             # Write the final video
             output_path = os.path.join(self.output_dir, output_filename)
-            self.logger.info(f"Writing final video to {output_path}")
-            
-            final_clip.write_videofile(
-                output_path,
-                fps=self.video_fps,
-                codec=self.video_codec,
-                audio_codec=self.video_audio_codec,
-                threads=4,
-                preset='medium',  # Better balance between speed and quality
-                ffmpeg_params=['-crf', '23']  # Constant rate factor for quality
-            )
+            self.logger.info(f"Writing final video to {output_path} ({self.encoder_backend} encoder)")
+            
+            if self.audio_mode == 'mux' or self.encoder_backend != 'moviepy':
+                # Render the video track alone and mux the original audio in once
+                video_only_path = output_path + '.video.mp4'
+                try:
+                    with self._stage('encode'):
+                        encoder.encode(timeline, video_only_path)
+                    self.logger.info(f"Muxing audio from {self.audio_file}")
+                    valid_segments = [s for s in segments if s['end'] - s['start'] > 0]
+                    with self._stage('mux'):
+                        mux_audio(
+                            video_only_path, self.audio_file,
+                            [(s['start'], s['end']) for s in valid_segments],
+                            output_path, audio_codec=self.video_audio_codec
+                        )
+                finally:
+                    if os.path.exists(video_only_path):
+                        os.remove(video_only_path)
+            else:
+                with self._stage('encode'):
+                    encoder.encode(timeline, output_path, audio=self.build_audio(segments))
             
             # Calculate and log total duration
-            total_duration = sum(clip.duration for clip in processed_clips)
+            total_duration = timeline.duration
             self.logger.info(
                 f"Video created successfully! Duration: {total_duration:.2f}s, "
                 f"Processing time: {time.time() - start_time:.2f}s"
             )
             
-            # Cleanup
-            self.logger.info("Cleaning up resources")
-            final_clip.close()
-            for clip in processed_clips:
-                clip.close()
-            
+            status = 'ok'
             return output_path
             
         except Exception as e:
@@ -386,13 +531,174 @@ class VideoEditor:
             raise
         finally:
             # Cleanup video cache
-            self.close()
+            with self._stage('cleanup'):
+                self.release_media()
+            self.metrics.emit(
+                'render_end', output=output_filename, status=status,
+                duration=round(time.time() - start_time, 3), stages=self.stage_timings
+            )
 
-    def close(self):
-        """Clean up all resources."""
+    def _create_video_from_tiles(self, segments, output_filename, start_time):
+        """
+        Create the final video by joining pre-encoded loop tiles with stream copy.
+        
+        Args:
+            segments: List of segment dictionaries
+            output_filename: Name of the output file
+            start_time: Time the render started, for logging
+            
+        Returns:
+            str: Path to the created video
+        """
+        output_path = os.path.join(self.output_dir, output_filename)
+        self.logger.info(f"Writing final video to {output_path} (tile mode)")
+        if self.subtitle_layer is not None:
+            self.logger.warning("Tile mode joins pre-encoded loops and cannot burn in captions; only the .srt is written")
+        if self.visualizer_layer is not None:
+            self.logger.warning("Tile mode joins pre-encoded loops and cannot draw the visualizer")
+        
+        renderer = TileRenderer(self.config, self.cache_dir, metrics=self.metrics, probe=self.probe_cache.probe)
+        with self._stage('render_tiles'):
+            renderer.render(segments, self.audio_file, output_path)
+        
+        self.logger.info(
+            f"Video created successfully! Processing time: {time.time() - start_time:.2f}s"
+        )
+        return output_path
+
+    def _create_preview(self, segments, output_filename, start_time):
+        """
+        Create a low-resolution, low frame rate preview from cached proxies,
+        optionally limited to PREVIEW_RANGE.
+        
+        Args:
+            segments: List of segment dictionaries
+            output_filename: Name of the output file
+            start_time: Time the render started, for logging
+            
+        Returns:
+            str: Path to the created preview
+        """
+        output_path = os.path.join(self.output_dir, output_filename)
+        time_range = parse_time_range(self.preview_range) if self.preview_range else None
+        if self.stage_layout is not None:
+            self.logger.info("Previews show the active speaker only, without the stage layout")
+        self.logger.info(f"Writing preview to {output_path}" + (f" (range {self.preview_range})" if time_range else ''))
+        
+        renderer = PreviewRenderer(self.config, self.cache_dir, metrics=self.metrics, probe=self.probe_cache.probe)
+        with self._stage('render_preview'):
+            renderer.render(segments, self.audio_file, output_path, time_range, overlay=self.overlay)
+        
+        self.logger.info(
+            f"Preview created successfully! Processing time: {time.time() - start_time:.2f}s"
+        )
+        return output_path
+
+    def _create_renditions(self, segments, output_filename, renditions, start_time):
+        """
+        Create several renditions of the video from a single pass over the timeline.
+        
+        Each frame is produced once and scaled and encoded by one worker per
+        rendition; the audio is then muxed into every rendition.
+        
+        Args:
+            segments: List of segment dictionaries
+            output_filename: Name of the output file; rendition names are appended
+            renditions: List of rendition dictionaries
+            start_time: Time the render started, for logging
+            
+        Returns:
+            list: Paths to the created videos, in rendition order
+        """
+        if self.render_mode == 'tiles' or self.workers > 1 or self.window_seconds > 0:
+            self.logger.warning("Renditions are rendered in a single compose pass; tiles, workers and windows are ignored")
+        
+        with self._stage('build_timeline', segments=len(segments)):
+            timeline = self.build_timeline(segments)
+        if not len(timeline):
+            raise ValueError("No valid segments to process")
+        
+        output_paths = [rendition_path(os.path.join(self.output_dir, output_filename), r) for r in renditions]
+        video_only_paths = [path + '.video.mp4' for path in output_paths]
+        self.logger.info(
+            f"Writing {len(renditions)} renditions: "
+            + ', '.join(f"{r['name']} ({r['width']}x{r['height']})" for r in renditions)
+        )
+        
+        progress = self.metrics.progress_callback('encode') if self.metrics.enabled else None
+        valid_segments = [s for s in segments if s['end'] - s['start'] > 0]
         try:
-            if hasattr(self, 'audio_clip') and self.audio_clip is not None:
-                self.audio_clip.close()
+            with self._stage('encode', renditions=len(renditions)):
+                MultiRenditionEncoder(self.config, renditions, progress=progress).encode(timeline, video_only_paths)
+            with self._stage('mux'):
+                for video_only_path, output_path in zip(video_only_paths, output_paths):
+                    mux_audio(
+                        video_only_path, self.audio_file,
+                        [(s['start'], s['end']) for s in valid_segments],
+                        output_path, audio_codec=self.video_audio_codec
+                    )
+        finally:
+            for video_only_path in video_only_paths:
+                if os.path.exists(video_only_path):
+                    os.remove(video_only_path)
+        
+        self.logger.info(
+            f"Renditions created successfully! Processing time: {time.time() - start_time:.2f}s"
+        )
+        return output_paths
+
+    def _create_video_in_chunks(self, segments, output_filename, start_time):
+        """
+        Create the final video by rendering chunks across a process pool,
+        reusing cached segment renders when the render cache is enabled.
+        With WINDOW_SECONDS set, the chunks are fixed time windows whose
+        readers are released before the next window starts.
+        
+        Args:
+            segments: List of segment dictionaries
+            output_filename: Name of the output file
+            start_time: Time the render started, for logging
+            
+        Returns:
+            str: Path to the created video
+        """
+        output_path = os.path.join(self.output_dir, output_filename)
+        self.logger.info(f"Writing final video to {output_path} ({self.workers} workers)")
+        
+        render_cache = None
+        if self.render_cache_enabled:
+            render_cache = RenderCache(
+                os.path.join(self.cache_dir, 'renders'),
+                self.render_cache_max_mb * 1024 * 1024
+            )
+        
+        frame_cache_settings = None
+        if self.frame_cache is not None:
+            frame_cache_settings = {
+                'max_bytes': self.frame_cache.max_bytes,
+                'mmap_dir': self.frame_cache.mmap_dir,
+                'mmap_threshold_bytes': self.frame_cache.mmap_threshold_bytes,
+            }
+        
+        renderer = ChunkRenderer(
+            self.config, self.cache_dir, self.workers, render_cache, frame_cache_settings,
+            metrics=self.metrics, window_seconds=self.window_seconds, probe=self.probe_cache.probe,
+            stills=self.stills, subtitles=self.subtitle_layer, visualizer=self.visualizer_layer
+        )
+        with self._stage('render_chunks'):
+            renderer.render(segments, self.audio_file, output_path)
+        
+        self.logger.info(
+            f"Video created successfully! Processing time: {time.time() - start_time:.2f}s"
+        )
+        return output_path
+
+    def release_media(self):
+        """Close the clips and caches of the last render; the editor can render again."""
+        try:
+            if getattr(self, '_audio_clip', None) is not None:
+                self._audio_clip.close()
+                self._audio_clip = None
                 
             # Close all cached video clips
             for path, clip in self.video_cache.items():
@@ -400,5 +706,18 @@ class VideoEditor:
                     clip.close()
             self.video_cache.clear()
             
+            if self.frame_cache is not None and self._owns_frame_cache:
+                self.frame_cache.clear()
+            
+            if self.stage_compositor is not None:
+                self.stage_compositor.close()
+                self.stage_compositor = None
+            
         except Exception as e:
-            self.logger.error(f"Error closing resources: {str(e)}")
\ No newline at end of file
+            self.logger.error(f"Error closing resources: {str(e)}")
+
+    def close(self):
+        """Clean up all resources, including the metrics file the editor opened itself."""
+        self.release_media()
+        if self._owns_metrics:
+            self.metrics.close()
@@ -0,0 +1,296 @@
+import os
+import logging
+
+import numpy as np
+
+from envelope import open_samples, load_envelope
+from render_cache import RenderCache, file_fingerprint
+from timeline import segment_frame_counts
+from stage import parse_color
+
+logger = logging.getLogger(__name__)
+
+VISUALIZER_MODES = ('off', 'spectrum', 'waveform')
+
+# Loudness mapped to empty and full bars
+FLOOR_DB = -60.0
+CEILING_DB = 0.0
+
+# Frequency range of the spectrum bars
+MIN_FREQUENCY = 50.0
+MAX_FREQUENCY = 12000.0
+
+
+def visualizer_style(config):
+    """Collect the visualizer settings from the configuration."""
+    box = config.get('VISUALIZER_BOX', '0.1,0.68,0.8,0.12')
+    if isinstance(box, str):
+        box = [float(v) for v in box.split(',')]
+    return {
+        'mode': config.get('VISUALIZER', 'off'),
+        'bars': int(config.get('VISUALIZER_BARS', 48)),
+        'box': list(box),
+        'color': config.get('VISUALIZER_COLOR', '#ffffff'),
+        'opacity': float(config.get('VISUALIZER_OPACITY', 0.8)),
+    }
+
+
+def band_edges(bars, window, sample_rate):
+    """
+    FFT bin edges of log-spaced bands, at least one bin wide each.
+
+    When the window has fewer bins above MIN_FREQUENCY than bars, there
+    are only as many bands as bins.
+
+    Returns:
+        np.ndarray: Strictly increasing bin indices, one more than the number of bands
+    """
+    limit = window // 2 + 1
+    first = min(max(1, int(round(MIN_FREQUENCY * window / sample_rate))), limit - 1)
+    bars = max(1, min(bars, limit - first))
+    top = min(MAX_FREQUENCY, sample_rate / 2)
+    frequencies = np.geomspace(MIN_FREQUENCY, top, bars + 1)
+    edges = np.round(frequencies * window / sample_rate).astype(np.int64)
+    steps = np.arange(bars + 1)
+    # Push edges up so every band gets a bin, then down so the last ones fit below limit
+    edges = np.maximum.accumulate(np.maximum(edges, first) - steps) + steps
+    return np.minimum(edges, limit - bars + steps)
+
+
+def spectrum_bars(chunks, sample_rate, fps, bars):
+    """
+    Compute the magnitude of log-spaced frequency bands for every output frame.
+
+    Each frame is a Hann-windowed FFT starting at the frame's first sample.
+    The windows of a whole chunk are gathered into one 2-D array and
+    transformed together.
+
+    Args:
+        chunks: Iterable of mono float32 sample arrays
+        sample_rate: Sample rate of the chunks
+        fps: Output frame rate
+        bars: Number of bands
+
+    Returns:
+        np.ndarray: Band levels in dBFS, shape (frames, bands), float32; fewer
+        bands than bars when the window is too short for them (see band_edges)
+    """
+    hop = sample_rate / fps
+    window = 1 << int(np.ceil(np.log2(2 * hop)))
+    taper = np.hanning(window).astype(np.float32)
+    # A full-scale sine in one bin reads as 0 dB
+    scale = 2.0 / taper.sum()
+    edges = band_edges(bars, window, sample_rate)
+    widths = np.diff(edges).astype(np.float32)
+    offsets = np.arange(window)
+
+    results = []
+    carry = np.empty(0, dtype=np.float32)
+    consumed = 0
+    frame = 0
+
+    def transform(data, first, last):
+        starts = (np.arange(first, last, dtype=np.int64) * sample_rate) // fps - consumed
+        windows = data[starts[:, None] + offsets] * taper
+        magnitude = np.abs(np.fft.rfft(windows, axis=1)).astype(np.float32) * scale
+        power = np.add.reduceat(magnitude[:, :edges[-1]] ** 2, edges[:-1], axis=1) / widths
+        return 10 * np.log10(np.maximum(power, 1e-12))
+
+    for chunk in chunks:
+        data = np.concatenate([carry, chunk]) if len(carry) else chunk
+        end = consumed + len(data)
+        # Frames whose whole window is available
+        last = int(((end - window) * fps) // sample_rate) + 1 if end >= window else 0
+        if last > frame:
+            results.append(transform(data, frame, last))
+            frame = last
+        cut = int((frame * sample_rate) // fps) - consumed
+        carry = data[cut:]
+        consumed += cut
+
+    # Frames near the end are padded with silence
+    total = int(np.ceil((consumed + len(carry)) * fps / sample_rate))
+    if total > frame:
+        padded = np.concatenate([carry, np.zeros(window, dtype=np.float32)])
+        results.append(transform(padded, frame, total))
+    if not results:
+        return np.empty((0, len(edges) - 1), dtype=np.float32)
+    return np.concatenate(results).astype(np.float32)
+
+
+def to_levels(db):
+    """Map dBFS values to 0-255 bar heights."""
+    levels = (db - FLOOR_DB) / (CEILING_DB - FLOOR_DB)
+    return np.round(np.clip(levels, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def load_visualizer_data(audio_path, fps, style, cache_dir):
+    """
+    Get the per-frame visualizer data of an audio file, computing it only once.
+
+    Spectrum data is cached in cache_dir/visualizer, keyed by the audio
+    file, frame rate and number of bars. Waveform data comes from the
+    cached loudness envelope.
+
+    Returns:
+        np.ndarray: uint8 levels, shape (frames, bars) for spectrum or (frames,) for waveform
+    """
+    if style['mode'] == 'waveform':
+        return to_levels(load_envelope(audio_path, fps, cache_dir))
+
+    key = RenderCache.make_key(file_fingerprint(audio_path), 'spectrum', fps, style['bars'])
+    cache_path = os.path.join(cache_dir, 'visualizer', f"{key}.npy")
+    if os.path.exists(cache_path):
+        try:
+            return np.load(cache_path)
+        except (OSError, ValueError):
+            pass
+
+    logger.info(f"Computing {style['bars']}-band spectrum of {audio_path} at {fps} fps")
+    chunks, rate, _ = open_samples(audio_path)
+    db = spectrum_bars(chunks, rate, fps, style['bars'])
+    if db.shape[1] < style['bars']:
+        logger.warning(f"Only {db.shape[1]} spectrum bands fit the analysis window at {fps} fps, "
+                       f"drawing {db.shape[1]} bars instead of {style['bars']}")
+    # Light smoothing over three frames keeps the bars from flickering
+    if len(db) > 2:
+        db[1:-1] = (db[:-2] + 2 * db[1:-1] + db[2:]) / 4
+    levels = to_levels(db)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+    np.save(temp_path, levels)
+    os.replace(temp_path, cache_path)
+    return levels
+
+
+def output_order(levels, segments, fps):
+    """
+    Reorder per-audio-frame data to follow the output timeline.
+
+    Output frames of every segment take the data of the audio they play,
+    so the bars match the muxed audio even when segments skip or repeat
+    parts of the recording.
+
+    Args:
+        levels: Data of every audio frame
+        segments: Compacted segment dictionaries in output order (audio times)
+        fps: Frame rate of the data
+
+    Returns:
+        np.ndarray: Data of every output frame
+    """
+    segments = [s for s in segments if s['end'] - s['start'] > 0]
+    counts = segment_frame_counts(segments, fps)
+    index = np.concatenate([
+        int(round(segment['start'] * fps)) + np.arange(frames, dtype=np.int64)
+        for segment, frames in zip(segments, counts)
+    ] or [np.empty(0, dtype=np.int64)])
+    if not len(levels):
+        return np.zeros((len(index),) + levels.shape[1:], dtype=np.uint8)
+    return levels[np.clip(index, 0, len(levels) - 1)]
+
+
+class VisualizerLayer:
+    def __init__(self, levels, fps, style, first_frame=0):
+        """
+        Draw audio bars from precomputed per-frame levels.
+
+        Spectrum mode shows one bar per band, bottom-aligned; waveform mode
+        scrolls the loudness of the most recent frames, mirrored around the
+        middle. Drawing reads one row of the level array and fills a
+        boolean mask of the bar area, so no audio is touched while encoding.
+
+        Args:
+            levels: uint8 levels in output frame order (see output_order)
+            fps: Frame rate of the levels
+            style: Visualizer settings (see visualizer_style)
+            first_frame: Output frame of levels[0]; negative when the levels
+                start with waveform history before the frames being drawn
+        """
+        self.levels = levels
+        self.fps = fps
+        self.first_frame = first_frame
+        self.style = dict(style)
+        if levels.ndim == 2:
+            # Fewer bands than requested when the analysis window is short (see band_edges)
+            self.style['bars'] = levels.shape[1]
+        self.color = np.array(parse_color(style['color']), dtype=np.uint16)
+        self.alpha = int(round(np.clip(style['opacity'], 0.0, 1.0) * 255))
+        self.geometry = {}
+
+    def _geometry(self, width, height):
+        """Bar area and the bar index of each pixel column, per frame size."""
+        if (width, height) not in self.geometry:
+            x, y, box_width, box_height = self.style['box']
+            left, top = int(x * width), int(y * height)
+            box_width = max(1, min(int(box_width * width), width - left))
+            box_height = max(2, min(int(box_height * height), height - top))
+            bars = self.style['bars']
+            # Bars fill 70% of their slot; -1 marks the gaps between bars
+            position = np.arange(box_width) * bars / box_width
+            column_bars = np.where(position % 1 < 0.7, position.astype(np.int64), -1)
+            rows = np.arange(box_height)[:, None]
+            self.geometry[(width, height)] = (left, top, box_width, box_height, column_bars, rows)
+        return self.geometry[(width, height)]
+
+    def between(self, first_frame, last_frame):
+        """
+        Return the levels needed to draw output frames [first_frame, last_frame).
+
+        Returns:
+            tuple: (levels, first frame relative to first_frame), as accepted by the constructor
+        """
+        history = min(first_frame, self.style['bars'] - 1) if self.levels.ndim == 1 else 0
+        start = first_frame - self.first_frame - history
+        return self.levels[max(0, start):max(0, last_frame - self.first_frame)], -history
+
+    def heights(self, frame_index):
+        """Level (0-255) of every bar at an output frame."""
+        bars = self.style['bars']
+        index = min(frame_index - self.first_frame, len(self.levels) - 1)
+        if self.levels.ndim == 2:
+            return self.levels[index]
+        history = self.levels[max(0, index - bars + 1):index + 1]
+        return np.concatenate([np.zeros(bars - len(history), dtype=np.uint8), history])
+
+    def apply(self, frame, t, out=None):
+        """
+        Draw the bars of time t into a frame.
+
+        Like SubtitleLayer.apply, source frames are copied into out (or a
+        new array) before drawing.
+
+        Returns:
+            np.ndarray: The frame with its bars
+        """
+        frame_index = int(t * self.fps + 1e-6)
+        if not len(self.levels) or frame_index < self.first_frame:
+            return frame
+        levels = self.heights(frame_index)
+        if not levels.any():
+            return frame
+
+        if frame is not out:
+            if out is None:
+                out = np.array(frame[:, :, :3])
+            else:
+                np.copyto(out, frame[:, :, :3])
+
+        height, width = out.shape[:2]
+        left, top, box_width, box_height, column_bars, rows = self._geometry(width, height)
+        bar_heights = (levels.astype(np.int64) * box_height) // 255
+        column_heights = np.where(column_bars >= 0, bar_heights[np.maximum(column_bars, 0)], 0)
+        if self.style['mode'] == 'waveform':
+            middle = box_height // 2
+            mask = np.abs(rows - middle) * 2 < column_heights[None, :]
+        else:
+            mask = rows >= box_height - column_heights[None, :]
+
+        region = out[top:top + box_height, left:left + box_width]
+        if self.alpha >= 255:
+            region[mask] = self.color
+        else:
+            pixels = region[mask].astype(np.uint16)
+            region[mask] = (pixels * (255 - self.alpha) + self.color * self.alpha + 127) // 255
+        return out